@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+'''
+archive module of documents
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+from struct import pack, unpack
+from zipfile import ZipFile, ZipInfo, ZIP_STORED, ZIP_DEFLATED, is_zipfile
+import zlib
+try:
+    from zipfile import BadZipFile
+except ImportError:
+    from zipfile import BadZipfile as BadZipFile
+
+from lucterios.documents.storage import CHUNK_SIZE, read_chunks
+from lucterios.documents.container import CODEC_STORED, CODEC_DEFLATED, get_container_header, iter_container, iter_payload
+
+LOCAL_HEADER_SIGNATURE = 0x04034b50
+CENTRAL_HEADER_SIGNATURE = 0x02014b50
+END_SIGNATURE = 0x06054b50
+ZIP64_END_SIGNATURE = 0x06064b50
+ZIP64_LOCATOR_SIGNATURE = 0x07064b50
+ZIP64_EXTRA_ID = 0x0001
+ZIP32_LIMIT = 0xFFFFFFFF
+ZIP32_COUNT_LIMIT = 0xFFFF
+LOCAL_HEADER_SIZE = 30
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+VERSION_DEFAULT = 20
+VERSION_ZIP64 = 45
+
+
+def read_raw_chunks(file_obj, size):
+    while size > 0:
+        chunk = file_obj.read(min(size, CHUNK_SIZE))
+        if len(chunk) == 0:
+            raise BadZipFile("Truncated member")
+        size -= len(chunk)
+        yield chunk
+
+
+def read_member_chunks(raw_file, info):
+    # data of a member as stored in the archive: its content only if it is not compressed
+    raw_file.seek(info.header_offset)
+    header = raw_file.read(LOCAL_HEADER_SIZE)
+    name_len, extra_len = unpack('<HH', header[26:30])
+    raw_file.seek(info.header_offset + LOCAL_HEADER_SIZE + name_len + extra_len)
+    return read_raw_chunks(raw_file, info.compress_size)
+
+
+def dos_date_time(date_time):
+    dosdate = (date_time[0] - 1980) << 9 | date_time[1] << 5 | date_time[2]
+    dostime = date_time[3] << 11 | date_time[4] << 5 | (date_time[5] // 2)
+    return dosdate, dostime
+
+
+class ZipStream(object):
+    """
+    Write a zip archive as a flow of bytes, without any seek on the output.
+    Members of existing archives are copied raw: no decompression nor recompression.
+    """
+
+    def __init__(self):
+        self.offset = 0
+        self.entries = []
+        self.names = set()
+
+    def _out(self, data):
+        self.offset += len(data)
+        return data
+
+    def _encode_name(self, arcname, flag_bits):
+        try:
+            filename = arcname.encode('ascii')
+            flag_bits &= ~FLAG_UTF8
+        except UnicodeEncodeError:
+            filename = arcname.encode('utf-8')
+            flag_bits |= FLAG_UTF8
+        return filename, flag_bits
+
+    def add_entry(self, arcname, info, data_chunks):
+        flag_bits = info.flag_bits & ~FLAG_DATA_DESCRIPTOR
+        filename, flag_bits = self._encode_name(arcname, flag_bits)
+        header_offset = self.offset
+        dosdate, dostime = dos_date_time(info.date_time)
+        zip64 = (info.file_size > ZIP32_LIMIT) or (info.compress_size > ZIP32_LIMIT)
+        if zip64:
+            extra = pack('<HHQQ', ZIP64_EXTRA_ID, 16, info.file_size, info.compress_size)
+            file_size = compress_size = ZIP32_LIMIT
+            version = VERSION_ZIP64
+        else:
+            extra = b''
+            file_size = info.file_size
+            compress_size = info.compress_size
+            version = VERSION_DEFAULT
+        yield self._out(pack('<IHHHHHIIIHH', LOCAL_HEADER_SIGNATURE, version, flag_bits, info.compress_type,
+                             dostime, dosdate, info.CRC, compress_size, file_size, len(filename), len(extra)) + filename + extra)
+        for chunk in data_chunks:
+            yield self._out(chunk)
+        self.entries.append((filename, flag_bits, info, dostime, dosdate, header_offset))
+
+    def copy_member(self, raw_file, info, arcname):
+        for chunk in self.add_entry(arcname, info, read_member_chunks(raw_file, info)):
+            yield chunk
+
+    def copy_archive(self, archive_path, prefix=''):
+        try:
+            src_zip = ZipFile(archive_path, 'r')
+        except (BadZipFile, IOError):
+            return
+        with src_zip:
+            with open(archive_path, 'rb') as raw_file:
+                for info in src_zip.infolist():
+                    arcname = prefix + info.filename
+                    if info.filename.endswith('/') or (arcname in self.names):
+                        continue
+                    self.names.add(arcname)
+                    for chunk in self.copy_member(raw_file, info, arcname):
+                        yield chunk
+
+    def copy_document(self, blob_path, prefix, filename, date_time):
+        """
+        Add a stored document, its payload copied raw when zip archives know its codec.
+        Older blobs: members of a zip are copied, a raw file is added as is.
+        """
+        header = get_container_header(blob_path)
+        if (header is None) and is_zipfile(blob_path):
+            for chunk in self.copy_archive(blob_path, prefix):
+                yield chunk
+            return
+        arcname = prefix + filename
+        if arcname in self.names:
+            return
+        self.names.add(arcname)
+        info = ZipInfo(arcname, date_time=date_time)
+        info.external_attr = 0o644 << 16
+        if header is None:
+            crc = 0
+            size = 0
+            with open(blob_path, 'rb') as raw_file:
+                for chunk in read_chunks(raw_file):
+                    crc = zlib.crc32(chunk, crc)
+                    size += len(chunk)
+            info.CRC = crc & 0xffffffff
+            info.file_size = info.compress_size = size
+            info.compress_type = ZIP_STORED
+            data_chunks = self._read_file(blob_path)
+        else:
+            info.CRC = header.crc
+            info.file_size = header.content_size
+            if header.codec in (CODEC_STORED, CODEC_DEFLATED):
+                info.compress_type = ZIP_DEFLATED if header.codec == CODEC_DEFLATED else ZIP_STORED
+                info.compress_size = header.payload_size
+                data_chunks = iter_payload(blob_path, header)
+            else:
+                info.compress_type = ZIP_STORED
+                info.compress_size = header.content_size
+                data_chunks = iter_container(blob_path)
+        for chunk in self.add_entry(arcname, info, data_chunks):
+            yield chunk
+
+    def _read_file(self, file_path):
+        with open(file_path, 'rb') as raw_file:
+            for chunk in read_chunks(raw_file):
+                yield chunk
+
+    def _central_header(self, filename, flag_bits, info, dostime, dosdate, header_offset):
+        zip64_fields = []
+        file_size = info.file_size
+        compress_size = info.compress_size
+        if file_size > ZIP32_LIMIT:
+            zip64_fields.append(file_size)
+            file_size = ZIP32_LIMIT
+        if compress_size > ZIP32_LIMIT:
+            zip64_fields.append(compress_size)
+            compress_size = ZIP32_LIMIT
+        if header_offset > ZIP32_LIMIT:
+            zip64_fields.append(header_offset)
+            header_offset = ZIP32_LIMIT
+        if len(zip64_fields) > 0:
+            extra = pack('<HH' + 'Q' * len(zip64_fields), ZIP64_EXTRA_ID, 8 * len(zip64_fields), *zip64_fields)
+            version = VERSION_ZIP64
+        else:
+            extra = b''
+            version = VERSION_DEFAULT
+        return pack('<IHHHHHHIIIHHHHHII', CENTRAL_HEADER_SIGNATURE, version, version, flag_bits, info.compress_type,
+                    dostime, dosdate, info.CRC, compress_size, file_size, len(filename), len(extra), 0, 0, 0,
+                    info.external_attr, header_offset) + filename + extra
+
+    def close(self):
+        central_offset = self.offset
+        for entry in self.entries:
+            yield self._out(self._central_header(*entry))
+        central_size = self.offset - central_offset
+        nb_entries = len(self.entries)
+        if (nb_entries > ZIP32_COUNT_LIMIT) or (central_offset > ZIP32_LIMIT) or (central_size > ZIP32_LIMIT):
+            zip64_end_offset = self.offset
+            yield self._out(pack('<IQHHIIQQQQ', ZIP64_END_SIGNATURE, 44, VERSION_ZIP64, VERSION_ZIP64, 0, 0,
+                                 nb_entries, nb_entries, central_size, central_offset))
+            yield self._out(pack('<IIQI', ZIP64_LOCATOR_SIGNATURE, 0, zip64_end_offset, 1))
+            nb_entries = min(nb_entries, ZIP32_COUNT_LIMIT)
+            central_size = min(central_size, ZIP32_LIMIT)
+            central_offset = min(central_offset, ZIP32_LIMIT)
+        yield self._out(pack('<IHHHHIIH', END_SIGNATURE, 0, 0, nb_entries, nb_entries, central_size, central_offset, 0))
+
+
+def iter_zip(sources):
+    # sources: (blob path, prefix, file name, date time) of stored documents
+    zip_stream = ZipStream()
+    for blob_path, prefix, filename, date_time in sources:
+        for chunk in zip_stream.copy_document(blob_path, prefix, filename, date_time):
+            yield chunk
+    for chunk in zip_stream.close():
+        yield chunk
+
+
+def write_zip(sources, file_path):
+    with open(file_path, 'wb') as zip_file:
+        for chunk in iter_zip(sources):
+            zip_file.write(chunk)
+
+
+def write_member(raw_file, info, arcname, file_path):
+    zip_stream = ZipStream()
+    with open(file_path, 'wb') as zip_file:
+        for chunk in zip_stream.copy_member(raw_file, info, arcname):
+            zip_file.write(chunk)
+        for chunk in zip_stream.close():
+            zip_file.write(chunk)
+
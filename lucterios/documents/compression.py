@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+'''
+compression module of documents
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+from shutil import copyfile
+from zipfile import ZipFile, is_zipfile
+import zlib
+
+from django.conf import settings
+
+from lucterios.documents.storage import read_chunks
+from lucterios.documents.container import CODEC_STORED, CODEC_DEFLATED, CODEC_BZIP2, CODEC_LZMA, write_container, \
+    get_container_header, iter_container, is_codec_available
+from lucterios.documents.content import MIME_HEADER_SIZE, guess_mimetype
+
+COMPRESSIONS = dict([(compression_name, codec) for compression_name, codec
+                     in (('store', CODEC_STORED), ('deflate', CODEC_DEFLATED), ('bzip2', CODEC_BZIP2), ('lzma', CODEC_LZMA))
+                     if is_codec_available(codec)])
+
+# (MIME type prefix, compression): the first matching prefix wins
+COMPRESSION_POLICY = (
+    ('image/jpeg', 'store'),
+    ('image/png', 'store'),
+    ('image/gif', 'store'),
+    ('image/webp', 'store'),
+    ('audio/', 'store'),
+    ('video/', 'store'),
+    ('application/pdf', 'store'),
+    ('application/zip', 'store'),
+    ('application/gzip', 'store'),
+    ('application/x-bzip2', 'store'),
+    ('application/x-xz', 'store'),
+    ('application/x-7z-compressed', 'store'),
+    ('application/x-rar-compressed', 'store'),
+    ('application/vnd.openxmlformats-officedocument.', 'store'),
+    ('application/vnd.oasis.opendocument.', 'store'),
+    ('', 'deflate'),
+)
+if hasattr(settings, 'DOCUMENTS_COMPRESSION_POLICY'):
+    COMPRESSION_POLICY = settings.DOCUMENTS_COMPRESSION_POLICY
+
+# a sample of the file is compressed first: not compressed further if it does not shrink enough
+COMPRESSION_SAMPLE_SIZE = 256 * 1024
+COMPRESSION_MIN_GAIN = 0.1
+
+
+def get_policy_compression(mimetype):
+    for mime_prefix, compression_name in COMPRESSION_POLICY:
+        if mimetype.startswith(mime_prefix):
+            return COMPRESSIONS.get(compression_name, CODEC_DEFLATED)
+    return CODEC_DEFLATED
+
+
+def choose_compression(file_path, filename, mimetype=None):
+    with open(file_path, 'rb') as file_read:
+        sample = file_read.read(COMPRESSION_SAMPLE_SIZE)
+    if mimetype is None:
+        mimetype = guess_mimetype(sample[:MIME_HEADER_SIZE], filename)
+    compression = get_policy_compression(mimetype)
+    if (compression != CODEC_STORED) and (len(zlib.compress(sample, 1)) > len(sample) * (1 - COMPRESSION_MIN_GAIN)):
+        compression = CODEC_STORED
+    return compression
+
+
+def get_stored_compression(blob_path):
+    # codec of a stored document, None if it is neither in a container nor in a zip
+    header = get_container_header(blob_path)
+    if header is not None:
+        return header.codec
+    if not is_zipfile(blob_path):
+        return None
+    with ZipFile(blob_path, 'r') as zip_ref:
+        infos = [info for info in zip_ref.infolist() if not info.filename.endswith('/')]
+        if len(infos) == 0:
+            return None
+        return infos[0].compress_type
+
+
+def extract_content(blob_path, file_path):
+    # content of a stored document in file_path
+    if get_container_header(blob_path) is not None:
+        with open(file_path, 'wb') as content_file:
+            for chunk in iter_container(blob_path):
+                content_file.write(chunk)
+        return
+    if is_zipfile(blob_path):
+        with ZipFile(blob_path, 'r') as zip_ref:
+            infos = [info for info in zip_ref.infolist() if not info.filename.endswith('/')]
+            if len(infos) > 0:
+                with zip_ref.open(infos[0], 'r') as member_file:
+                    with open(file_path, 'wb') as content_file:
+                        for chunk in read_chunks(member_file):
+                            content_file.write(chunk)
+                return
+    copyfile(blob_path, file_path)
+
+
+def write_compressed(file_path, filename, tmp_path, compression=None, mimetype=None):
+    """
+    Store a file in a container, compressed as the policy says for its type.
+    The file name is only used to guess the type, it is not stored.
+    """
+    if compression is None:
+        compression = choose_compression(file_path, filename, mimetype)
+    write_container(file_path, tmp_path, compression)
+    return compression
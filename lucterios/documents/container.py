@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+'''
+container module of documents
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+from collections import namedtuple
+from hashlib import sha256
+from struct import pack, unpack, calcsize
+import zlib
+
+# Container of a stored document:
+#   header: signature, format version, codec, flags, block size, content size, payload size,
+#           CRC-32 and SHA-256 of the content, length of a name - followed by the name (UTF-8)
+#           the name of a document is not stored: the same content always gives the same container
+#   payload: the content, cut in blocks compressed independently
+#   index: offset in the payload of each block, for random access
+CONTAINER_SIGNATURE = b'LDOC'
+CONTAINER_VERSION = 1
+HEADER_FORMAT = '<4sBBHIQQI32sH'
+HEADER_SIZE = calcsize(HEADER_FORMAT)
+INDEX_FORMAT = '<%dQ'
+BLOCK_SIZE = 1024 * 1024
+
+# codecs numbered as the compression methods of zip archives
+CODEC_STORED = 0
+CODEC_DEFLATED = 8
+CODEC_BZIP2 = 12
+CODEC_LZMA = 14
+
+ContainerHeader = namedtuple('ContainerHeader', ['version', 'codec', 'block_size', 'content_size', 'payload_size',
+                                                 'crc', 'checksum', 'name', 'payload_offset'])
+
+
+def get_block_codec(codec):
+    """
+    Functions (compress_block, finish, decompress_block) of a codec.
+    Deflate blocks end with a full flush: the whole payload is also one raw deflate stream, as in a zip member.
+    """
+    if codec == CODEC_STORED:
+        return (lambda data: data), (lambda: b''), (lambda data: data)
+    if codec == CODEC_DEFLATED:
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        return (lambda data: compressor.compress(data) + compressor.flush(zlib.Z_FULL_FLUSH)), \
+            (lambda: compressor.flush(zlib.Z_FINISH)), (lambda data: zlib.decompressobj(-15).decompress(data))
+    if codec == CODEC_BZIP2:
+        import bz2
+        return bz2.compress, (lambda: b''), bz2.decompress
+    if codec == CODEC_LZMA:
+        import lzma
+        return lzma.compress, (lambda: b''), lzma.decompress
+    raise ValueError("unknown codec %d" % codec)
+
+
+def is_codec_available(codec):
+    # bzip2 and lzma depend on optional modules of the Python build
+    try:
+        get_block_codec(codec)
+        return True
+    except (ImportError, ValueError):
+        return False
+
+
+def get_nb_blocks(header):
+    return (header.content_size + header.block_size - 1) // header.block_size
+
+
+def write_container(file_path, container_path, codec):
+    compress_block, finish, _decompress_block = get_block_codec(codec)
+    name = b''
+    block_offsets = []
+    content_size = 0
+    payload_size = 0
+    crc = 0
+    checksum = sha256()
+    with open(container_path, 'wb') as container_file:
+        container_file.write(b'\0' * (HEADER_SIZE + len(name)))
+        with open(file_path, 'rb') as content_file:
+            block = content_file.read(BLOCK_SIZE)
+            while len(block) > 0:
+                block_offsets.append(payload_size)
+                content_size += len(block)
+                crc = zlib.crc32(block, crc)
+                checksum.update(block)
+                data = compress_block(block)
+                container_file.write(data)
+                payload_size += len(data)
+                block = content_file.read(BLOCK_SIZE)
+        data = finish()
+        container_file.write(data)
+        payload_size += len(data)
+        container_file.write(pack(INDEX_FORMAT % len(block_offsets), *block_offsets))
+        # header written at the end, when sizes and checksums are known
+        container_file.seek(0)
+        container_file.write(pack(HEADER_FORMAT, CONTAINER_SIGNATURE, CONTAINER_VERSION, codec, 0, BLOCK_SIZE, content_size,
+                                  payload_size, crc & 0xffffffff, checksum.digest(), len(name)) + name)
+
+
+def read_header(container_file):
+    # None if the file is not a container
+    data = container_file.read(HEADER_SIZE)
+    if (len(data) < HEADER_SIZE) or (data[:len(CONTAINER_SIGNATURE)] != CONTAINER_SIGNATURE):
+        return None
+    _signature, version, codec, _flags, block_size, content_size, payload_size, crc, checksum, name_size = unpack(HEADER_FORMAT, data)
+    if version > CONTAINER_VERSION:
+        raise ValueError("container version %d not supported" % version)
+    name = container_file.read(name_size).decode('utf-8')
+    return ContainerHeader(version, codec, block_size, content_size, payload_size, crc, checksum, name, HEADER_SIZE + name_size)
+
+
+def get_container_header(file_path):
+    with open(file_path, 'rb') as container_file:
+        return read_header(container_file)
+
+
+def is_container(file_path):
+    with open(file_path, 'rb') as container_file:
+        return container_file.read(len(CONTAINER_SIGNATURE)) == CONTAINER_SIGNATURE
+
+
+def iter_container(file_path, start=0, length=None):
+    """
+    Content of a container, decompressed as a flow of bytes.
+    Only the blocks holding the range from start are read.
+    """
+    with open(file_path, 'rb') as container_file:
+        header = read_header(container_file)
+        if header is None:
+            raise ValueError("not a container")
+        if length is None:
+            length = header.content_size - start
+        length = min(length, header.content_size - start)
+        if header.codec == CODEC_STORED:
+            container_file.seek(header.payload_offset + start)
+            while length > 0:
+                data = container_file.read(min(length, BLOCK_SIZE))
+                if len(data) == 0:
+                    raise ValueError("truncated container")
+                length -= len(data)
+                yield data
+            return
+        _compress_block, _finish, decompress_block = get_block_codec(header.codec)
+        nb_blocks = get_nb_blocks(header)
+        container_file.seek(header.payload_offset + header.payload_size)
+        block_offsets = unpack(INDEX_FORMAT % nb_blocks, container_file.read(8 * nb_blocks)) + (header.payload_size,)
+        block_idx = start // header.block_size
+        skip = start - block_idx * header.block_size
+        while (length > 0) and (block_idx < nb_blocks):
+            container_file.seek(header.payload_offset + block_offsets[block_idx])
+            data = decompress_block(container_file.read(block_offsets[block_idx + 1] - block_offsets[block_idx]))[skip:skip + length]
+            skip = 0
+            length -= len(data)
+            block_idx += 1
+            yield data
+
+
+def read_container(file_path):
+    return b''.join(iter_container(file_path))
+
+
+def iter_payload(file_path, header):
+    # payload as stored: a zip member when the codec is stored or deflated
+    with open(file_path, 'rb') as container_file:
+        container_file.seek(header.payload_offset)
+        size = header.payload_size
+        while size > 0:
+            data = container_file.read(min(size, BLOCK_SIZE))
+            if len(data) == 0:
+                raise ValueError("truncated container")
+            size -= len(data)
+            yield data
+
+
+def check_container(file_path):
+    # content decompressed and checked against the checksums of the header
+    header = get_container_header(file_path)
+    if header is None:
+        return False
+    crc = 0
+    checksum = sha256()
+    size = 0
+    for data in iter_container(file_path):
+        crc = zlib.crc32(data, crc)
+        checksum.update(data)
+        size += len(data)
+    return (size == header.content_size) and ((crc & 0xffffffff) == header.crc) and (checksum.digest() == header.checksum)
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+'''
+content module of documents
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+from os.path import splitext, isfile, getsize
+from zipfile import ZipFile, is_zipfile
+from unicodedata import normalize, category
+from collections import Counter
+from io import BytesIO
+from time import time
+from multiprocessing import Pool, TimeoutError
+from mimetypes import guess_type
+from difflib import unified_diff
+from itertools import islice
+import re
+
+from django.conf import settings
+from django.utils import six
+
+from lucterios.documents.storage import FORMAT_RAW, FORMAT_ZIP, FORMAT_CONTAINER
+from lucterios.documents.container import get_container_header, iter_container
+
+WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+WORD_MIN_LENGTH = 2
+WORD_MAX_LENGTH = 50
+
+XML_TAG_PATTERN = re.compile(r'<[^>]*>')
+
+TEXT_EXTENSIONS = ('.txt', '.csv', '.tsv', '.md', '.rst', '.log', '.ini', '.cfg', '.conf',
+                   '.json', '.yml', '.yaml', '.sql', '.py', '.js', '.css')
+MARKUP_EXTENSIONS = ('.htm', '.html', '.xml', '.svg')
+OFFICE_PARTS = {
+    '.docx': ('word/document.xml',),
+    '.xlsx': ('xl/sharedStrings.xml',),
+    '.pptx': ('ppt/slides/slide',),
+    '.odt': ('content.xml',),
+    '.ods': ('content.xml',),
+    '.odp': ('content.xml',),
+}
+MIME_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+    (b'%PDF-', 'application/pdf'),
+    (b'\x1f\x8b', 'application/gzip'),
+)
+MIME_HEADER_SIZE = 16
+DEFAULT_MIMETYPE = 'application/octet-stream'
+
+EXTRACTABLE_EXTENSIONS = TEXT_EXTENSIONS + MARKUP_EXTENSIONS + tuple(OFFICE_PARTS.keys())
+
+TEXT_MAX_SIZE = 1024 * 1024  # 1Mo of text by document
+if hasattr(settings, 'DOCUMENTS_TEXT_MAX_SIZE'):
+    TEXT_MAX_SIZE = settings.DOCUMENTS_TEXT_MAX_SIZE
+
+EXTRACT_MAX_FILE_SIZE = 50 * 1024 * 1024  # 50Mo
+if hasattr(settings, 'DOCUMENTS_EXTRACT_MAX_FILE_SIZE'):
+    EXTRACT_MAX_FILE_SIZE = settings.DOCUMENTS_EXTRACT_MAX_FILE_SIZE
+
+EXTRACT_PROCESSES = 2
+if hasattr(settings, 'DOCUMENTS_EXTRACT_PROCESSES'):
+    EXTRACT_PROCESSES = settings.DOCUMENTS_EXTRACT_PROCESSES
+
+EXTRACT_TIMEOUT = 30  # seconds by file
+if hasattr(settings, 'DOCUMENTS_EXTRACT_TIMEOUT'):
+    EXTRACT_TIMEOUT = settings.DOCUMENTS_EXTRACT_TIMEOUT
+
+DIFF_MAX_LINES = 500
+if hasattr(settings, 'DOCUMENTS_DIFF_MAX_LINES'):
+    DIFF_MAX_LINES = settings.DOCUMENTS_DIFF_MAX_LINES
+
+DIFF_MAX_FILE_SIZE = 10 * 1024 * 1024  # 10Mo, bigger versions are not compared
+if hasattr(settings, 'DOCUMENTS_DIFF_MAX_FILE_SIZE'):
+    DIFF_MAX_FILE_SIZE = settings.DOCUMENTS_DIFF_MAX_FILE_SIZE
+
+SEARCH_MAX_RESULTS = 200  # ids and ranks of results must stay under the 999 variables of a SQLite query
+if hasattr(settings, 'DOCUMENTS_SEARCH_MAX_RESULTS'):
+    SEARCH_MAX_RESULTS = settings.DOCUMENTS_SEARCH_MAX_RESULTS
+
+
+def normalize_word(word):
+    word = normalize('NFKD', word.lower())
+    return ''.join([char for char in word if category(char) != 'Mn'])
+
+
+def get_words(text):
+    for match in WORD_PATTERN.finditer(text):
+        word = normalize_word(match.group(0))
+        if WORD_MIN_LENGTH <= len(word) <= WORD_MAX_LENGTH:
+            yield word
+
+
+def count_words(text):
+    return Counter(get_words(text))
+
+
+def get_extension(filename):
+    return splitext(filename)[1].lower()
+
+
+def guess_mimetype(header, filename):
+    for signature, mimetype in MIME_SIGNATURES:
+        if header.startswith(signature):
+            return mimetype
+    mimetype = guess_type(filename)[0]
+    if mimetype is None:
+        mimetype = DEFAULT_MIMETYPE
+    return mimetype
+
+
+def describe_file(blob_path, filename):
+    """
+    Storage format and MIME type of a stored document, as (storage_format, mimetype).
+    Only the header of the file is read, from its container or its first member if it is stored in a zip.
+    """
+    storage_format = FORMAT_RAW
+    header = b''
+    try:
+        container_header = get_container_header(blob_path)
+        if container_header is not None:
+            storage_format = FORMAT_CONTAINER
+            header = b''.join(iter_container(blob_path, 0, MIME_HEADER_SIZE))
+        elif is_zipfile(blob_path):
+            storage_format = FORMAT_ZIP
+            with ZipFile(blob_path, 'r') as zip_ref:
+                infos = [info for info in zip_ref.infolist() if not info.filename.endswith('/')]
+                if len(infos) > 0:
+                    filename = infos[0].filename
+                    with zip_ref.open(infos[0]) as member_file:
+                        header = member_file.read(MIME_HEADER_SIZE)
+        else:
+            with open(blob_path, 'rb') as blob_file:
+                header = blob_file.read(MIME_HEADER_SIZE)
+    except Exception:
+        pass
+    return storage_format, guess_mimetype(header, filename)
+
+
+def decode_text(content):
+    for cut_size in range(4):  # a truncated content can end in the middle of an UTF-8 character
+        try:
+            return content[:len(content) - cut_size].decode('utf-8')
+        except UnicodeDecodeError:
+            pass
+    return content.decode('latin-1')
+
+
+def markup_to_text(content):
+    return unescape_entities(XML_TAG_PATTERN.sub(' ', decode_text(content)))
+
+
+def unescape_entities(text):
+    for entity, char in (('&lt;', '<'), ('&gt;', '>'), ('&quot;', '"'), ('&apos;', "'"), ('&nbsp;', ' '), ('&amp;', '&')):
+        text = text.replace(entity, char)
+    return text
+
+
+def office_to_text(content, part_prefixes, max_size):
+    texts = []
+    with ZipFile(BytesIO(content), 'r') as office_zip:
+        for part_name in sorted(office_zip.namelist()):
+            if part_name.startswith(part_prefixes) and part_name.endswith('.xml'):
+                texts.append(markup_to_text(office_zip.read(part_name)[:max_size]))
+    return ' '.join(texts)
+
+
+def read_content(blob_path, filename, max_file_size):
+    container_header = get_container_header(blob_path)
+    if container_header is not None:
+        if get_extension(filename) not in EXTRACTABLE_EXTENSIONS:
+            return filename, None
+        if container_header.content_size > max_file_size:
+            raise ValueError("file too big")
+        return filename, b''.join(iter_container(blob_path, 0, max_file_size))
+    if is_zipfile(blob_path):
+        with ZipFile(blob_path, 'r') as zip_ref:
+            infos = [info for info in zip_ref.infolist() if not info.filename.endswith('/')]
+            if len(infos) == 0:
+                return filename, None
+            filename = infos[0].filename
+            if get_extension(filename) not in EXTRACTABLE_EXTENSIONS:
+                return filename, None
+            if infos[0].file_size > max_file_size:
+                raise ValueError("file too big")
+            with zip_ref.open(infos[0]) as member_file:
+                return filename, member_file.read(max_file_size)
+    if get_extension(filename) not in EXTRACTABLE_EXTENSIONS:
+        return filename, None
+    if getsize(blob_path) > max_file_size:
+        raise ValueError("file too big")
+    with open(blob_path, 'rb') as blob_file:
+        return filename, blob_file.read(max_file_size)
+
+
+def extract_text(blob_path, filename, max_file_size=EXTRACT_MAX_FILE_SIZE, max_text_size=TEXT_MAX_SIZE):
+    """
+    Plain text of a stored document, as (text, error).
+    Run in a worker process: file system only, no database access.
+    """
+    try:
+        if (blob_path is None) or not isfile(blob_path):
+            return '', "file not found"
+        filename, content = read_content(blob_path, filename, max_file_size)
+        if content is None:
+            return '', ''
+        return content_to_text(content, filename, max_text_size), ''
+    except Exception as err:
+        return '', six.text_type(err)
+
+
+def content_to_text(content, filename, max_text_size=TEXT_MAX_SIZE):
+    extension = get_extension(filename)
+    if extension in OFFICE_PARTS:
+        text = office_to_text(content, OFFICE_PARTS[extension], max_text_size)
+    elif extension in MARKUP_EXTENSIONS:
+        text = markup_to_text(content[:max_text_size])
+    else:
+        text = decode_text(content[:max_text_size])
+    return text[:max_text_size]
+
+
+def diff_texts(old_text, new_text, old_name, new_name, max_lines=DIFF_MAX_LINES):
+    diff_lines = list(islice(unified_diff(old_text.splitlines(), new_text.splitlines(), old_name, new_name, n=2, lineterm=''), max_lines + 1))
+    if len(diff_lines) > max_lines:
+        diff_lines = diff_lines[:max_lines] + ['...']
+    return diff_lines
+
+
+def extract_batches(tasks, processes=EXTRACT_PROCESSES, timeout=EXTRACT_TIMEOUT):
+    """
+    Extract texts of (key, blob_path, filename) tasks in a pool of processes.
+    Yield results as lists of (key, text, error): one file by process and by batch,
+    so each file has its own timeout and a stuck process is replaced.
+    """
+    pool = Pool(processes)
+    try:
+        batch = []
+        for task in tasks:
+            batch.append(task)
+            if len(batch) == processes:
+                results, timed_out = _extract_batch(pool, batch, timeout)
+                if timed_out:
+                    pool.terminate()
+                    pool.join()
+                    pool = Pool(processes)
+                yield results
+                batch = []
+        if len(batch) > 0:
+            yield _extract_batch(pool, batch, timeout)[0]
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _extract_batch(pool, batch, timeout):
+    deadline = time() + timeout
+    async_results = [pool.apply_async(extract_text, (blob_path, filename)) for _key, blob_path, filename in batch]
+    results = []
+    timed_out = False
+    for (key, _blob_path, _filename), async_result in zip(batch, async_results):
+        try:
+            text, error = async_result.get(max(deadline - time(), 0))
+        except TimeoutError:
+            text, error = '', "timeout"
+            timed_out = True
+        results.append((key, text, error))
+    return results, timed_out
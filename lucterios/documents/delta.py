@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+'''
+delta module of documents
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+from io import BytesIO
+from struct import pack, unpack
+import zlib
+
+from django.conf import settings
+
+DELTA_SIGNATURE = b'LDD1'
+CHUNK_MAX_SIZE = 4096
+OP_COPY = b'C'
+OP_INSERT = b'I'
+
+VERSION_SNAPSHOT_INTERVAL = 10  # one version in 10 kept whole, so at most 9 deltas to apply
+if hasattr(settings, 'DOCUMENTS_VERSION_SNAPSHOT_INTERVAL'):
+    VERSION_SNAPSHOT_INTERVAL = settings.DOCUMENTS_VERSION_SNAPSHOT_INTERVAL
+
+DELTA_MAX_FILE_SIZE = 64 * 1024 * 1024  # 64Mo, bigger versions are kept whole
+if hasattr(settings, 'DOCUMENTS_DELTA_MAX_FILE_SIZE'):
+    DELTA_MAX_FILE_SIZE = settings.DOCUMENTS_DELTA_MAX_FILE_SIZE
+
+DELTA_MAX_RATIO = 0.5  # a delta bigger than half of the version is not worth it
+
+
+def split_chunks(content):
+    """
+    Cut a content after each new line, long lines in pieces of CHUNK_MAX_SIZE.
+    Boundaries depend on the content only, so an insertion changes the chunks around it only.
+    For binary data, a new line byte appears every 256 bytes in average.
+    """
+    chunks = []
+    for line in BytesIO(content):
+        for index in range(0, len(line), CHUNK_MAX_SIZE):
+            chunks.append(line[index:index + CHUNK_MAX_SIZE])
+    return chunks
+
+
+def make_delta(base, target):
+    """
+    Binary delta rebuilding target from base: list of copies from base and inserted bytes, compressed.
+    """
+    offsets = {}
+    offset = 0
+    for chunk in split_chunks(base):
+        offsets.setdefault(chunk, offset)
+        offset += len(chunk)
+    operations = []
+    copy = None
+    inserted = []
+    for chunk in split_chunks(target):
+        chunk_offset = offsets.get(chunk)
+        if chunk_offset is None:
+            if copy is not None:
+                operations.append(OP_COPY + pack('<QI', *copy))
+                copy = None
+            inserted.append(chunk)
+            continue
+        if len(inserted) > 0:
+            data = b''.join(inserted)
+            operations.append(OP_INSERT + pack('<I', len(data)) + data)
+            inserted = []
+        if (copy is not None) and (copy[0] + copy[1] == chunk_offset):
+            copy = (copy[0], copy[1] + len(chunk))
+        else:
+            if copy is not None:
+                operations.append(OP_COPY + pack('<QI', *copy))
+            copy = (chunk_offset, len(chunk))
+    if copy is not None:
+        operations.append(OP_COPY + pack('<QI', *copy))
+    if len(inserted) > 0:
+        data = b''.join(inserted)
+        operations.append(OP_INSERT + pack('<I', len(data)) + data)
+    return DELTA_SIGNATURE + zlib.compress(b''.join(operations))
+
+
+def apply_delta(base, delta):
+    if delta[:len(DELTA_SIGNATURE)] != DELTA_SIGNATURE:
+        raise ValueError("invalid delta")
+    operations = zlib.decompress(delta[len(DELTA_SIGNATURE):])
+    target = []
+    index = 0
+    while index < len(operations):
+        operation = operations[index:index + 1]
+        if operation == OP_COPY:
+            offset, length = unpack('<QI', operations[index + 1:index + 13])
+            target.append(base[offset:offset + length])
+            index += 13
+        elif operation == OP_INSERT:
+            length = unpack('<I', operations[index + 1:index + 5])[0]
+            target.append(operations[index + 5:index + 5 + length])
+            index += 5 + length
+        else:
+            raise ValueError("invalid delta")
+    return b''.join(target)
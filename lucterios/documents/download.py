@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+'''
+download module of documents
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+from os import sep, rename, unlink, utime
+from os.path import getsize, relpath, isfile, join
+from binascii import hexlify
+from logging import getLogger
+from zipfile import ZipFile
+import re
+
+from django.conf import settings
+from django.http.response import HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe
+
+from lucterios.framework.filetools import get_user_dir, get_user_path
+from lucterios.documents.storage import CHUNK_SIZE, DOCUMENTS_DIR, DOWNLOAD_DIR, get_tmp_blob_path, evict_cached_files
+from lucterios.documents.container import get_container_header, iter_container
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+MODE_STREAM = 'stream'  # file sent by Django
+MODE_SENDFILE = 'sendfile'  # file sent by Apache or lighttpd, from its path in a 'X-Sendfile' header
+MODE_ACCEL = 'accel'  # file sent by nginx, from an internal location in a 'X-Accel-Redirect' header
+
+DOWNLOAD_MODE = MODE_STREAM
+if hasattr(settings, 'DOCUMENTS_DOWNLOAD_MODE'):
+    DOWNLOAD_MODE = settings.DOCUMENTS_DOWNLOAD_MODE
+
+# internal location of nginx aliasing the user directory
+ACCEL_LOCATION = '/protected/'
+if hasattr(settings, 'DOCUMENTS_ACCEL_LOCATION'):
+    ACCEL_LOCATION = settings.DOCUMENTS_ACCEL_LOCATION
+
+# decompressed copies of containers, served by the front web server
+DOWNLOAD_CACHE_SIZE = 2 * 1024 * 1024 * 1024  # 2Go
+if hasattr(settings, 'DOCUMENTS_DOWNLOAD_CACHE_SIZE'):
+    DOWNLOAD_CACHE_SIZE = settings.DOCUMENTS_DOWNLOAD_CACHE_SIZE
+
+
+def parse_range(range_header, size):
+    """
+    Byte range asked by a 'Range' header, as (start, end) with end included.
+    None for a missing, malformed or multiple range (the whole file is sent),
+    (None, None) for a range out of the file.
+    """
+    if (range_header is None) or (size == 0):
+        return None
+    range_match = RANGE_PATTERN.match(range_header.strip())
+    if range_match is None:
+        return None
+    start, end = range_match.groups()
+    if start == '':
+        if end == '':
+            return None
+        # suffix range: last bytes of the file
+        start = max(size - int(end), 0)
+        end = size - 1
+    else:
+        start = int(start)
+        if end == '':
+            end = size - 1
+        else:
+            end = min(int(end), size - 1)
+    if (start > end) or (start >= size):
+        return None, None
+    return start, end
+
+
+def match_etag(etag_header, etag):
+    if etag_header is None:
+        return False
+    for header_etag in etag_header.split(','):
+        header_etag = header_etag.strip()
+        if header_etag.startswith('W/'):
+            header_etag = header_etag[2:]
+        if (header_etag == '*') or (header_etag.strip('"') == etag):
+            return True
+    return False
+
+
+def is_not_modified(request, etag, last_modified):
+    if 'HTTP_IF_NONE_MATCH' in request.META:
+        # If-Modified-Since is ignored when If-None-Match is sent
+        return match_etag(request.META['HTTP_IF_NONE_MATCH'], etag)
+    modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return (modified_since is not None) and (last_modified <= modified_since)
+
+
+def is_range_valid(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is None:
+        return True
+    if_range_date = parse_http_date_safe(if_range)
+    if if_range_date is not None:
+        return last_modified <= if_range_date
+    return match_etag(if_range, etag)
+
+
+def read_file_range(file_path, start, length):
+    with open(file_path, 'rb') as file_read:
+        file_read.seek(start)
+        while length > 0:
+            chunk = file_read.read(min(length, CHUNK_SIZE))
+            if len(chunk) == 0:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def get_offload_path(file_path, container_header, cache_size=None):
+    """
+    File to send by the front web server: a container is decompressed once in the download cache.
+    None if its content does not fit in the cache: it must be streamed.
+    """
+    if container_header is None:
+        return file_path
+    if cache_size is None:
+        cache_size = DOWNLOAD_CACHE_SIZE
+    if container_header.content_size > cache_size:
+        getLogger('lucterios.documents').info("%s streamed: bigger than the download cache", file_path)
+        return None
+    cache_path = get_user_path(join(DOCUMENTS_DIR, DOWNLOAD_DIR), hexlify(container_header.checksum).decode('ascii'))
+    if isfile(cache_path):
+        utime(cache_path, None)
+        return cache_path
+    # written out of the cache directory: never evicted before complete
+    tmp_path = get_tmp_blob_path()
+    try:
+        with open(tmp_path, 'wb') as tmp_file:
+            for chunk in iter_container(file_path):
+                tmp_file.write(chunk)
+        rename(tmp_path, cache_path)
+    finally:
+        if isfile(tmp_path):
+            unlink(tmp_path)
+    evict_cached_files(join(get_user_dir(), DOCUMENTS_DIR, DOWNLOAD_DIR), cache_size)
+    return cache_path
+
+
+def get_member_info(file_path):
+    # first member of a zip archive: a document stored by an older version
+    with ZipFile(file_path, 'r') as zip_ref:
+        infos = [info for info in zip_ref.infolist() if not info.filename.endswith('/')]
+    return infos[0] if len(infos) > 0 else None
+
+
+def read_member_range(file_path, start, length):
+    # decompressed from the start of the member: the bytes before start are read and skipped
+    info = get_member_info(file_path)
+    if info is None:
+        return
+    with ZipFile(file_path, 'r') as zip_ref:
+        with zip_ref.open(info, 'r') as member_file:
+            while start > 0:
+                chunk = member_file.read(min(start, CHUNK_SIZE))
+                if len(chunk) == 0:
+                    return
+                start -= len(chunk)
+            while length > 0:
+                chunk = member_file.read(min(length, CHUNK_SIZE))
+                if len(chunk) == 0:
+                    break
+                length -= len(chunk)
+                yield chunk
+
+
+def offload_response(file_path, content_type, mode):
+    # the front web server reads the file and handles the byte ranges
+    response = HttpResponse(content_type=content_type)
+    if mode == MODE_SENDFILE:
+        response['X-Sendfile'] = file_path
+    else:
+        response['X-Accel-Redirect'] = ACCEL_LOCATION.rstrip('/') + '/' + relpath(file_path, get_user_dir()).replace(sep, '/')
+    return response
+
+
+def file_response(request, file_path, content_type, filename, etag, last_modified, mode=None, attachment=True, member=False):
+    """
+    Send a file, with conditional GET and a single byte range supported.
+    etag: identifier of the file content, last_modified: timestamp of its last change
+    mode: stream the file or offload it to the front web server, DOWNLOAD_MODE by default
+    attachment: saved by the browser, else displayed
+    member: the file is a zip archive of older versions, only its first member is sent, always streamed
+    The content of a container is sent decompressed: streamed from its blocks, which give the byte ranges,
+    or offloaded from its copy in the download cache.
+    """
+    if mode is None:
+        mode = DOWNLOAD_MODE
+    container_header = get_container_header(file_path)
+    if member:
+        mode = MODE_STREAM
+        info = get_member_info(file_path)
+        size = info.file_size if info is not None else 0
+        read_range = read_member_range
+    elif container_header is not None:
+        size = container_header.content_size
+        read_range = iter_container
+    else:
+        size = getsize(file_path)
+        read_range = read_file_range
+    not_modified = is_not_modified(request, etag, last_modified)
+    offload_path = None
+    if (mode in (MODE_SENDFILE, MODE_ACCEL)) and not not_modified:
+        offload_path = get_offload_path(file_path, container_header)
+    if not_modified:
+        response = HttpResponse(status=304)
+    elif offload_path is not None:
+        response = offload_response(offload_path, content_type, mode)
+    else:
+        byte_range = None
+        if is_range_valid(request, etag, last_modified):
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        if byte_range is None:
+            response = StreamingHttpResponse(read_range(file_path, 0, size), content_type=content_type)
+            response['Content-Length'] = size
+        elif byte_range == (None, None):
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+        else:
+            start, end = byte_range
+            response = StreamingHttpResponse(read_range(file_path, start, end - start + 1), content_type=content_type, status=206)
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+    if response.status_code in (200, 206):
+        response['Content-Disposition'] = '%s; filename="%s"' % ('attachment' if attachment else 'inline', filename.replace('"', ''))
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = '"%s"' % etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
@@ -23,24 +23,32 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import unicode_literals
-from os.path import isfile, join
 
 from django.utils.translation import ugettext_lazy as _
-from django.utils import six, timezone
+from django.utils import timezone
 
-from lucterios.framework.filetools import get_user_path, get_user_dir
 from lucterios.framework.error import LucteriosException, IMPORTANT
 from lucterios.framework.tools import ActionsManage, CLOSE_NO, FORMTYPE_MODAL
-from lucterios.framework.xfercomponents import XferCompUpLoad, XferCompDownLoad
+from lucterios.framework.xfercomponents import XferCompUpLoad, XferCompDownLoad, XferCompImage, XferCompGrid, \
+    XferCompLabelForm
 from lucterios.framework.editors import LucteriosEditor
 
 from lucterios.CORE.models import LucteriosUser
-from lucterios.documents.models import Folder
+from lucterios.documents.models import Folder, Document, DocumentVersion, Blob, Job
+from lucterios.documents.storage import read_chunks
+from lucterios.documents.thumbnail import get_thumbnail_base64, is_thumbnail_supported
+
+# documents are sent to and from the client as they are, in both directions: they are compressed by the storage
+TRANSFER_COMPRESS = False
 
 
 class DocumentEditor(LucteriosEditor):
 
     def before_save(self, xfer):
+        self.item.previous_state = None
+        if (self.item.id is not None) and ('filename' in xfer.request.FILES.keys()):
+            # kept as it is in database, for the version history
+            self.item.previous_state = Document.objects.get(id=self.item.id)
         current_folder = xfer.getparam('current_folder')
         if current_folder is not None:
             if current_folder != 0:
@@ -61,15 +69,26 @@ class DocumentEditor(LucteriosEditor):
         self.item.date_modification = timezone.now()
         if self.item.id is None:
             self.item.date_creation = self.item.date_modification
+        self.check_quota(xfer)
         return
 
+    def check_quota(self, xfer):
+        if 'filename' in xfer.request.FILES.keys():
+            new_size = xfer.request.FILES['filename'].size
+        else:
+            new_size = self.item.size
+        old_folder_id = None
+        if self.item.id is not None:
+            old_folder_id, old_size = Document.objects.filter(id=self.item.id).values_list('folder_id', 'size')[0]
+            if old_folder_id == self.item.folder_id:
+                old_folder_id = None
+                new_size -= old_size
+        Folder.check_quota(self.item.folder_id, new_size, old_folder_id)
+
     def saving(self, xfer):
         if 'filename' in xfer.request.FILES.keys():
             tmp_file = xfer.request.FILES['filename']
-            file_path = get_user_path("documents", "document_%s" % six.text_type(
-                self.item.id))
-            with open(file_path, "wb") as file_tmp:
-                file_tmp.write(tmp_file.read())  # write the tmp file
+            self.item.set_blob(Blob.store_document(read_chunks(tmp_file), self.item.name), getattr(self.item, 'previous_state', None))
 
     def edit(self, xfer):
         xfer.change_to_readonly("folder")
@@ -77,24 +96,44 @@ class DocumentEditor(LucteriosEditor):
         xfer.remove_component('name')
         file_name = XferCompUpLoad('filename')
         file_name.http_file = True
-        file_name.compress = True
+        file_name.compress = TRANSFER_COMPRESS
         file_name.set_value('')
         file_name.set_location(obj_cmt.col, obj_cmt.row, obj_cmt.colspan, obj_cmt.rowspan)
         xfer.add_component(file_name)
 
     def show(self, xfer):
-        destination_file = join("documents", "document_%s" % six.text_type(
-            self.item.id))
-        if not isfile(join(get_user_dir(), destination_file)):
+        from lucterios.documents.views import DocumentDownload
+        if self.item.blob is None:
             raise LucteriosException(IMPORTANT, _("File not found!"))
-        obj_cmt = xfer.get_components('creator')
+        if not self.item.is_consistent():
+            raise LucteriosException(IMPORTANT, _("File corrupted!"))
+        obj_cmt = xfer.get_components('storage_format')
         down = XferCompDownLoad('filename')
-        down.compress = True
+        down.compress = TRANSFER_COMPRESS
         down.http_file = True
         down.maxsize = 0
         down.set_value(self.item.name)
-        down.set_download(destination_file)
+        down.set_filename("%s?document=%d" % (DocumentDownload.url_text, self.item.id))
         down.set_action(xfer.request, ActionsManage.get_action_url('documents.Document', 'AddModify', xfer),
                         modal=FORMTYPE_MODAL, close=CLOSE_NO)
         down.set_location(obj_cmt.col, obj_cmt.row + 1, 4)
         xfer.add_component(down)
+        if is_thumbnail_supported(self.item.mimetype):
+            preview_path = self.item.get_thumbnail('preview')
+            if preview_path is not None:
+                preview = XferCompImage('preview')
+                preview.set_value(get_thumbnail_base64(preview_path))
+            else:
+                # images are decoded by the job workers, not while the document is shown
+                Job.add_thumbnail(self.item, xfer.request.user)
+                preview = XferCompLabelForm('preview')
+                preview.set_value_center(_("Preview in preparation"))
+            preview.set_location(obj_cmt.col, obj_cmt.row + 2, 4)
+            xfer.add_component(preview)
+        versions = DocumentVersion.objects.filter(document_id=self.item.id)
+        if versions.exists():
+            grid = XferCompGrid('documentversion')
+            grid.set_model(versions, None, xfer)
+            grid.add_action_notified(xfer, DocumentVersion)
+            grid.set_location(obj_cmt.col, obj_cmt.row + 3, 4)
+            xfer.add_component(grid)
@@ -26,11 +26,8 @@ from __future__ import unicode_literals
 from django.apps import apps
 
 from lucterios.install.lucterios_migration import MigrateAbstract
-from lucterios.framework.filetools import get_user_path
+from lucterios.documents.storage import read_chunks
 from os.path import join, isfile
-from os import mknod
-from shutil import copyfile
-from django.utils import six
 
 
 class DocumentsMigrate(MigrateAbstract):
@@ -88,7 +85,10 @@ class DocumentsMigrate(MigrateAbstract):
 
     def _docs(self):
         doc_mdl = apps.get_model("documents", "Document")
+        blob_mdl = apps.get_model("documents", "Blob")
         doc_mdl.objects.all().delete()
+        for blob in blob_mdl.objects.all():
+            blob.delete()
         self.doc_list = {}
         cur = self.old_db.open()
         cur.execute(
@@ -102,15 +102,15 @@ class DocumentsMigrate(MigrateAbstract):
             self.doc_list[docid].modifier = self.user_list[doc_modifier]
             self.doc_list[docid].creator = self.user_list[doc_creator]
             self.doc_list[docid].save()
-            new_filename = get_user_path(
-                "documents", "document_%s" % six.text_type(self.doc_list[docid].id))
             old_filename = join(
                 self.old_db.tmp_path, "usr", "org_lucterios_documents", "document%d" % docid)
             if isfile(old_filename):
-                copyfile(old_filename, new_filename)
+                with open(old_filename, "rb") as old_file:
+                    new_blob = blob_mdl.store_document(read_chunks(old_file), doc_name)
             else:
                 self.print_info("*** Document '%s' not found ***", doc_name)
-                mknod(new_filename)
+                new_blob = blob_mdl.store_chunks([])
+            self.doc_list[docid].set_blob(new_blob)
 
     def run(self):
         self._folders()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+'''
+lucterios.documents.management.commands package
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from lucterios.documents.models import Blob
+from lucterios.documents.storage import FORMAT_CONTAINER, get_storage_format, content_checksum
+from lucterios.documents.container import check_container
+
+
+class Command(BaseCommand):
+    help = 'Store again in containers the documents stored in zip archives, as raw files or in containers keyed by their stored file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', dest='check', default=False,
+                            help='Check the checksums of the containers too')
+
+    def handle(self, *args, **options):
+        nb_converted = 0
+        nb_errors = 0
+        blob_infos = Blob.get_document_infos()
+        for blob_id in sorted(blob_infos.keys()):
+            blob = Blob.objects.filter(id=blob_id).first()
+            if (blob is None) or not blob.is_stored():
+                continue
+            blob_path = blob.get_path()
+            if get_storage_format(blob_path) == FORMAT_CONTAINER:
+                if options['check'] and not check_container(blob_path):
+                    self.stdout.write("%s: corrupted container" % blob.checksum)
+                    nb_errors += 1
+                    continue
+                if content_checksum(blob_path)[1] == blob.checksum:
+                    continue
+            name, mimetype = blob_infos[blob_id]
+            try:
+                if blob.recompress(name, mimetype, convert=True) is not None:
+                    nb_converted += 1
+            except Exception as err:
+                self.stdout.write("%s: %s" % (blob.checksum, err))
+                nb_errors += 1
+        self.stdout.write("%d blob(s) converted, %d error(s)" % (nb_converted, nb_errors))
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+'''
+lucterios.documents.management.commands package
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from lucterios.documents.models import BlobCollector
+
+
+class Command(BaseCommand):
+    help = 'Find the stored files and blobs used by no document, and quarantine or remove them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--remove', action='store_true', dest='remove', default=False,
+                            help='Remove orphan files at once, instead of keeping them in quarantine')
+        parser.add_argument('--limit', type=int, dest='limit', default=None,
+                            help='Maximum number of blobs checked by this run, the next run goes on')
+        parser.add_argument('--pause', type=float, dest='pause', default=0.0,
+                            help='Pause in seconds between two batches, to throttle I/O on a live install')
+        parser.add_argument('--grace', type=int, dest='grace', default=None,
+                            help='Files younger than this number of seconds are never orphans')
+
+    def handle(self, *args, **options):
+        collector = BlobCollector(options['remove'], options['limit'], options['grace'])
+        finished = collector.run(options['pause'])
+        self.stdout.write("%d blob(s) checked, %d orphan(s), %d reference count(s) fixed, %d missing file(s), %s reclaimed" %
+                          (collector.nb_checked, collector.nb_orphans, collector.nb_fixed, collector.nb_missing, filesizeformat(collector.reclaimed)))
+        if finished:
+            self.stdout.write("%s purged from quarantine" % filesizeformat(collector.purged))
+        else:
+            self.stdout.write("stopped after %s: run again to go on" % collector.cursor)
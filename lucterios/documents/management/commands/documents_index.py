@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+'''
+lucterios.documents.management.commands package
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from lucterios.documents.models import DocumentContent
+from lucterios.documents.content import EXTRACT_PROCESSES, EXTRACT_TIMEOUT
+
+
+class Command(BaseCommand):
+    help = 'Extract the text of new or modified documents and index it for the search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', dest='rebuild', default=False,
+                            help='Extract and index again all documents')
+        parser.add_argument('--processes', type=int, dest='processes', default=EXTRACT_PROCESSES,
+                            help='Number of extraction processes')
+        parser.add_argument('--timeout', type=float, dest='timeout', default=EXTRACT_TIMEOUT,
+                            help='Maximum time in seconds to extract the text of one file')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            DocumentContent.objects.all().update(date_extraction=None, date_index=None)
+        nb_documents = DocumentContent.extract_texts(options['processes'], options['timeout'])
+        self.stdout.write("%d document(s) extracted" % nb_documents)
+        nb_documents = DocumentContent.update_index()
+        self.stdout.write("%d document(s) indexed" % nb_documents)
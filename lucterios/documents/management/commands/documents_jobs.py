@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+'''
+lucterios.documents.management.commands package
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+from time import sleep
+from multiprocessing import Process
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from lucterios.documents.models import Job, PendingUnlink
+from lucterios.documents.storage import IMPORT_BATCH_SIZE
+
+
+def run_jobs(once, delay):
+    while True:
+        job = Job.take_next()
+        if job is not None:
+            job.run()
+        elif PendingUnlink.sweep(IMPORT_BATCH_SIZE) > 0:
+            # files of the documents deleted in bulk, between two jobs
+            continue
+        elif once:
+            break
+        else:
+            sleep(delay)
+
+
+class Command(BaseCommand):
+    help = 'Run the queued imports and extracts of folders and previews of documents, and unlink the files of the documents deleted in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', dest='once', default=False,
+                            help='Stop when the queue is empty')
+        parser.add_argument('--sleep', type=float, dest='sleep', default=2.0,
+                            help='Pause in seconds between two polls of an empty queue')
+        parser.add_argument('--processes', type=int, dest='processes', default=1,
+                            help='Number of worker processes')
+        parser.add_argument('--requeue', action='store_true', dest='requeue', default=False,
+                            help='Put back in the queue the extracts interrupted by a stop of the workers')
+
+    def handle(self, *args, **options):
+        if options['requeue']:
+            # an interrupted import is partially done: running it again would duplicate documents
+            nb_jobs = Job.objects.filter(status=Job.STATUS_RUNNING, kind=Job.KIND_EXTRACT).update(status=Job.STATUS_WAITING, nb_files_done=0, size_done=0)
+            Job.objects.filter(status=Job.STATUS_RUNNING, kind=Job.KIND_IMPORT).update(status=Job.STATUS_FAILED, message='interrupted')
+            self.stdout.write("%d job(s) requeued" % nb_jobs)
+        if options['processes'] > 1:
+            # each process must open its own database connection
+            for conn in connections.all():
+                conn.close()
+            workers = [Process(target=run_jobs, args=(options['once'], options['sleep'])) for _idx in range(options['processes'])]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        else:
+            run_jobs(options['once'], options['sleep'])
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+'''
+lucterios.documents.management.commands package
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from os.path import isfile
+
+from django.core.management.base import BaseCommand
+
+from lucterios.documents.models import Document
+from lucterios.documents.storage import content_checksum, IMPORT_BATCH_SIZE
+from lucterios.documents.container import is_container, check_container
+from lucterios.documents.content import describe_file
+
+
+class Command(BaseCommand):
+    help = 'Fill the size, type, checksum and storage format of documents from their stored files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', dest='all', default=False,
+                            help='Describe again all documents, not only those without type')
+        parser.add_argument('--check', action='store_true', dest='check', default=False,
+                            help='Read the stored files to verify their checksum')
+
+    def handle(self, *args, **options):
+        documents = Document.objects.exclude(blob=None)
+        if not options['all']:
+            documents = documents.filter(mimetype='')
+        document_ids = list(documents.order_by('id').values_list('id', flat=True))
+        nb_errors = 0
+        for index in range(0, len(document_ids), IMPORT_BATCH_SIZE):
+            for document in Document.objects.filter(id__in=document_ids[index:index + IMPORT_BATCH_SIZE]).select_related('blob'):
+                blob_path = document.blob.get_path()
+                if not isfile(blob_path):
+                    self.stdout.write("%s: file not found" % document)
+                    nb_errors += 1
+                    continue
+                if options['check'] and ((content_checksum(blob_path) != (document.blob.size, document.blob.checksum)) or
+                                         (is_container(blob_path) and not check_container(blob_path))):
+                    self.stdout.write("%s: file corrupted" % document)
+                    nb_errors += 1
+                if (document.size != document.blob.size) or (document.checksum != document.blob.checksum):
+                    # saved to keep the folder totals up to date
+                    document.size = document.blob.size
+                    document.checksum = document.blob.checksum
+                    document.save(update_fields=['size', 'checksum'])
+                storage_format, mimetype = describe_file(blob_path, document.name)
+                Document.objects.filter(id=document.id).update(storage_format=storage_format, mimetype=mimetype)
+        self.stdout.write("%d document(s) described, %d error(s)" % (len(document_ids), nb_errors))
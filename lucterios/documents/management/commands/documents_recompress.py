@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+'''
+lucterios.documents.management.commands package
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from lucterios.documents.models import Blob
+
+
+class Command(BaseCommand):
+    help = 'Compress again the stored documents as the compression policy says, to reclaim space'
+
+    def handle(self, *args, **options):
+        nb_blobs = 0
+        reclaimed = 0
+        blob_infos = Blob.get_document_infos()
+        for blob_id in sorted(blob_infos.keys()):
+            blob = Blob.objects.filter(id=blob_id).first()
+            if blob is None:
+                continue
+            name, mimetype = blob_infos[blob_id]
+            blob_reclaimed = blob.recompress(name, mimetype)
+            if blob_reclaimed is not None:
+                nb_blobs += 1
+                reclaimed += blob_reclaimed
+        self.stdout.write("%d blob(s) recompressed, %s reclaimed" % (nb_blobs, filesizeformat(reclaimed)))
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+'''
+lucterios.documents.management.commands package
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+from os import walk, rename, unlink, rmdir, listdir
+from os.path import join, isfile, relpath, sep
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from lucterios.framework.filetools import get_user_dir
+from lucterios.documents.storage import DOCUMENTS_DIR, SPECIAL_DIRS, SHARD_LEVELS, get_blob_name, get_blob_path, is_blob_name
+
+
+class Command(BaseCommand):
+    help = 'Move stored documents into the sharded directory layout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run', default=False,
+                            help='Only report files to move')
+        parser.add_argument('--pause', type=float, dest='pause', default=0.0,
+                            help='Pause in seconds between two moves, to throttle I/O on a live install')
+
+    def handle(self, *args, **options):
+        user_dir = get_user_dir()
+        root_dir = join(user_dir, DOCUMENTS_DIR)
+        nb_moved = 0
+        for dirpath, dirs, filenames in walk(root_dir):
+            if dirpath == root_dir:
+                dirs[:] = [dirname for dirname in dirs if dirname not in SPECIAL_DIRS]
+            for filename in filenames:
+                if not is_blob_name(filename):
+                    continue
+                current_path = join(dirpath, filename)
+                if relpath(current_path, user_dir) == get_blob_name(filename):
+                    continue
+                nb_moved += 1
+                if options['dry_run']:
+                    self.stdout.write(relpath(current_path, user_dir))
+                    continue
+                new_path = get_blob_path(filename)
+                if isfile(new_path):
+                    unlink(current_path)
+                else:
+                    rename(current_path, new_path)
+                if options['pause'] > 0:
+                    sleep(options['pause'])
+        if not options['dry_run']:
+            self._clean_empty_dirs(root_dir)
+        self.stdout.write("%d file(s) resharded" % nb_moved)
+
+    def _clean_empty_dirs(self, root_dir):
+        # only buckets deeper than the current layout, others can receive new files at any time
+        for dirpath, _dirs, _filenames in walk(root_dir, topdown=False):
+            if (dirpath == root_dir) or (relpath(dirpath, root_dir).split(sep)[0] in SPECIAL_DIRS):
+                continue
+            depth = len(relpath(dirpath, root_dir).split(sep))
+            if (depth > SHARD_LEVELS) and (len(listdir(dirpath)) == 0):
+                rmdir(dirpath)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+'''
+lucterios.documents.management.commands package
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from lucterios.documents.models import Blob
+from lucterios.documents.thumbnail import THUMBNAIL_SIZES, THUMBNAIL_MIMETYPES, get_cached_thumbnail, generate_thumbnail, \
+    evict_thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Make the missing thumbnails of image documents'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', dest='size', default='thumbnail', choices=sorted(THUMBNAIL_SIZES.keys()),
+                            help='Kind of thumbnail to make')
+
+    def handle(self, *args, **options):
+        nb_thumbnails = 0
+        blobs = Blob.objects.filter(document__mimetype__in=THUMBNAIL_MIMETYPES).distinct()
+        for blob in blobs.iterator():
+            if get_cached_thumbnail(blob.checksum, options['size']) is None:
+                if generate_thumbnail(blob.get_path(), blob.checksum, options['size'], evict=False) is not None:
+                    nb_thumbnails += 1
+        evict_thumbnails()
+        self.stdout.write("%d thumbnail(s) made" % nb_thumbnails)
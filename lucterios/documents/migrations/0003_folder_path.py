@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_folder_path(apps, schema_editor):
+    # pylint: disable=unused-argument
+    folder_mdl = apps.get_model("documents", "Folder")
+    parents = dict(folder_mdl.objects.values_list('id', 'parent_id'))
+    paths = {}
+
+    def get_path(folder_id):
+        if folder_id not in paths:
+            parent_id = parents[folder_id]
+            if parent_id is None:
+                parent_path = '/'
+            else:
+                parent_path = get_path(parent_id)
+            paths[folder_id] = "%s%d/" % (parent_path, folder_id)
+        return paths[folder_id]
+
+    for folder_id in parents.keys():
+        folder_path = get_path(folder_id)
+        if len(folder_path) > 250:
+            raise ValueError("path of folder %d too long: %s" % (folder_id, folder_path))
+        folder_mdl.objects.filter(id=folder_id).update(path=folder_path)
+    # an empty path would match every folder in the subtree queries
+    if folder_mdl.objects.filter(path='').exists():
+        raise ValueError("folders without path: %s" % list(folder_mdl.objects.filter(path='').values_list('id', flat=True)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0002_length_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=250, verbose_name='path'),
+        ),
+        migrations.RunPython(fill_folder_path, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+from os import rename, unlink
+from os.path import isfile
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from lucterios.framework.filetools import get_user_path
+from lucterios.documents.storage import file_checksum, get_blob_path
+
+
+def convert_document_files(apps, schema_editor):
+    # pylint: disable=unused-argument
+    doc_mdl = apps.get_model("documents", "Document")
+    blob_mdl = apps.get_model("documents", "Blob")
+    for doc in doc_mdl.objects.filter(blob=None):
+        old_path = get_user_path("documents", "document_%d" % doc.id)
+        if isfile(old_path):
+            size, checksum = file_checksum(old_path)
+            blob, _created = blob_mdl.objects.get_or_create(checksum=checksum, defaults={'size': size})
+            blob_path = get_blob_path(checksum)
+            if isfile(blob_path):
+                unlink(old_path)
+            else:
+                rename(old_path, blob_path)
+            blob.nb_reference += 1
+            blob.save()
+            doc.blob = blob
+            doc.size = size
+            doc.checksum = checksum
+            doc.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0004_document_size_checksum'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checksum', models.CharField(max_length=64, unique=True, verbose_name='checksum')),
+                ('size', models.BigIntegerField(default=0, verbose_name='size')),
+                ('nb_reference', models.IntegerField(default=0, verbose_name='number of references')),
+            ],
+            options={
+                'verbose_name': 'blob',
+                'verbose_name_plural': 'blobs',
+                'default_permissions': [],
+            },
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='blob',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='documents.Blob', verbose_name='blob'),
+        ),
+        migrations.RunPython(convert_document_files, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CORE', '0001_initial'),
+        ('documents', '0005_blob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.IntegerField(choices=[(0, 'import'), (1, 'extract')], default=0, verbose_name='kind')),
+                ('status', models.IntegerField(choices=[(0, 'waiting'), (1, 'running'), (2, 'done'), (3, 'failed')],
+                                               db_index=True, default=0, verbose_name='status')),
+                ('nb_files', models.IntegerField(default=0, verbose_name='number of files')),
+                ('nb_files_done', models.IntegerField(default=0, verbose_name='files done')),
+                ('size', models.BigIntegerField(default=0, verbose_name='size')),
+                ('size_done', models.BigIntegerField(default=0, verbose_name='size done')),
+                ('date_creation', models.DateTimeField(verbose_name='date creation')),
+                ('date_start', models.DateTimeField(null=True, verbose_name='date start')),
+                ('date_end', models.DateTimeField(null=True, verbose_name='date end')),
+                ('message', models.TextField(blank=True, default='', verbose_name='message')),
+                ('folder', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='documents.Folder', verbose_name='folder')),
+                ('modifier', models.ManyToManyField(blank=True, related_name='job_modifier', to='CORE.LucteriosGroup', verbose_name='modifier')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='CORE.LucteriosUser', verbose_name='user')),
+                ('viewer', models.ManyToManyField(blank=True, related_name='job_viewer', to='CORE.LucteriosGroup', verbose_name='viewer')),
+            ],
+            options={
+                'verbose_name': 'job',
+                'verbose_name_plural': 'jobs',
+                'default_permissions': [],
+            },
+        ),
+    ]
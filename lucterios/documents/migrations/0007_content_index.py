@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0006_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentContent',
+            fields=[
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False,
+                                                  to='documents.Document', verbose_name='document')),
+                ('date_index', models.DateTimeField(null=True, verbose_name='date index')),
+                ('nb_words', models.IntegerField(default=0, verbose_name='number of words')),
+            ],
+            options={
+                'verbose_name': 'document content',
+                'verbose_name_plural': 'document contents',
+                'default_permissions': [],
+            },
+        ),
+        migrations.CreateModel(
+            name='ContentWord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('word', models.CharField(db_index=True, max_length=50, verbose_name='word')),
+                ('nb_occurrences', models.IntegerField(default=1, verbose_name='number of occurrences')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='documents.Document', verbose_name='document')),
+            ],
+            options={
+                'verbose_name': 'word',
+                'verbose_name_plural': 'words',
+                'default_permissions': [],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='contentword',
+            unique_together=set([('document', 'word')]),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0007_content_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentcontent',
+            name='text',
+            field=models.TextField(blank=True, default='', verbose_name='text'),
+        ),
+        migrations.AddField(
+            model_name='documentcontent',
+            name='error',
+            field=models.CharField(blank=True, default='', max_length=200, verbose_name='error'),
+        ),
+        migrations.AddField(
+            model_name='documentcontent',
+            name='date_extraction',
+            field=models.DateTimeField(null=True, verbose_name='date extraction'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_documents(apps, schema_editor):
+    # pylint: disable=unused-argument
+    doc_mdl = apps.get_model("documents", "Document")
+    counter_mdl = apps.get_model("documents", "DocumentCounter")
+    counter_mdl.objects.all().delete()
+    nb_by_folder = dict(doc_mdl.objects.values_list('folder_id').annotate(nb_documents=models.Count('id')).values_list('folder_id', 'nb_documents'))
+    if None not in nb_by_folder:
+        nb_by_folder[None] = 0
+    counter_mdl.objects.bulk_create([counter_mdl(folder_id=folder_id, nb_documents=nb_documents)
+                                     for folder_id, nb_documents in nb_by_folder.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0008_content_extraction'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nb_documents', models.IntegerField(default=0, verbose_name='number of documents')),
+                ('folder', models.OneToOneField(null=True, on_delete=django.db.models.deletion.CASCADE, to='documents.Folder', verbose_name='folder')),
+            ],
+            options={
+                'verbose_name': 'document counter',
+                'verbose_name_plural': 'document counters',
+                'default_permissions': [],
+            },
+        ),
+        migrations.RunPython(count_documents, migrations.RunPython.noop),
+    ]
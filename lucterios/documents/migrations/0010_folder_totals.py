@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def compute_totals(apps, schema_editor):
+    # pylint: disable=unused-argument
+    folder_mdl = apps.get_model("documents", "Folder")
+    doc_mdl = apps.get_model("documents", "Document")
+    totals = {}
+    folder_paths = dict(folder_mdl.objects.values_list('id', 'path'))
+    for folder_id, nb_documents, size in doc_mdl.objects.exclude(folder=None).values_list('folder_id').annotate(nb_documents=models.Count('id'), size=models.Sum('size')).values_list('folder_id', 'nb_documents', 'size'):
+        for branch_id in [int(item) for item in folder_paths[folder_id].split('/') if item != '']:
+            total_documents, total_size = totals.get(branch_id, (0, 0))
+            totals[branch_id] = (total_documents + nb_documents, total_size + (size or 0))
+    for folder_id, (total_documents, total_size) in totals.items():
+        folder_mdl.objects.filter(id=folder_id).update(total_documents=total_documents, total_size=total_size)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0009_documentcounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='quota',
+            field=models.IntegerField(default=0, help_text='0 for no limit', verbose_name='quota (Mo)'),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='total_documents',
+            field=models.IntegerField(default=0, editable=False, verbose_name='total of documents'),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='total_size',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='total size'),
+        ),
+        migrations.RunPython(compute_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0010_folder_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='mimetype',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100, verbose_name='type'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='storage_format',
+            field=models.IntegerField(choices=[(0, 'raw'), (1, 'zip')], default=0, editable=False, verbose_name='storage format'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CORE', '0001_initial'),
+        ('documents', '0011_document_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.IntegerField(verbose_name='version')),
+                ('name', models.CharField(max_length=250, verbose_name='name')),
+                ('date_modification', models.DateTimeField(verbose_name='date modification')),
+                ('size', models.BigIntegerField(default=0, verbose_name='size')),
+                ('checksum', models.CharField(blank=True, default='', max_length=64, verbose_name='checksum')),
+                ('mimetype', models.CharField(blank=True, default='', max_length=100, verbose_name='type')),
+                ('storage_format', models.IntegerField(choices=[(0, 'raw'), (1, 'zip')], default=0, verbose_name='storage format')),
+                ('is_delta', models.BooleanField(default=False, verbose_name='delta')),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='documents.Blob', verbose_name='blob')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='documents.Document', verbose_name='document')),
+                ('modifier', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='version_modifier', to='CORE.LucteriosUser', verbose_name='modifier')),
+            ],
+            options={
+                'verbose_name': 'version',
+                'verbose_name_plural': 'versions',
+                'ordering': ['document', '-number'],
+                'default_permissions': [],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='documentversion',
+            unique_together=set([('document', 'number')]),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0012_documentversion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='document',
+            name='storage_format',
+            field=models.IntegerField(choices=[(0, 'raw'), (1, 'zip'), (2, 'container')], default=0, editable=False, verbose_name='storage format'),
+        ),
+        migrations.AlterField(
+            model_name='documentversion',
+            name='storage_format',
+            field=models.IntegerField(choices=[(0, 'raw'), (1, 'zip'), (2, 'container')], default=0, verbose_name='storage format'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0013_storage_container'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingUnlink',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checksum', models.CharField(db_index=True, max_length=64, verbose_name='checksum')),
+                ('date_creation', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date creation')),
+            ],
+            options={
+                'verbose_name': 'pending unlink',
+                'verbose_name_plural': 'pending unlinks',
+                'default_permissions': [],
+            },
+        ),
+    ]
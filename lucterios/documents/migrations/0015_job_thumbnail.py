@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0014_pendingunlink'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.IntegerField(choices=[(0, 'import'), (1, 'extract'), (2, 'preview')], default=0, verbose_name='kind'),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='document',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='documents.Document', verbose_name='document'),
+        ),
+    ]
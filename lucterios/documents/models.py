@@ -23,21 +23,307 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import unicode_literals
-from os import unlink, listdir, makedirs
-from os.path import isfile, isdir, join
+from os import unlink, listdir, rename, utime
+from os.path import isfile, isdir, join, getsize, getmtime
+from time import time, sleep
+from collections import Counter
+from hashlib import sha256
+from math import log
+from logging import getLogger
 from zipfile import ZipFile
-try:
-    from zipfile import BadZipFile
-except ImportError:
-    from zipfile import BadZipfile as BadZipFile
+from uuid import uuid4
+from threading import Lock, local
+from multiprocessing.pool import ThreadPool
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.db.models.functions import Concat, Substr, Length
+from django.template.defaultfilters import filesizeformat
 from django.utils import six, timezone
 from django.utils.translation import ugettext_lazy as _
 
 from lucterios.framework.models import LucteriosModel
-from lucterios.framework.filetools import get_user_path
+from lucterios.framework.error import LucteriosException, IMPORTANT
+from lucterios.framework.filetools import get_user_dir
 from lucterios.CORE.models import LucteriosGroup, LucteriosUser
+from lucterios.documents.storage import get_blob_name, get_blob_path, get_tmp_blob_path, \
+    find_blob_name, get_storage_format, content_checksum, read_chunks, write_chunks, IMPORT_MAX_ENTRIES, IMPORT_MAX_SIZE, IMPORT_BATCH_SIZE, \
+    IMPORT_WORKERS, JOB_PROGRESS_DELAY, FORMAT_RAW, FORMAT_ZIP, FORMAT_CONTAINER, Workspace, read_stored_content, iter_stored_content, get_job_name, get_job_path, fetch_cached_archive, store_cached_archive, \
+    DOCUMENTS_DIR, GC_GRACE_PERIOD, iter_blob_files, get_gc_cursor, set_gc_cursor, quarantine_file, purge_quarantine
+from lucterios.documents.archive import write_member, write_zip
+from lucterios.documents.compression import write_compressed, extract_content, choose_compression, get_stored_compression
+from lucterios.documents.delta import make_delta, apply_delta, VERSION_SNAPSHOT_INTERVAL, DELTA_MAX_FILE_SIZE, DELTA_MAX_RATIO
+from lucterios.documents.thumbnail import is_thumbnail_supported, get_cached_thumbnail, generate_thumbnail
+from lucterios.documents.content import count_words, get_words, extract_batches, describe_file, WORD_MAX_LENGTH, SEARCH_MAX_RESULTS, \
+    EXTRACT_PROCESSES, EXTRACT_TIMEOUT
+
+PATH_SEPARATOR = '/'
+PATH_MAX_LENGTH = 250
+
+STORAGE_FORMATS = ((FORMAT_RAW, _('raw')), (FORMAT_ZIP, _('zip')), (FORMAT_CONTAINER, _('container')))
+
+
+def get_path_ids(path):
+    return [int(folder_id) for folder_id in path.split(PATH_SEPARATOR) if folder_id != '']
+
+
+class Blob(LucteriosModel):
+    """
+    Stored content, shared by all documents and versions with the same one.
+    Keyed by the checksum and size of the content, not of its stored file.
+    """
+    checksum = models.CharField(_('checksum'), max_length=64, unique=True)
+    size = models.BigIntegerField(_('size'), default=0)
+    nb_reference = models.IntegerField(_('number of references'), default=0)
+
+    def __str__(self):
+        return self.checksum
+
+    def get_name(self):
+        blob_name = find_blob_name(self.checksum)
+        if blob_name is None:
+            blob_name = get_blob_name(self.checksum)
+        return blob_name
+
+    def get_path(self):
+        return join(get_user_dir(), self.get_name())
+
+    def is_stored(self):
+        return find_blob_name(self.checksum) is not None
+
+    @classmethod
+    def store_files(cls, tmp_files):
+        # tmp_files: list of (tmp_path, size, checksum), one reference is added for each of them
+        try:
+            checksums = set([checksum for _tmp_path, _size, checksum in tmp_files])
+            with transaction.atomic():
+                blobs = dict([(blob.checksum, blob) for blob in cls.objects.select_for_update().filter(checksum__in=checksums)])
+                # released and stored again: its file must not be unlinked
+                PendingUnlink.objects.filter(checksum__in=checksums).delete()
+                new_blobs = {}
+                for _tmp_path, size, checksum in tmp_files:
+                    if (checksum not in blobs) and (checksum not in new_blobs):
+                        new_blobs[checksum] = cls(checksum=checksum, size=size)
+                if len(new_blobs) > 0:
+                    try:
+                        with transaction.atomic():
+                            cls.objects.bulk_create(list(new_blobs.values()), batch_size=IMPORT_BATCH_SIZE)
+                    except IntegrityError:
+                        # some of them stored meanwhile by a concurrent upload: added one at a time, the others reused
+                        for checksum, blob in list(new_blobs.items()):
+                            try:
+                                with transaction.atomic():
+                                    cls.objects.create(checksum=checksum, size=blob.size)
+                            except IntegrityError:
+                                del new_blobs[checksum]
+                    blobs.update([(blob.checksum, blob) for blob in cls.objects.select_for_update().filter(checksum__in=checksums - set(blobs.keys()))])
+                stored_paths = []
+                try:
+                    for tmp_path, _size, checksum in tmp_files:
+                        if not blobs[checksum].is_stored():
+                            stored_paths.append(get_blob_path(checksum))
+                            rename(tmp_path, stored_paths[-1])
+                        elif checksum not in new_blobs:
+                            # reused: the collector leaves it for its grace period
+                            utime(blobs[checksum].get_path(), None)
+                    blob_ids_by_nb = {}
+                    for checksum, nb_reference in Counter([checksum for _tmp_path, _size, checksum in tmp_files]).items():
+                        blob_ids_by_nb.setdefault(nb_reference, []).append(blobs[checksum].id)
+                        blobs[checksum].nb_reference += nb_reference
+                    for nb_reference, blob_ids in blob_ids_by_nb.items():
+                        cls.objects.filter(id__in=blob_ids).update(nb_reference=models.F('nb_reference') + nb_reference)
+                except Exception:
+                    # their blobs are rolled back: unlinked while still locked by this transaction
+                    for blob_path in stored_paths:
+                        if isfile(blob_path):
+                            unlink(blob_path)
+                    raise
+        finally:
+            for tmp_path, _size, _checksum in tmp_files:
+                if isfile(tmp_path):
+                    unlink(tmp_path)
+        return blobs
+
+    @classmethod
+    def store_file(cls, tmp_path, size=None, checksum=None):
+        if checksum is None:
+            size, checksum = content_checksum(tmp_path)
+        return cls.store_files([(tmp_path, size, checksum)])[checksum]
+
+    @classmethod
+    def store_chunks(cls, chunks):
+        tmp_path = get_tmp_blob_path()
+        size, checksum = write_chunks(chunks, tmp_path)
+        return cls.store_file(tmp_path, size, checksum)
+
+    @classmethod
+    def get_document_infos(cls):
+        # name and type of the documents for each blob, whole versions included
+        blob_infos = {}
+        for blob_id, name, mimetype in DocumentVersion.objects.filter(is_delta=False).values_list('blob_id', 'name', 'mimetype'):
+            blob_infos[blob_id] = (name, mimetype if mimetype != '' else None)
+        for blob_id, name, mimetype in Document.objects.filter(blob__isnull=False).values_list('blob_id', 'name', 'mimetype'):
+            blob_infos[blob_id] = (name, mimetype if mimetype != '' else None)
+        return blob_infos
+
+    @classmethod
+    def store_document(cls, chunks, filename, mimetype=None):
+        # content of a document, stored in a container compressed as the policy says for its type, keyed by its content
+        content_path = get_tmp_blob_path()
+        tmp_path = get_tmp_blob_path()
+        try:
+            write_chunks(chunks, content_path)
+            write_compressed(content_path, filename, tmp_path, mimetype=mimetype)
+        finally:
+            if isfile(content_path):
+                unlink(content_path)
+        return cls.store_file(tmp_path)
+
+    def recompress(self, filename, mimetype=None, convert=False):
+        """
+        Store this blob again in a container compressed as the policy says, if it takes less space.
+        convert: an older blob (zip, raw file or container keyed by its own checksum) is stored again in any case.
+        The same content replaces the file in place, documents and versions of a blob keyed by an older checksum move to
+        the blob of their content: returns the number of bytes reclaimed, None if not stored again.
+        """
+        blob_path = self.get_path()
+        if not isfile(blob_path):
+            return None
+        is_converted = convert and ((get_storage_format(blob_path) != FORMAT_CONTAINER) or (content_checksum(blob_path)[1] != self.checksum))
+        stored_size = getsize(blob_path)
+        content_path = get_tmp_blob_path()
+        tmp_path = get_tmp_blob_path()
+        try:
+            extract_content(blob_path, content_path)
+            compression = choose_compression(content_path, filename, mimetype)
+            if not is_converted and (compression == get_stored_compression(blob_path)):
+                return None
+            write_compressed(content_path, filename, tmp_path, compression)
+            new_stored_size = getsize(tmp_path)
+            if not is_converted and (new_stored_size >= stored_size):
+                return None
+            size, checksum = content_checksum(tmp_path)
+            if checksum == self.checksum:
+                rename(tmp_path, blob_path)
+                new_blob = None
+            else:
+                new_blob = Blob.store_file(tmp_path, size, checksum)
+        finally:
+            for file_path in (content_path, tmp_path):
+                if isfile(file_path):
+                    unlink(file_path)
+        if new_blob is None:
+            Document.objects.filter(blob_id=self.id).update(storage_format=FORMAT_CONTAINER)
+            DocumentVersion.objects.filter(blob_id=self.id, is_delta=False).update(storage_format=FORMAT_CONTAINER)
+            return stored_size - new_stored_size
+        with transaction.atomic():
+            nb_reference = 0
+            for document in Document.objects.filter(blob_id=self.id):
+                document.blob = new_blob
+                document.size = new_blob.size
+                document.checksum = new_blob.checksum
+                document.storage_format = FORMAT_CONTAINER
+                document.save(update_fields=['blob', 'size', 'checksum', 'storage_format'])
+                nb_reference += 1
+            nb_reference += DocumentVersion.objects.filter(blob_id=self.id, is_delta=False).update(blob=new_blob, size=new_blob.size, checksum=new_blob.checksum,
+                                                                                                  storage_format=FORMAT_CONTAINER)
+            Blob.objects.filter(id=new_blob.id).update(nb_reference=models.F('nb_reference') + nb_reference)
+            Blob.release(new_blob.id)
+            Blob.release(self.id, nb_reference)
+        return stored_size - new_stored_size
+
+    @classmethod
+    def release(cls, blob_id, nb_reference=1):
+        with transaction.atomic():
+            blob = cls.objects.select_for_update().filter(id=blob_id).first()
+            if blob is None:
+                return
+            blob.nb_reference -= nb_reference
+            if blob.nb_reference > 0:
+                blob.save(update_fields=['nb_reference'])
+            else:
+                blob.delete()
+
+    @classmethod
+    def release_all(cls, blob_ids):
+        for blob_id, nb_reference in Counter(blob_ids).items():
+            cls.release(blob_id, nb_reference)
+
+    @classmethod
+    def release_bulk(cls, blob_ids):
+        # set-based release: the files of the blobs no longer used are unlinked later by PendingUnlink.sweep
+        blob_ids_by_nb = {}
+        for blob_id, nb_reference in Counter(blob_ids).items():
+            blob_ids_by_nb.setdefault(nb_reference, []).append(blob_id)
+        released_ids = []
+        with transaction.atomic():
+            for nb_reference, ids in blob_ids_by_nb.items():
+                for index in range(0, len(ids), IMPORT_BATCH_SIZE):
+                    batch_ids = ids[index:index + IMPORT_BATCH_SIZE]
+                    cls.objects.filter(id__in=batch_ids).update(nb_reference=models.F('nb_reference') - nb_reference)
+                    released_ids.extend(cls.objects.filter(id__in=batch_ids, nb_reference__lte=0).values_list('id', flat=True))
+            for index in range(0, len(released_ids), IMPORT_BATCH_SIZE):
+                released = cls.objects.filter(id__in=released_ids[index:index + IMPORT_BATCH_SIZE])
+                PendingUnlink.objects.bulk_create([PendingUnlink(checksum=checksum) for checksum in released.values_list('checksum', flat=True)])
+                released.delete()
+        return len(released_ids)
+
+    def delete(self):
+        # unlinked once committed: a rolled back delete keeps its file
+        PendingUnlink.objects.create(checksum=self.checksum)
+        LucteriosModel.delete(self)
+        checksum = self.checksum
+        transaction.on_commit(lambda: PendingUnlink.sweep(checksum=checksum))
+
+    class Meta(object):
+        verbose_name = _('blob')
+        verbose_name_plural = _('blobs')
+        default_permissions = []
+
+
+class PendingUnlink(LucteriosModel):
+    """
+    File of a released blob.
+    Unlinked when the release is committed, or by the jobs worker after a bulk delete, unless a blob with the same checksum has been stored again meanwhile.
+    """
+    checksum = models.CharField(_('checksum'), max_length=64, db_index=True)
+    date_creation = models.DateTimeField(verbose_name=_('date creation'), default=timezone.now)
+
+    def __str__(self):
+        return self.checksum
+
+    @classmethod
+    def sweep(cls, limit=None, checksum=None):
+        # returns the number of pending files handled
+        pending_ids = cls.objects.order_by('id')
+        if checksum is not None:
+            pending_ids = pending_ids.filter(checksum=checksum)
+        pending_ids = pending_ids.values_list('id', flat=True)
+        if limit is not None:
+            pending_ids = pending_ids[:limit]
+        pending_ids = list(pending_ids)
+        for pending_id in pending_ids:
+            with transaction.atomic():
+                # locked until unlinked: Blob.store_files waits for it before reusing the file
+                pending = cls.objects.select_for_update().filter(id=pending_id).first()
+                if pending is None:
+                    continue
+                blob_name = find_blob_name(pending.checksum)
+                if (blob_name is not None) and not Blob.objects.filter(checksum=pending.checksum).exists():
+                    try:
+                        unlink(join(get_user_dir(), blob_name))
+                    except OSError as err:
+                        # left to the collector (documents_gc)
+                        getLogger('lucterios.documents').warning("blob %s not unlinked: %s", pending.checksum, err)
+                pending.delete()
+        return len(pending_ids)
+
+    class Meta(object):
+        verbose_name = _('pending unlink')
+        verbose_name_plural = _('pending unlinks')
+        default_permissions = []
 
 
 class Folder(LucteriosModel):
@@ -51,6 +337,10 @@ class Folder(LucteriosModel):
         LucteriosGroup, related_name="folder_viewer", verbose_name=_('viewer'), blank=True)
     modifier = models.ManyToManyField(
         LucteriosGroup, related_name="folder_modifier", verbose_name=_('modifier'), blank=True)
+    path = models.CharField(_('path'), max_length=PATH_MAX_LENGTH, blank=True, default='', db_index=True, editable=False)
+    quota = models.IntegerField(_('quota (Mo)'), default=0, help_text=_('0 for no limit'))
+    total_documents = models.IntegerField(_('total of documents'), default=0, editable=False)
+    total_size = models.BigIntegerField(_('total size'), default=0, editable=False)
 
     viewer__titles = [_("Available group viewers"), _("Chosen group viewers")]
     modifier__titles = [
@@ -58,11 +348,11 @@ class Folder(LucteriosModel):
 
     @classmethod
     def get_show_fields(cls):
-        return {_('001@Info'): ["name", "description", "parent"], _('001@Permission'): ["viewer", "modifier"]}
+        return {_('001@Info'): ["name", "description", "parent", "quota", ("total_documents", "total_size")], _('001@Permission'): ["viewer", "modifier"]}
 
     @classmethod
     def get_edit_fields(cls):
-        return {_('001@Info'): ["name", "description", "parent"], _('001@Permission'): ["viewer", "modifier"]}
+        return {_('001@Info'): ["name", "description", "parent", "quota"], _('001@Permission'): ["viewer", "modifier"]}
 
     @classmethod
     def get_search_fields(cls):
@@ -72,84 +362,175 @@ class Folder(LucteriosModel):
     def get_default_fields(cls):
         return ["name", "description", "parent"]
 
+    @classmethod
+    def check_path_length(cls, new_path, old_path=''):
+        # a moved folder takes its subtree with it: its deepest folder gets the longest path
+        path_length = len(new_path)
+        if old_path != '':
+            max_length = cls.objects.filter(path__startswith=old_path).aggregate(max_length=models.Max(Length('path')))['max_length']
+            path_length += (max_length or len(old_path)) - len(old_path)
+        if path_length > PATH_MAX_LENGTH:
+            raise LucteriosException(IMPORTANT, _("Folder tree too deep!"))
+
+    def get_path_from_parent(self):
+        if self.parent_id is None:
+            parent_path = PATH_SEPARATOR
+        else:
+            parent_path = Folder.objects.filter(id=self.parent_id).values_list('path', flat=True)[0]
+        return "%s%d%s" % (parent_path, self.id, PATH_SEPARATOR)
+
+    def get_ancestor_ids(self):
+        return get_path_ids(self.path)[:-1]
+
+    @classmethod
+    def get_branch_ids(cls, folder_id):
+        if folder_id is None:
+            return []
+        folder_path = cls.objects.filter(id=folder_id).values_list('path', flat=True).first()
+        if folder_path is None:
+            return []
+        return get_path_ids(folder_path)
+
+    @classmethod
+    def add_to_totals(cls, folder_id, nb_documents, size):
+        # the folder and all its ancestors
+        if (nb_documents != 0) or (size != 0):
+            cls.add_to_folders_totals(cls.get_branch_ids(folder_id), nb_documents, size)
+
+    @classmethod
+    def add_to_folders_totals(cls, folder_ids, nb_documents, size):
+        if len(folder_ids) > 0:
+            cls.objects.filter(id__in=folder_ids).update(total_documents=models.F('total_documents') + nb_documents,
+                                                         total_size=models.F('total_size') + size)
+
+    @classmethod
+    def check_quota(cls, folder_id, size, old_folder_id=None):
+        # when moved from old folder, the size is already in the totals of their common ancestors
+        if size <= 0:
+            return
+        folder_ids = set(cls.get_branch_ids(folder_id)) - set(cls.get_branch_ids(old_folder_id))
+        for folder_name, quota, total_size in cls.objects.filter(id__in=folder_ids, quota__gt=0).values_list('name', 'quota', 'total_size'):
+            if total_size + size > quota * 1024 * 1024:
+                raise LucteriosException(IMPORTANT, _("Quota of folder '%s' exceeded!") % folder_name)
+
+    def get_ancestors(self):
+        if self.path == '':
+            if self.parent is None:
+                return []
+            return self.parent.get_ancestors() + [self.parent]
+        ancestor_ids = self.get_ancestor_ids()
+        if len(ancestor_ids) == 0:
+            return []
+        ancestors = Folder.objects.in_bulk(ancestor_ids)
+        return [ancestors[folder_id] for folder_id in ancestor_ids if folder_id in ancestors]
+
+    def get_subtree_path(self):
+        # an empty path, of a folder missed by the migrations, would match every folder
+        if self.path == '':
+            raise LucteriosException(IMPORTANT, _("Folder without path!"))
+        return self.path
+
+    def get_subtree(self):
+        return Folder.objects.filter(path__startswith=self.get_subtree_path())
+
     def get_title(self):
-        title = ">" + self.name
-        if self.parent is not None:
-            title = self.parent.get_title() + \
-                title
+        title = ""
+        for folder in self.get_ancestors() + [self]:
+            title += ">" + folder.name
         return title
 
     def __str__(self):
         return self.get_title()
 
     def is_readonly(self, user):
-        readonly = True
-        for modifier_item in self.modifier.all():
-            if modifier_item in user.groups.all():
-                readonly = False
-        return readonly
+        return FolderAccess.for_user(user).is_readonly(self.id)
 
     def cannot_view(self, user):
-        cannotview = True
-        for viewer_item in self.viewer.all():
-            if viewer_item in user.groups.all():
-                cannotview = False
-        return cannotview
+        return FolderAccess.for_user(user).cannot_view(self.id)
 
     def delete(self):
-        file_paths = []
-        docs = self.document_set.all()
-        for doc in docs:
-            file_paths.append(
-                get_user_path("documents", "document_%s" % six.text_type(doc.id)))
+        subtree_path = self.get_subtree_path()
+        blob_ids = list(Document.objects.filter(folder__path__startswith=subtree_path).exclude(blob=None).values_list('blob_id', flat=True))
+        blob_ids.extend(DocumentVersion.objects.filter(document__folder__path__startswith=subtree_path).values_list('blob_id', flat=True))
         LucteriosModel.delete(self)
-        for file_path in file_paths:
-            if isfile(file_path):
-                unlink(file_path)
+        Blob.release_all(blob_ids)
 
     def import_files(self, dir_to_import, viewers, modifiers, user):
-        for filename in listdir(dir_to_import):
-            complet_path = join(dir_to_import, filename)
-            if isfile(complet_path):
-                new_doc = Document(
-                    name=filename, description=filename, folder_id=self.id)
-                if user.is_authenticated():
-                    new_doc.creator = LucteriosUser.objects.get(pk=user.id)
-                    new_doc.modifier = new_doc.creator
-                new_doc.date_modification = timezone.now()
-                new_doc.date_creation = new_doc.date_modification
-                new_doc.save()
-                file_path = get_user_path(
-                    "documents", "document_%s" % six.text_type(new_doc.id))
-                with ZipFile(file_path, 'w') as zip_ref:
-                    zip_ref.write(complet_path, arcname=filename)
-            elif isdir(complet_path):
-                new_folder = Folder.objects.create(
-                    name=filename, description=filename, parent_id=self.id)
-                new_folder.viewer = viewers
-                new_folder.modifier = modifiers
-                new_folder.save()
-                new_folder.import_files(complet_path, viewers, modifiers, user)
-
-    def extract_files(self, dir_to_extract):
-        for doc in Document.objects.filter(folder_id=self.id):
-            file_path = get_user_path(
-                "documents", "document_%s" % six.text_type(doc.id))
-            if isfile(file_path):
-                try:
-                    with ZipFile(file_path, 'r') as zip_ref:
-                        zip_ref.extractall(dir_to_extract)
-                except BadZipFile:
-                    pass
-        for folder in Folder.objects.filter(parent_id=self.id):
-            new_dir_to_extract = join(dir_to_extract, folder.name)
-            if not isdir(new_dir_to_extract):
-                makedirs(new_dir_to_extract)
-            folder.extract_files(new_dir_to_extract)
+        importer = DocumentImporter(self, viewers, modifiers, user)
+        importer.add_directory(dir_to_import)
+        return importer.run()
+
+    def import_archive(self, archive_file, viewers, modifiers, user):
+        with ZipFile(archive_file, 'r') as zip_ref:
+            importer = DocumentImporter(self, viewers, modifiers, user)
+            importer.add_archive(zip_ref, archive_file)
+            return importer.run()
+
+    def get_subtree_documents(self):
+        if self.id is None:
+            return Document.objects.all()
+        return Document.objects.filter(folder__path__startswith=self.get_subtree_path())
+
+    def get_fingerprint(self):
+        # any change of a folder or a document of the subtree gives a new fingerprint
+        fingerprint = sha256(six.text_type(self.id).encode('utf-8'))
+        if self.id is None:
+            folders = Folder.objects.all()
+        else:
+            folders = self.get_subtree()
+        for folder_values in folders.order_by('id').values_list('id', 'name', 'path').iterator():
+            fingerprint.update(("F%r" % (folder_values,)).encode('utf-8'))
+        for doc_values in self.get_subtree_documents().order_by('id').values_list('id', 'folder_id', 'name', 'checksum', 'date_modification').iterator():
+            fingerprint.update(("D%r" % (doc_values,)).encode('utf-8'))
+        return fingerprint.hexdigest()
+
+    def get_archive_sources(self, with_size=False):
+        # with_size: the size of the document is added to each source
+        documents = self.get_subtree_documents()
+        if self.id is None:
+            folders = Folder.objects.all()
+            root_ids = []
+        else:
+            folders = self.get_subtree()
+            root_ids = self.get_ancestor_ids() + [self.id]
+        folder_names = dict(folders.values_list('id', 'name'))
+        prefixes = {None: ''}
+        for folder_id, folder_path in folders.values_list('id', 'path'):
+            folder_ids = [int(item) for item in folder_path.split(PATH_SEPARATOR) if item != ''][len(root_ids):]
+            prefixes[folder_id] = ''.join([folder_names[item] + '/' for item in folder_ids])
+        for doc in documents.exclude(blob=None).select_related('blob').order_by('folder__path', 'id'):
+            if doc.blob.is_stored():
+                source = (doc.blob.get_path(), prefixes[doc.folder_id], doc.name, timezone.localtime(doc.date_modification).timetuple()[:6])
+                if with_size:
+                    source += (doc.size,)
+                yield source
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
         self.name = self.name[:250]
-        return LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        old_path = self.path
+        if (self.id is not None) and (update_fields is None) and not force_insert:
+            # totals are only changed by incremental updates
+            update_fields = [field.name for field in self._meta.concrete_fields
+                             if not field.primary_key and (field.name not in ('total_documents', 'total_size'))]
+        with transaction.atomic():
+            res = LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+            new_path = self.get_path_from_parent()
+            if new_path != old_path:
+                # checked before any path is rewritten: the save is cancelled with the transaction
+                Folder.check_path_length(new_path, old_path)
+                if old_path == '':
+                    Folder.objects.filter(id=self.id).update(path=new_path)
+                else:
+                    Folder.objects.filter(path__startswith=old_path).update(
+                        path=Concat(models.Value(new_path), Substr('path', len(old_path) + 1), output_field=models.CharField()))
+                    self._move_totals(get_path_ids(old_path)[:-1], get_path_ids(new_path)[:-1])
+        self.path = new_path
+        return res
+
+    def _move_totals(self, old_ancestor_ids, new_ancestor_ids):
+        nb_documents, size = Folder.objects.filter(id=self.id).values_list('total_documents', 'total_size')[0]
+        Folder.add_to_folders_totals(list(set(old_ancestor_ids) - set(new_ancestor_ids)), -nb_documents, -size)
+        Folder.add_to_folders_totals(list(set(new_ancestor_ids) - set(old_ancestor_ids)), nb_documents, size)
 
     class Meta(object):
         verbose_name = _('folder')
@@ -157,6 +538,62 @@ class Folder(LucteriosModel):
         ordering = ['parent__name', 'name']
 
 
+class FolderAccess(object):
+    """
+    Resolve view/modify rights of a user on folders.
+    User groups are loaded once, rights of folders are loaded by batch and kept in memory.
+    """
+    # increased by any change of rights: the resolvers kept on users are then loaded again
+    generation = 0
+
+    def __init__(self, user):
+        self.generation = FolderAccess.generation
+        self.user = user
+        self.group_ids = set(user.groups.values_list('id', flat=True))
+        self.viewer_groups = {}
+        self.modifier_groups = {}
+
+    @classmethod
+    def for_user(cls, user):
+        # kept on the user: a grid of folders resolves the groups and the rights once for all its rows
+        access = getattr(user, 'folder_access', None)
+        if (access is None) or (access.generation != cls.generation):
+            access = cls(user)
+            user.folder_access = access
+        return access
+
+    @classmethod
+    def for_request(cls, request):
+        access = getattr(request, 'folder_access', None)
+        if (access is None) or (access.user is not request.user):
+            access = cls(request.user)
+            request.folder_access = access
+        return access
+
+    @classmethod
+    def clear(cls):
+        cls.generation += 1
+
+    def load(self, folder_ids):
+        new_ids = set(folder_ids) - set(self.viewer_groups.keys())
+        if len(new_ids) > 0:
+            for folder_id in new_ids:
+                self.viewer_groups[folder_id] = set()
+                self.modifier_groups[folder_id] = set()
+            for folder_id, group_id in Folder.viewer.through.objects.filter(folder_id__in=new_ids).values_list('folder_id', 'lucteriosgroup_id'):
+                self.viewer_groups[folder_id].add(group_id)
+            for folder_id, group_id in Folder.modifier.through.objects.filter(folder_id__in=new_ids).values_list('folder_id', 'lucteriosgroup_id'):
+                self.modifier_groups[folder_id].add(group_id)
+
+    def cannot_view(self, folder_id):
+        self.load([folder_id])
+        return self.group_ids.isdisjoint(self.viewer_groups[folder_id])
+
+    def is_readonly(self, folder_id):
+        self.load([folder_id])
+        return self.group_ids.isdisjoint(self.modifier_groups[folder_id])
+
+
 class Document(LucteriosModel):
     is_simple_gui = True
 
@@ -172,10 +609,16 @@ class Document(LucteriosModel):
         'creator'), null=True, on_delete=models.CASCADE)
     date_creation = models.DateTimeField(
         verbose_name=_('date creation'), null=False)
+    size = models.BigIntegerField(_('size'), default=0, editable=False)
+    checksum = models.CharField(_('checksum'), max_length=64, blank=True, default='', editable=False)
+    mimetype = models.CharField(_('type'), max_length=100, blank=True, default='', editable=False)
+    storage_format = models.IntegerField(_('storage format'), choices=STORAGE_FORMATS, default=FORMAT_RAW, editable=False)
+    blob = models.ForeignKey(Blob, verbose_name=_('blob'), null=True, on_delete=models.PROTECT, editable=False)
 
     @classmethod
     def get_show_fields(cls):
-        return ["folder", "name", "description", ("modifier", "date_modification"), ("creator", "date_creation")]
+        return ["folder", "name", "description", ("modifier", "date_modification"), ("creator", "date_creation"),
+                ((_('size'), "size_text"), "mimetype"), ("storage_format", "checksum")]
 
     @classmethod
     def get_edit_fields(cls):
@@ -187,17 +630,79 @@ class Document(LucteriosModel):
 
     @classmethod
     def get_default_fields(cls):
-        return ["name", "description", "date_modification", "modifier"]
+        return ["name", "description", (_('size'), "size_text"), "mimetype", "date_modification", "modifier"]
 
     def __str__(self):
         return '[%s] %s' % (self.folder, self.name)
 
+    @property
+    def size_text(self):
+        return filesizeformat(self.size)
+
+    def is_consistent(self):
+        # checked against the metadata of the blob, the file itself is not read
+        return (self.blob is not None) and (self.blob.checksum == self.checksum) and (self.blob.size == self.size)
+
+    def get_thumbnail(self, size_name, generate=False):
+        if (self.blob_id is None) or not is_thumbnail_supported(self.mimetype):
+            return None
+        if generate:
+            return generate_thumbnail(self.blob.get_path(), self.checksum, size_name)
+        return get_cached_thumbnail(self.checksum, size_name)
+
+    def set_blob(self, blob, previous=None):
+        # previous: the document as saved before this change, archived as a version
+        if previous is None:
+            previous = self
+        released_id = previous.blob_id
+        if (previous.blob_id is not None) and (previous.checksum != blob.checksum):
+            if not DocumentVersion.archive(previous, blob).is_delta:
+                # the reference of the document on its blob went to the new version
+                released_id = None
+        self.blob = blob
+        self.size = blob.size
+        self.checksum = blob.checksum
+        self.storage_format, self.mimetype = describe_file(blob.get_path(), self.name)
+        self.save(update_fields=['blob', 'size', 'checksum', 'storage_format', 'mimetype'])
+        if released_id is not None:
+            # once the document no longer points at it
+            Blob.release(released_id)
+
+    def get_content(self):
+        return read_stored_content(self.blob.get_path())
+
     def delete(self):
-        file_path = get_user_path("documents", "document_%s" % six.text_type(
-            self.id))
+        blob_ids = list(self.documentversion_set.values_list('blob_id', flat=True))
+        if self.blob_id is not None:
+            blob_ids.append(self.blob_id)
         LucteriosModel.delete(self)
-        if isfile(file_path):
-            unlink(file_path)
+        Blob.release_all(blob_ids)
+
+    @classmethod
+    def delete_all(cls, document_ids):
+        """
+        Delete documents with set-based queries, by batch in one transaction.
+        Counters and totals are updated once by folder, the files of the released blobs are unlinked later.
+        """
+        document_ids = list(document_ids)
+        nb_deleted = 0
+        with transaction.atomic():
+            for index in range(0, len(document_ids), IMPORT_BATCH_SIZE):
+                documents = cls.objects.filter(id__in=document_ids[index:index + IMPORT_BATCH_SIZE])
+                blob_ids = list(documents.exclude(blob=None).values_list('blob_id', flat=True))
+                blob_ids.extend(DocumentVersion.objects.filter(document__in=documents).values_list('blob_id', flat=True))
+                folder_totals = documents.order_by().values('folder_id').annotate(nb_documents=models.Count('id'), size=models.Sum('size'))
+                for folder_id, nb_documents, size in folder_totals.values_list('folder_id', 'nb_documents', 'size'):
+                    DocumentCounter.add(folder_id, -nb_documents)
+                    Folder.add_to_totals(folder_id, -nb_documents, -size)
+                    nb_deleted += nb_documents
+                bulk_deletion.active = True
+                try:
+                    documents.delete()
+                finally:
+                    bulk_deletion.active = False
+                Blob.release_bulk(blob_ids)
+        return nb_deleted
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
         self.name = self.name[:250]
@@ -207,3 +712,806 @@ class Document(LucteriosModel):
         verbose_name = _('document')
         verbose_name_plural = _('documents')
         ordering = ['folder__name', 'name']
+
+
+class DocumentVersion(LucteriosModel):
+    """
+    Former content of a document.
+    Stored whole, or as a delta against the content of the next version (the document itself for the last one).
+    """
+    document = models.ForeignKey(Document, verbose_name=_('document'), on_delete=models.CASCADE)
+    number = models.IntegerField(_('version'))
+    name = models.CharField(_('name'), max_length=250)
+    modifier = models.ForeignKey(LucteriosUser, related_name="version_modifier", verbose_name=_('modifier'), null=True, on_delete=models.SET_NULL)
+    date_modification = models.DateTimeField(verbose_name=_('date modification'), null=False)
+    size = models.BigIntegerField(_('size'), default=0)
+    checksum = models.CharField(_('checksum'), max_length=64, blank=True, default='')
+    mimetype = models.CharField(_('type'), max_length=100, blank=True, default='')
+    storage_format = models.IntegerField(_('storage format'), choices=STORAGE_FORMATS, default=FORMAT_RAW)
+    blob = models.ForeignKey(Blob, verbose_name=_('blob'), on_delete=models.PROTECT)
+    is_delta = models.BooleanField(_('delta'), default=False)
+
+    @classmethod
+    def get_default_fields(cls):
+        return ["number", "name", (_('size'), "size_text"), "date_modification", "modifier"]
+
+    def __str__(self):
+        return "%s #%d" % (self.name, self.number)
+
+    @property
+    def size_text(self):
+        return filesizeformat(self.size)
+
+    @classmethod
+    def archive(cls, document, new_blob):
+        """
+        Keep the content of document, about to be replaced by new_blob.
+        The reference of document on its blob goes to the new version, unless it is stored as a delta:
+        the blob is then released by the caller, once the document points at new_blob.
+        """
+        number = (cls.objects.filter(document_id=document.id).aggregate(number=models.Max('number'))['number'] or 0) + 1
+        version = cls(document_id=document.id, number=number, name=document.name, modifier_id=document.modifier_id,
+                      date_modification=document.date_modification, size=document.size, checksum=document.checksum,
+                      mimetype=document.mimetype, storage_format=document.storage_format, blob_id=document.blob_id)
+        if (number % VERSION_SNAPSHOT_INTERVAL) != 0:
+            delta = cls.get_delta(document.blob, new_blob)
+            if delta is not None:
+                version.blob = Blob.store_chunks([delta])
+                version.is_delta = True
+        version.save()
+        return version
+
+    @classmethod
+    def get_delta(cls, old_blob, new_blob):
+        if (old_blob.size > DELTA_MAX_FILE_SIZE) or (new_blob.size > DELTA_MAX_FILE_SIZE) or not old_blob.is_stored() or not new_blob.is_stored():
+            return None
+        old_content = read_stored_content(old_blob.get_path())
+        new_content = read_stored_content(new_blob.get_path())
+        if max(len(old_content), len(new_content)) > DELTA_MAX_FILE_SIZE:
+            return None
+        delta = make_delta(new_content, old_content)
+        if len(delta) > (len(old_content) * DELTA_MAX_RATIO):
+            return None
+        return delta
+
+    def get_content(self):
+        # from the first version kept whole above this one: at most VERSION_SNAPSHOT_INTERVAL - 1 deltas
+        # versions and contents of a delta chain are never bigger than DELTA_MAX_FILE_SIZE
+        deltas = []
+        content = None
+        for version in DocumentVersion.objects.filter(document_id=self.document_id, number__gte=self.number).order_by('number').select_related('blob'):
+            if not version.is_delta:
+                content = read_stored_content(version.blob.get_path())
+                break
+            deltas.append(version)
+        if content is None:
+            content = self.document.get_content()
+        for version in reversed(deltas):
+            content = apply_delta(content, read_stored_content(version.blob.get_path()))
+        return content
+
+    def iter_content(self):
+        # a whole version is read by chunks, only a delta one is rebuilt in memory
+        if self.is_delta:
+            return iter([self.get_content()])
+        return iter_stored_content(self.blob.get_path())
+
+    def get_next(self):
+        # the next version, the document itself for the last one
+        next_version = DocumentVersion.objects.filter(document_id=self.document_id, number=self.number + 1).first()
+        if next_version is None:
+            return self.document
+        return next_version
+
+    def restore(self, user):
+        Folder.check_quota(self.document.folder_id, self.size - self.document.size)
+        blob = Blob.store_document(self.iter_content(), self.name, self.mimetype)
+        previous = Document.objects.get(id=self.document_id)
+        document = Document.objects.get(id=self.document_id)
+        document.name = self.name
+        if (user is not None) and user.is_authenticated():
+            document.modifier = LucteriosUser.objects.get(pk=user.id)
+        else:
+            document.modifier = None
+        document.date_modification = timezone.now()
+        document.save()
+        document.set_blob(blob, previous)
+        return document
+
+    class Meta(object):
+        verbose_name = _('version')
+        verbose_name_plural = _('versions')
+        ordering = ['document', '-number']
+        unique_together = (('document', 'number'),)
+        default_permissions = []
+
+
+class DocumentCounter(LucteriosModel):
+    """
+    Number of documents directly in a folder (the root for an empty folder).
+    Kept up to date by signals, so the summaries never count the documents.
+    """
+    folder = models.OneToOneField(Folder, verbose_name=_('folder'), null=True, on_delete=models.CASCADE)
+    nb_documents = models.IntegerField(_('number of documents'), default=0)
+
+    def __str__(self):
+        return six.text_type(self.nb_documents)
+
+    @classmethod
+    def add(cls, folder_id, nb_documents):
+        if (nb_documents == 0) or (cls.objects.filter(folder_id=folder_id).update(nb_documents=models.F('nb_documents') + nb_documents) > 0):
+            return
+        if nb_documents > 0:
+            # no counter yet for this folder
+            try:
+                with transaction.atomic():
+                    cls.objects.create(folder_id=folder_id, nb_documents=nb_documents)
+            except IntegrityError:
+                cls.objects.filter(folder_id=folder_id).update(nb_documents=models.F('nb_documents') + nb_documents)
+
+    @classmethod
+    def add_all(cls, folder_ids):
+        for folder_id, nb_documents in Counter(folder_ids).items():
+            cls.add(folder_id, nb_documents)
+
+    @classmethod
+    def count(cls, group_ids=None):
+        counters = cls.objects.all()
+        if group_ids is not None:
+            counters = counters.filter(Q(folder=None) | Q(folder__in=Folder.objects.filter(viewer__in=group_ids)))
+        return counters.aggregate(nb_documents=models.Sum('nb_documents'))['nb_documents'] or 0
+
+    class Meta(object):
+        verbose_name = _('document counter')
+        verbose_name_plural = _('document counters')
+        default_permissions = []
+
+
+@receiver(post_save, sender=Folder)
+@receiver(post_delete, sender=Folder)
+@receiver(m2m_changed, sender=Folder.viewer.through)
+@receiver(m2m_changed, sender=Folder.modifier.through)
+@receiver(m2m_changed, sender=LucteriosUser.groups.through)
+def folder_access_changed(sender, **kwargs):
+    # pylint: disable=unused-argument
+    FolderAccess.clear()
+
+
+@receiver(pre_save, sender=Document)
+def document_pre_save(sender, instance, **kwargs):
+    # pylint: disable=unused-argument
+    instance.old_values = None
+    update_fields = kwargs.get('update_fields')
+    if (instance.id is not None) and ((update_fields is None) or ('folder' in update_fields) or ('size' in update_fields)):
+        instance.old_values = Document.objects.filter(id=instance.id).values_list('folder_id', 'size').first()
+
+
+@receiver(post_save, sender=Document)
+def document_post_save(sender, instance, created, **kwargs):
+    # pylint: disable=unused-argument
+    if created:
+        DocumentCounter.add(instance.folder_id, 1)
+        Folder.add_to_totals(instance.folder_id, 1, instance.size)
+    elif getattr(instance, 'old_values', None) is not None:
+        old_folder_id, old_size = instance.old_values
+        if old_folder_id != instance.folder_id:
+            DocumentCounter.add(old_folder_id, -1)
+            DocumentCounter.add(instance.folder_id, 1)
+            Folder.add_to_totals(old_folder_id, -1, -old_size)
+            Folder.add_to_totals(instance.folder_id, 1, instance.size)
+        elif old_size != instance.size:
+            Folder.add_to_totals(instance.folder_id, 0, instance.size - old_size)
+
+
+# set by Document.delete_all, which updates the counters and totals by folder
+bulk_deletion = local()
+
+
+@receiver(post_delete, sender=Document)
+def document_post_delete(sender, instance, **kwargs):
+    # pylint: disable=unused-argument
+    if getattr(bulk_deletion, 'active', False):
+        return
+    DocumentCounter.add(instance.folder_id, -1)
+    Folder.add_to_totals(instance.folder_id, -1, -instance.size)
+
+
+class DocumentContent(LucteriosModel):
+    document = models.OneToOneField(Document, verbose_name=_('document'), primary_key=True, on_delete=models.CASCADE)
+    text = models.TextField(_('text'), blank=True, default='')
+    error = models.CharField(_('error'), max_length=200, blank=True, default='')
+    date_extraction = models.DateTimeField(verbose_name=_('date extraction'), null=True)
+    date_index = models.DateTimeField(verbose_name=_('date index'), null=True)
+    nb_words = models.IntegerField(_('number of words'), default=0)
+
+    def __str__(self):
+        return six.text_type(self.document)
+
+    @classmethod
+    def get_documents_to_extract(cls):
+        extracted_ids = cls.objects.filter(date_extraction=models.F('document__date_modification')).values_list('document_id', flat=True)
+        return Document.objects.exclude(id__in=extracted_ids)
+
+    @classmethod
+    def _get_extract_tasks(cls, document_ids):
+        for index in range(0, len(document_ids), IMPORT_BATCH_SIZE):
+            for document in Document.objects.filter(id__in=document_ids[index:index + IMPORT_BATCH_SIZE]).select_related('blob'):
+                if (document.blob is not None) and document.blob.is_stored():
+                    yield document, document.blob.get_path(), document.name
+                else:
+                    yield document, None, document.name
+
+    @classmethod
+    def extract_texts(cls, processes=EXTRACT_PROCESSES, timeout=EXTRACT_TIMEOUT):
+        # results are saved by batch: a new run resumes after the last saved batch
+        document_ids = list(cls.get_documents_to_extract().order_by('id').values_list('id', flat=True))
+        nb_documents = 0
+        for results in extract_batches(cls._get_extract_tasks(document_ids), processes, timeout):
+            with transaction.atomic():
+                for document, text, error in results:
+                    cls.objects.update_or_create(document_id=document.id, defaults={'text': text, 'error': error[:200],
+                                                                                    'date_extraction': document.date_modification})
+                    if error != '':
+                        getLogger('lucterios.documents').warning("text of %s not extracted: %s", document.name, error)
+            nb_documents += len(results)
+        return nb_documents
+
+    def update_words(self):
+        words = count_words(self.text)
+        with transaction.atomic():
+            ContentWord.objects.filter(document_id=self.document_id).delete()
+            ContentWord.objects.bulk_create([ContentWord(document_id=self.document_id, word=word, nb_occurrences=nb_occurrences)
+                                             for word, nb_occurrences in words.items()], batch_size=IMPORT_BATCH_SIZE)
+            self.date_index = self.date_extraction
+            self.nb_words = sum(words.values())
+            self.save(update_fields=['date_index', 'nb_words'])
+
+    @classmethod
+    def update_index(cls):
+        document_ids = [document_id for document_id, date_extraction, date_index
+                        in cls.objects.exclude(date_extraction=None).values_list('document_id', 'date_extraction', 'date_index')
+                        if date_index != date_extraction]
+        for document_id in document_ids:
+            cls.objects.get(document_id=document_id).update_words()
+        return len(document_ids)
+
+    class Meta(object):
+        verbose_name = _('document content')
+        verbose_name_plural = _('document contents')
+        default_permissions = []
+
+
+class ContentWord(LucteriosModel):
+    document = models.ForeignKey(Document, verbose_name=_('document'), on_delete=models.CASCADE)
+    word = models.CharField(_('word'), max_length=WORD_MAX_LENGTH, db_index=True)
+    nb_occurrences = models.IntegerField(_('number of occurrences'), default=1)
+
+    def __str__(self):
+        return self.word
+
+    @classmethod
+    def get_matching_documents(cls, text):
+        # ids of all documents containing all words of the text, as a subquery: not limited as the ranked search
+        words = set(get_words(text))
+        if len(words) == 0:
+            return cls.objects.none().values('document')
+        return cls.objects.filter(word__in=words).values('document').annotate(nb_words=models.Count('word')).filter(nb_words=len(words)).values('document')
+
+    @classmethod
+    def search(cls, text, max_results=SEARCH_MAX_RESULTS):
+        """
+        Best ranked documents containing all words of the text, best first.
+        The rank of a word in a document grows with its occurrences and the rarity of the word.
+        """
+        words = set(get_words(text))
+        if len(words) == 0:
+            return []
+        nb_documents = max(DocumentContent.objects.count(), 1)
+        ranks = None
+        for word in words:
+            occurrences = dict(cls.objects.filter(word=word).values_list('document_id', 'nb_occurrences'))
+            if ranks is not None:
+                occurrences = dict([(doc_id, nb_occurrences) for doc_id, nb_occurrences in occurrences.items() if doc_id in ranks])
+            if len(occurrences) == 0:
+                return []
+            rarity = log(1.0 + float(nb_documents) / len(occurrences))
+            new_ranks = {}
+            for doc_id, nb_occurrences in occurrences.items():
+                new_ranks[doc_id] = (ranks or {}).get(doc_id, 0.0) + rarity * nb_occurrences / (nb_occurrences + 1.2)
+            ranks = new_ranks
+        return sorted(ranks.items(), key=lambda item: (-item[1], item[0]))[:max_results]
+
+    class Meta(object):
+        verbose_name = _('word')
+        verbose_name_plural = _('words')
+        default_permissions = []
+        unique_together = (('document', 'word'),)
+
+
+class BlobCollector(object):
+    """
+    Mark and sweep of the stored blobs.
+    Blobs of the database, with their documents and versions counted by batch, and files of the storage directory
+    are both read in the order of checksums and merged: files without blob and blobs without reference are orphans.
+    A run stopped by its limit goes on from its cursor at the next one.
+    """
+
+    def __init__(self, remove=False, limit=None, grace_period=None):
+        self.remove = remove
+        self.limit = limit
+        if grace_period is None:
+            grace_period = GC_GRACE_PERIOD
+        self.limit_time = time() - grace_period
+        self.nb_checked = 0
+        self.nb_orphans = 0
+        self.nb_fixed = 0
+        self.nb_missing = 0
+        self.reclaimed = 0
+        self.purged = 0
+        self.cursor = ''
+
+    def iter_blobs(self, start_after):
+        # (checksum, blob id, number of references, number of documents and versions using it)
+        while True:
+            blobs = list(Blob.objects.filter(checksum__gt=start_after).order_by('checksum').values_list('checksum', 'id', 'nb_reference')[:IMPORT_BATCH_SIZE])
+            if len(blobs) == 0:
+                return
+            used = Counter()
+            for model in (Document, DocumentVersion):
+                users = model.objects.filter(blob_id__in=[blob_id for _checksum, blob_id, _nb_reference in blobs]).order_by()
+                for blob_id, nb_used in users.values('blob_id').annotate(nb_used=models.Count('id')).values_list('blob_id', 'nb_used'):
+                    used[blob_id] += nb_used
+            for checksum, blob_id, nb_reference in blobs:
+                yield checksum, blob_id, nb_reference, used[blob_id]
+            start_after = blobs[-1][0]
+
+    def is_old(self, file_path):
+        return getmtime(file_path) < self.limit_time
+
+    def discard_file(self, file_path):
+        self.reclaimed += getsize(file_path)
+        if self.remove:
+            unlink(file_path)
+        else:
+            quarantine_file(file_path)
+
+    def check_blob(self, blob_id, nb_reference, nb_used, file_path):
+        if (file_path is None) and (nb_used > 0):
+            self.nb_missing += 1
+        if (nb_used == nb_reference) and (nb_used > 0):
+            return
+        if (nb_used < nb_reference) and (file_path is not None) and not self.is_old(file_path):
+            # maybe stored or reused just now, its document not saved yet
+            return
+        with transaction.atomic():
+            blob = Blob.objects.select_for_update().filter(id=blob_id).first()
+            if blob is None:
+                return
+            nb_used = Document.objects.filter(blob_id=blob_id).count() + DocumentVersion.objects.filter(blob_id=blob_id).count()
+            if nb_used == 0:
+                Blob.objects.filter(id=blob_id).delete()
+                self.nb_orphans += 1
+            elif nb_used != blob.nb_reference:
+                blob.nb_reference = nb_used
+                blob.save(update_fields=['nb_reference'])
+                self.nb_fixed += 1
+        if (nb_used == 0) and (file_path is not None):
+            self.discard_file(file_path)
+
+    def clean_tmp_files(self):
+        # left by an upload or an import which stopped before storing its blob
+        root_dir = join(get_user_dir(), DOCUMENTS_DIR)
+        if isdir(root_dir):
+            for filename in listdir(root_dir):
+                file_path = join(root_dir, filename)
+                if filename.startswith('tmp_') and isfile(file_path) and self.is_old(file_path):
+                    self.nb_orphans += 1
+                    self.reclaimed += getsize(file_path)
+                    unlink(file_path)
+
+    def run(self, pause=0.0):
+        # returns True when all blobs have been checked
+        self.cursor = get_gc_cursor()
+        blobs = self.iter_blobs(self.cursor)
+        blob_files = iter_blob_files(self.cursor)
+        blob = next(blobs, None)
+        blob_file = next(blob_files, None)
+        while (blob is not None) or (blob_file is not None):
+            if (self.limit is not None) and (self.nb_checked >= self.limit):
+                set_gc_cursor(self.cursor)
+                return False
+            if (blob_file is None) or ((blob is not None) and (blob[0] < blob_file[0])):
+                self.check_blob(blob[1], blob[2], blob[3], None)
+                self.cursor = blob[0]
+                blob = next(blobs, None)
+            elif (blob is None) or (blob_file[0] < blob[0]):
+                # a second copy of the last blob is left to documents_reshard
+                if (blob_file[0] != self.cursor) and self.is_old(blob_file[1]):
+                    self.nb_orphans += 1
+                    self.discard_file(blob_file[1])
+                self.cursor = blob_file[0]
+                blob_file = next(blob_files, None)
+            else:
+                self.check_blob(blob[1], blob[2], blob[3], blob_file[1])
+                self.cursor = blob[0]
+                blob = next(blobs, None)
+                blob_file = next(blob_files, None)
+            self.nb_checked += 1
+            if (pause > 0) and ((self.nb_checked % IMPORT_BATCH_SIZE) == 0):
+                sleep(pause)
+        set_gc_cursor('')
+        self.clean_tmp_files()
+        self.purged = purge_quarantine()
+        return True
+
+
+class DocumentImporter(object):
+    """
+    Import a tree of files in a folder.
+    The tree is planned first, then folders, documents and permissions are inserted by batch.
+    """
+
+    def __init__(self, folder, viewers, modifiers, user):
+        self.folder = folder
+        self.viewer_ids = [group.id for group in viewers]
+        self.modifier_ids = [group.id for group in modifiers]
+        if (user is not None) and user.is_authenticated():
+            self.user = LucteriosUser.objects.get(pk=user.id)
+        else:
+            self.user = None
+        self.folder_ids = {(): folder.id}
+        if folder.id is None:
+            self.folder_paths = {(): PATH_SEPARATOR}
+        else:
+            self.folder_paths = {(): folder.path}
+        self.planned_folders = []
+        self.planned_files = []
+        self.archive_lock = Lock()
+        self.errors = []
+        self.progress = None
+
+    def add_folder(self, folder_names):
+        for level in range(1, len(folder_names) + 1):
+            if folder_names[:level] not in self.folder_ids:
+                self.folder_ids[folder_names[:level]] = None
+                self.planned_folders.append(folder_names[:level])
+
+    def add_file(self, folder_names, filename, writer, *args):
+        self.add_folder(folder_names)
+        self.planned_files.append((folder_names, filename, writer, args))
+
+    def add_directory(self, dir_to_import, folder_names=()):
+        for filename in sorted(listdir(dir_to_import)):
+            complet_path = join(dir_to_import, filename)
+            if isfile(complet_path):
+                self.add_file(folder_names, filename, write_compressed, complet_path, filename)
+            elif isdir(complet_path):
+                self.add_folder(folder_names + (filename,))
+                self.add_directory(complet_path, folder_names + (filename,))
+
+    def add_archive(self, zip_ref, archive_file):
+        if hasattr(archive_file, 'temporary_file_path'):
+            archive_file = archive_file.temporary_file_path()
+        infos = zip_ref.infolist()
+        if len(infos) > IMPORT_MAX_ENTRIES:
+            raise LucteriosException(IMPORTANT, _("Too many files in this archive (limit: %d)!") % IMPORT_MAX_ENTRIES)
+        if sum([info.file_size for info in infos]) > IMPORT_MAX_SIZE:
+            raise LucteriosException(IMPORTANT, _("Archive too big once uncompressed (limit: %d Mo)!") % (IMPORT_MAX_SIZE // (1024 * 1024)))
+        for info in infos:
+            names = tuple([name for name in info.filename.replace('\\', '/').split('/') if name not in ('', '.', '..')])
+            if info.filename.endswith('/'):
+                self.add_folder(names)
+            elif len(names) > 0:
+                self.add_file(names[:-1], names[-1], write_archive_member, archive_file, self.archive_lock, info, names[-1])
+
+    def _create_folders(self):
+        levels = {}
+        for folder_names in self.planned_folders:
+            levels.setdefault(len(folder_names), []).append(folder_names)
+        with transaction.atomic():
+            for depth in sorted(levels.keys()):
+                level_names = levels[depth]
+                token = "#%s%s" % (uuid4().hex, PATH_SEPARATOR)
+                Folder.objects.bulk_create([Folder(name=folder_names[-1][:250], description=folder_names[-1],
+                                                   parent_id=self.folder_ids[folder_names[:-1]], path="%s%d" % (token, index))
+                                            for index, folder_names in enumerate(level_names)], batch_size=IMPORT_BATCH_SIZE)
+                new_paths = {}
+                for folder_id, staging_path in Folder.objects.filter(path__startswith=token).values_list('id', 'path'):
+                    folder_names = level_names[int(staging_path[len(token):])]
+                    self.folder_ids[folder_names] = folder_id
+                    self.folder_paths[folder_names] = "%s%d%s" % (self.folder_paths[folder_names[:-1]], folder_id, PATH_SEPARATOR)
+                    Folder.check_path_length(self.folder_paths[folder_names])
+                    new_paths[folder_id] = self.folder_paths[folder_names]
+                folder_ids = list(new_paths.keys())
+                for index in range(0, len(folder_ids), IMPORT_BATCH_SIZE):
+                    batch_ids = folder_ids[index:index + IMPORT_BATCH_SIZE]
+                    Folder.objects.filter(id__in=batch_ids).update(path=models.Case(*[models.When(id=folder_id, then=models.Value(new_paths[folder_id])) for folder_id in batch_ids],
+                                                                                    output_field=models.CharField()))
+                Folder.viewer.through.objects.bulk_create([Folder.viewer.through(folder_id=folder_id, lucteriosgroup_id=group_id)
+                                                           for folder_id in folder_ids for group_id in self.viewer_ids], batch_size=IMPORT_BATCH_SIZE)
+                Folder.modifier.through.objects.bulk_create([Folder.modifier.through(folder_id=folder_id, lucteriosgroup_id=group_id)
+                                                             for folder_id in folder_ids for group_id in self.modifier_ids], batch_size=IMPORT_BATCH_SIZE)
+
+    def _create_documents(self, planned_files, first_index, pool, workspace):
+        file_jobs = [(planned_file, workspace.get_path("file_%d" % (first_index + index))) for index, planned_file in enumerate(planned_files)]
+        if pool is None:
+            written_files = [write_planned_file(file_job) for file_job in file_jobs]
+        else:
+            written_files = pool.map(write_planned_file, file_jobs)
+        tmp_files = []
+        stored_files = []
+        for planned_file, (tmp_path, size, checksum, description, error) in zip(planned_files, written_files):
+            if error is None:
+                tmp_files.append((tmp_path, size, checksum))
+                stored_files.append(planned_file + (description,))
+            else:
+                self.errors.append(('/'.join(planned_file[0] + (planned_file[1],)), error))
+        current_date = timezone.now()
+        with transaction.atomic():
+            blobs = Blob.store_files(tmp_files)
+            new_docs = []
+            for (folder_names, filename, _writer, _args, (storage_format, mimetype)), (_tmp_path, size, checksum) in zip(stored_files, tmp_files):
+                new_docs.append(Document(name=filename[:250], description=filename, folder_id=self.folder_ids[folder_names],
+                                         creator=self.user, modifier=self.user, date_modification=current_date, date_creation=current_date,
+                                         blob=blobs[checksum], size=size, checksum=checksum, storage_format=storage_format, mimetype=mimetype))
+            Document.objects.bulk_create(new_docs, batch_size=IMPORT_BATCH_SIZE)
+            DocumentCounter.add_all([new_doc.folder_id for new_doc in new_docs])
+            folder_sizes = {}
+            for new_doc in new_docs:
+                folder_sizes.setdefault(new_doc.folder_id, []).append(new_doc.size)
+            for folder_id, sizes in folder_sizes.items():
+                Folder.add_to_totals(folder_id, len(sizes), sum(sizes))
+        if self.progress is not None:
+            self.progress(len(planned_files), sum([size for _tmp_path, size, _checksum in tmp_files]))
+
+    def run(self):
+        self._create_folders()
+        if IMPORT_WORKERS > 1:
+            pool = ThreadPool(IMPORT_WORKERS)
+        else:
+            pool = None
+        try:
+            with Workspace() as workspace:
+                for index in range(0, len(self.planned_files), IMPORT_BATCH_SIZE):
+                    self._create_documents(self.planned_files[index:index + IMPORT_BATCH_SIZE], index, pool, workspace)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return self.errors
+
+
+class Job(LucteriosModel):
+    KIND_IMPORT = 0
+    KIND_EXTRACT = 1
+    KIND_THUMBNAIL = 2
+    STATUS_WAITING = 0
+    STATUS_RUNNING = 1
+    STATUS_DONE = 2
+    STATUS_FAILED = 3
+
+    kind = models.IntegerField(_('kind'), choices=((KIND_IMPORT, _('import')), (KIND_EXTRACT, _('extract')), (KIND_THUMBNAIL, _('preview'))),
+                               default=KIND_IMPORT)
+    status = models.IntegerField(_('status'), choices=((STATUS_WAITING, _('waiting')), (STATUS_RUNNING, _('running')),
+                                                       (STATUS_DONE, _('done')), (STATUS_FAILED, _('failed'))), default=STATUS_WAITING, db_index=True)
+    folder = models.ForeignKey(Folder, verbose_name=_('folder'), null=True, on_delete=models.CASCADE)
+    document = models.ForeignKey(Document, verbose_name=_('document'), null=True, on_delete=models.CASCADE)
+    user = models.ForeignKey(LucteriosUser, verbose_name=_('user'), null=True, on_delete=models.CASCADE)
+    viewer = models.ManyToManyField(LucteriosGroup, related_name="job_viewer", verbose_name=_('viewer'), blank=True)
+    modifier = models.ManyToManyField(LucteriosGroup, related_name="job_modifier", verbose_name=_('modifier'), blank=True)
+    nb_files = models.IntegerField(_('number of files'), default=0)
+    nb_files_done = models.IntegerField(_('files done'), default=0)
+    size = models.BigIntegerField(_('size'), default=0)
+    size_done = models.BigIntegerField(_('size done'), default=0)
+    date_creation = models.DateTimeField(verbose_name=_('date creation'), null=False)
+    date_start = models.DateTimeField(verbose_name=_('date start'), null=True)
+    date_end = models.DateTimeField(verbose_name=_('date end'), null=True)
+    message = models.TextField(_('message'), blank=True, default='')
+
+    def __str__(self):
+        return "%s #%d" % (self.get_kind_display(), self.id)
+
+    @classmethod
+    def _create(cls, kind, folder, user):
+        if user.is_authenticated():
+            user = LucteriosUser.objects.get(pk=user.id)
+        else:
+            user = None
+        return cls.objects.create(kind=kind, folder_id=None if folder is None else folder.id, user=user, date_creation=timezone.now())
+
+    @classmethod
+    def add_import(cls, folder, archive_file, viewers, modifiers, user):
+        job = cls._create(cls.KIND_IMPORT, folder, user)
+        job.viewer.add(*viewers)
+        job.modifier.add(*modifiers)
+        job_path = get_job_path(job.id)
+        write_chunks(read_chunks(archive_file), job_path)
+        job.size = getsize(job_path)
+        job.save(update_fields=['size'])
+        return job
+
+    @classmethod
+    def add_extract(cls, folder, user):
+        job = cls._create(cls.KIND_EXTRACT, folder, user)
+        if fetch_cached_archive(folder.get_fingerprint(), get_job_path(job.id)):
+            job._set_extract_totals()
+            job.nb_files_done = job.nb_files
+            job.size_done = job.size
+            job.status = cls.STATUS_DONE
+            job.date_start = job.date_creation
+            job.date_end = job.date_creation
+            job.save()
+        return job
+
+    @classmethod
+    def add_thumbnail(cls, document, user):
+        jobs = cls.objects.filter(kind=cls.KIND_THUMBNAIL, document_id=document.id)
+        # an image which cannot be decoded is not tried again before a new version of the document
+        job = jobs.filter(Q(status__in=(cls.STATUS_WAITING, cls.STATUS_RUNNING)) |
+                          Q(status=cls.STATUS_FAILED, date_creation__gte=document.date_modification)).first()
+        if job is None:
+            # a thumbnail evicted from the cache is made again
+            jobs.filter(status=cls.STATUS_DONE).delete()
+            job = cls._create(cls.KIND_THUMBNAIL, document.folder, user)
+            job.document = document
+            job.nb_files = 1
+            job.size = document.size
+            job.save(update_fields=['document', 'nb_files', 'size'])
+        return job
+
+    @classmethod
+    def take_next(cls):
+        # several workers can poll the queue: a job belongs to the one which switches its status
+        for job_id in cls.objects.filter(status=cls.STATUS_WAITING).order_by('id').values_list('id', flat=True):
+            if cls.objects.filter(id=job_id, status=cls.STATUS_WAITING).update(status=cls.STATUS_RUNNING, date_start=timezone.now()) == 1:
+                return cls.objects.get(id=job_id)
+        return None
+
+    def get_folder(self):
+        if self.folder_id is None:
+            return Folder()
+        return self.folder
+
+    def get_file_name(self):
+        return get_job_name(self.id)
+
+    def is_downloadable(self):
+        return (self.kind == self.KIND_EXTRACT) and (self.status == self.STATUS_DONE) and isfile(join(get_user_dir(), self.get_file_name()))
+
+    def get_eta(self):
+        if (self.status != self.STATUS_RUNNING) or (self.date_start is None) or (self.size_done == 0) or (self.size_done >= self.size):
+            return None
+        elapsed = (timezone.now() - self.date_start).total_seconds()
+        return int(elapsed * (self.size - self.size_done) / self.size_done)
+
+    def _progress(self, nb_files, size):
+        self.nb_files_done += nb_files
+        self.size_done += size
+        Job.objects.filter(id=self.id).update(nb_files_done=models.F('nb_files_done') + nb_files, size_done=models.F('size_done') + size)
+
+    def _run_import(self):
+        job_path = join(get_user_dir(), self.get_file_name())
+        try:
+            Folder.check_quota(self.folder_id, self.size)
+            with ZipFile(job_path, 'r') as zip_ref:
+                importer = DocumentImporter(self.get_folder(), self.viewer.all(), self.modifier.all(), self.user)
+                importer.add_archive(zip_ref, job_path)
+                self.nb_files = len(importer.planned_files)
+                self.save(update_fields=['nb_files'])
+                importer.progress = self._progress
+                errors = importer.run()
+        finally:
+            if isfile(job_path):
+                unlink(job_path)
+        if len(errors) > 0:
+            self.message = _("Some files have not been imported:{[br/]}%s") % "{[br/]}".join(["%s: %s" % error for error in errors])
+
+    def _extract_sources(self):
+        nb_files = 0
+        size = 0
+        last_time = time()
+        for source in self.get_folder().get_archive_sources(with_size=True):
+            yield source[:4]
+            nb_files += 1
+            # counted as the total of the job: sizes of the documents, not of their stored files
+            size += source[4]
+            if (time() - last_time) >= JOB_PROGRESS_DELAY:
+                self._progress(nb_files, size)
+                nb_files = 0
+                size = 0
+                last_time = time()
+        self._progress(nb_files, size)
+
+    def _set_extract_totals(self):
+        totals = self.get_folder().get_subtree_documents().exclude(blob=None).aggregate(nb_files=models.Count('id'), size=models.Sum('size'))
+        self.nb_files = totals['nb_files']
+        self.size = totals['size'] or 0
+
+    def _run_extract(self):
+        folder = self.get_folder()
+        fingerprint = folder.get_fingerprint()
+        job_path = get_job_path(self.id)
+        self._set_extract_totals()
+        if fetch_cached_archive(fingerprint, job_path):
+            self.nb_files_done = self.nb_files
+            self.size_done = self.size
+            self.save(update_fields=['nb_files', 'size', 'nb_files_done', 'size_done'])
+            return
+        self.save(update_fields=['nb_files', 'size'])
+        with Workspace() as workspace:
+            tmp_path = workspace.get_path('extract.zip')
+            write_zip(self._extract_sources(), tmp_path)
+            rename(tmp_path, job_path)
+        if folder.get_fingerprint() == fingerprint:
+            # not modified while extracting
+            store_cached_archive(fingerprint, job_path)
+
+    def _run_thumbnail(self):
+        for size_name in ('preview', 'thumbnail'):
+            if self.document.get_thumbnail(size_name, True) is None:
+                raise LucteriosException(IMPORTANT, _("No preview for this document!"))
+        self._progress(1, self.size)
+
+    def run(self):
+        try:
+            if self.kind == self.KIND_IMPORT:
+                self._run_import()
+            elif self.kind == self.KIND_THUMBNAIL:
+                self._run_thumbnail()
+            else:
+                self._run_extract()
+            self.status = self.STATUS_DONE
+        except Exception as err:
+            self.status = self.STATUS_FAILED
+            self.message = six.text_type(err)
+        self.date_end = timezone.now()
+        self.save(update_fields=['status', 'message', 'date_end'])
+
+    class Meta(object):
+        verbose_name = _('job')
+        verbose_name_plural = _('jobs')
+        default_permissions = []
+
+
+@receiver(pre_delete, sender=Job)
+def job_pre_delete(sender, instance, **kwargs):
+    # pylint: disable=unused-argument
+    # also for the jobs deleted with their folder: the file is unlinked once committed
+    job_path = join(get_user_dir(), instance.get_file_name())
+
+    def unlink_job_file():
+        if isfile(job_path):
+            unlink(job_path)
+    transaction.on_commit(unlink_job_file)
+
+
+def write_archive_member(archive_file, archive_lock, info, arcname, tmp_path):
+    # the member is copied raw, then decompressed into a container out of the lock
+    member_path = tmp_path + '.member'
+    content_path = tmp_path + '.content'
+    try:
+        if isinstance(archive_file, six.string_types):
+            with open(archive_file, 'rb') as raw_file:
+                write_member(raw_file, info, arcname, member_path)
+        else:
+            with archive_lock:
+                write_member(archive_file, info, arcname, member_path)
+        extract_content(member_path, content_path)
+        write_compressed(content_path, arcname, tmp_path)
+    finally:
+        for file_path in (member_path, content_path):
+            if isfile(file_path):
+                unlink(file_path)
+
+
+def write_planned_file(file_job):
+    # run in a worker thread: file system only, no database access
+    (_folder_names, filename, writer, args), tmp_path = file_job
+    try:
+        writer(*(args + (tmp_path,)))
+        size, checksum = content_checksum(tmp_path)
+        return tmp_path, size, checksum, describe_file(tmp_path, filename), None
+    except Exception as err:
+        if isfile(tmp_path):
+            unlink(tmp_path)
+        return None, 0, '', None, six.text_type(err)
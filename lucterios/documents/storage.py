@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+'''
+storage module of documents
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+from os import rename, unlink, makedirs, listdir, utime, stat
+from os.path import isfile, isdir, join, dirname, basename, getmtime, getsize
+from stat import S_ISREG
+from hashlib import sha256
+from binascii import hexlify
+from heapq import merge
+from itertools import chain
+from shutil import rmtree
+from time import time
+import re
+from uuid import uuid4
+from zipfile import ZipFile, is_zipfile
+try:
+    from os import link
+except ImportError:
+    link = None
+
+from django.conf import settings
+
+from lucterios.framework.filetools import get_user_dir, get_user_path
+from lucterios.documents.container import is_container, read_container, iter_container, get_container_header
+
+DOCUMENTS_DIR = "documents"
+WORKSPACE_DIR = "jobs"
+QUEUE_DIR = "queue"
+CACHE_DIR = "cache"
+THUMBNAIL_DIR = "thumbnails"
+QUARANTINE_DIR = "quarantine"
+DOWNLOAD_DIR = "downloads"
+SPECIAL_DIRS = (WORKSPACE_DIR, QUEUE_DIR, CACHE_DIR, THUMBNAIL_DIR, QUARANTINE_DIR, DOWNLOAD_DIR)
+GC_CURSOR_NAME = "gc_cursor"
+
+CHUNK_SIZE = 64 * 1024
+if hasattr(settings, 'DOCUMENTS_CHUNK_SIZE'):
+    CHUNK_SIZE = settings.DOCUMENTS_CHUNK_SIZE
+
+MAX_SHARD_LEVELS = 3
+SHARD_LEVELS = 2  # 2 levels of 256 buckets
+if hasattr(settings, 'DOCUMENTS_SHARD_LEVELS'):
+    SHARD_LEVELS = min(settings.DOCUMENTS_SHARD_LEVELS, MAX_SHARD_LEVELS)
+
+BLOB_NAME_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+BUCKET_NAME_PATTERN = re.compile(r'^[0-9a-f]{2}$')
+
+FORMAT_RAW = 0  # file stored as is
+FORMAT_ZIP = 1  # file stored in a zip archive, as imported or uploaded compressed
+FORMAT_CONTAINER = 2  # file stored in a container, see container module
+
+IMPORT_MAX_ENTRIES = 50000
+if hasattr(settings, 'DOCUMENTS_IMPORT_MAX_ENTRIES'):
+    IMPORT_MAX_ENTRIES = settings.DOCUMENTS_IMPORT_MAX_ENTRIES
+
+IMPORT_MAX_SIZE = 10 * 1024 * 1024 * 1024  # 10Go
+if hasattr(settings, 'DOCUMENTS_IMPORT_MAX_SIZE'):
+    IMPORT_MAX_SIZE = settings.DOCUMENTS_IMPORT_MAX_SIZE
+
+IMPORT_BATCH_SIZE = 500  # keep under the 999 variables of a SQLite query
+if hasattr(settings, 'DOCUMENTS_IMPORT_BATCH_SIZE'):
+    IMPORT_BATCH_SIZE = settings.DOCUMENTS_IMPORT_BATCH_SIZE
+
+IMPORT_WORKERS = 4
+if hasattr(settings, 'DOCUMENTS_IMPORT_WORKERS'):
+    IMPORT_WORKERS = settings.DOCUMENTS_IMPORT_WORKERS
+
+WORKSPACE_EXPIRY = 24 * 60 * 60  # 1 day
+if hasattr(settings, 'DOCUMENTS_WORKSPACE_EXPIRY'):
+    WORKSPACE_EXPIRY = settings.DOCUMENTS_WORKSPACE_EXPIRY
+
+JOB_PROGRESS_DELAY = 1.0  # seconds between two progress updates of a job
+if hasattr(settings, 'DOCUMENTS_JOB_PROGRESS_DELAY'):
+    JOB_PROGRESS_DELAY = settings.DOCUMENTS_JOB_PROGRESS_DELAY
+
+GC_GRACE_PERIOD = 60 * 60  # 1 hour: younger files can belong to a transaction not committed yet
+if hasattr(settings, 'DOCUMENTS_GC_GRACE_PERIOD'):
+    GC_GRACE_PERIOD = settings.DOCUMENTS_GC_GRACE_PERIOD
+
+QUARANTINE_EXPIRY = 7 * 24 * 60 * 60  # 1 week
+if hasattr(settings, 'DOCUMENTS_QUARANTINE_EXPIRY'):
+    QUARANTINE_EXPIRY = settings.DOCUMENTS_QUARANTINE_EXPIRY
+
+EXTRACT_CACHE_SIZE = 2 * 1024 * 1024 * 1024  # 2Go
+if hasattr(settings, 'DOCUMENTS_EXTRACT_CACHE_SIZE'):
+    EXTRACT_CACHE_SIZE = settings.DOCUMENTS_EXTRACT_CACHE_SIZE
+
+
+def read_chunks(file_obj, chunk_size=CHUNK_SIZE):
+    if hasattr(file_obj, 'chunks'):
+        for chunk in file_obj.chunks(chunk_size):
+            yield chunk
+    else:
+        chunk = file_obj.read(chunk_size)
+        while len(chunk) > 0:
+            yield chunk
+            chunk = file_obj.read(chunk_size)
+
+
+def get_storage_format(blob_path):
+    # a container is known by its signature, zip archives and raw files are from older versions
+    if is_container(blob_path):
+        return FORMAT_CONTAINER
+    if is_zipfile(blob_path):
+        return FORMAT_ZIP
+    return FORMAT_RAW
+
+
+def read_stored_content(blob_path):
+    # content of a stored document: decompressed from its container, the first member of a zip, else the file itself
+    storage_format = get_storage_format(blob_path)
+    if storage_format == FORMAT_CONTAINER:
+        return read_container(blob_path)
+    if storage_format == FORMAT_ZIP:
+        with ZipFile(blob_path, 'r') as zip_ref:
+            infos = [info for info in zip_ref.infolist() if not info.filename.endswith('/')]
+            if len(infos) == 0:
+                return b''
+            return zip_ref.read(infos[0])
+    with open(blob_path, 'rb') as blob_file:
+        return blob_file.read()
+
+
+def iter_stored_content(blob_path):
+    # content of a stored document by chunks, as read_stored_content
+    storage_format = get_storage_format(blob_path)
+    if storage_format == FORMAT_CONTAINER:
+        for chunk in iter_container(blob_path):
+            yield chunk
+    elif storage_format == FORMAT_ZIP:
+        with ZipFile(blob_path, 'r') as zip_ref:
+            infos = [info for info in zip_ref.infolist() if not info.filename.endswith('/')]
+            if len(infos) > 0:
+                with zip_ref.open(infos[0], 'r') as member_file:
+                    for chunk in read_chunks(member_file):
+                        yield chunk
+    else:
+        with open(blob_path, 'rb') as blob_file:
+            for chunk in read_chunks(blob_file):
+                yield chunk
+
+
+def write_chunks(chunks, file_path):
+    size = 0
+    checksum = sha256()
+    tmp_path = file_path + '.tmp'
+    try:
+        with open(tmp_path, "wb") as file_tmp:
+            for chunk in chunks:
+                file_tmp.write(chunk)
+                checksum.update(chunk)
+                size += len(chunk)
+        if isfile(file_path):
+            unlink(file_path)
+        rename(tmp_path, file_path)
+    finally:
+        if isfile(tmp_path):
+            unlink(tmp_path)
+    return size, checksum.hexdigest()
+
+
+def file_checksum(file_path):
+    size = 0
+    checksum = sha256()
+    with open(file_path, "rb") as file_read:
+        for chunk in read_chunks(file_read):
+            checksum.update(chunk)
+            size += len(chunk)
+    return size, checksum.hexdigest()
+
+
+def content_checksum(file_path):
+    # size and checksum of the content of a stored file: read from the header of a container
+    header = get_container_header(file_path)
+    if header is None:
+        return file_checksum(file_path)
+    return header.content_size, hexlify(header.checksum).decode('ascii')
+
+
+def get_blob_name(checksum, shard_levels=None):
+    if shard_levels is None:
+        shard_levels = SHARD_LEVELS
+    buckets = [checksum[level * 2:level * 2 + 2] for level in range(shard_levels)]
+    return join(DOCUMENTS_DIR, *(buckets + [checksum]))
+
+
+def find_blob_name(checksum):
+    user_dir = get_user_dir()
+    for shard_levels in [SHARD_LEVELS] + [level for level in range(MAX_SHARD_LEVELS + 1) if level != SHARD_LEVELS]:
+        blob_name = get_blob_name(checksum, shard_levels)
+        if isfile(join(user_dir, blob_name)):
+            return blob_name
+    return None
+
+
+def get_blob_path(checksum):
+    blob_path = join(get_user_dir(), get_blob_name(checksum))
+    if not isdir(dirname(blob_path)):
+        makedirs(dirname(blob_path))
+    return blob_path
+
+
+def get_tmp_blob_path():
+    return get_user_path(DOCUMENTS_DIR, "tmp_%s" % uuid4().hex)
+
+
+def get_job_name(job_id):
+    return join(DOCUMENTS_DIR, QUEUE_DIR, "job_%d.zip" % job_id)
+
+
+def get_job_path(job_id):
+    return get_user_path(join(DOCUMENTS_DIR, QUEUE_DIR), "job_%d.zip" % job_id)
+
+
+def link_file(source_path, target_path):
+    # hard link when possible: archives are never modified once written
+    if link is not None:
+        tmp_path = target_path + '.tmp'
+        try:
+            link(source_path, tmp_path)
+            rename(tmp_path, target_path)
+            return
+        except OSError:
+            if isfile(tmp_path):
+                unlink(tmp_path)
+    with open(source_path, 'rb') as source_file:
+        write_chunks(read_chunks(source_file), target_path)
+
+
+def get_cache_path(fingerprint):
+    return get_user_path(join(DOCUMENTS_DIR, CACHE_DIR), "%s.zip" % fingerprint)
+
+
+def fetch_cached_archive(fingerprint, file_path):
+    cache_path = get_cache_path(fingerprint)
+    if not isfile(cache_path):
+        return False
+    try:
+        utime(cache_path, None)
+        link_file(cache_path, file_path)
+    except (IOError, OSError):
+        # evicted by another process meanwhile
+        return False
+    return True
+
+
+def store_cached_archive(fingerprint, file_path, cache_size=None):
+    if cache_size is None:
+        cache_size = EXTRACT_CACHE_SIZE
+    if getsize(file_path) > cache_size:
+        return
+    cache_path = get_cache_path(fingerprint)
+    link_file(file_path, cache_path)
+    utime(cache_path, None)
+    evict_cached_archives(cache_size)
+
+
+def evict_cached_archives(cache_size):
+    evict_cached_files(join(get_user_dir(), DOCUMENTS_DIR, CACHE_DIR), cache_size)
+
+
+def evict_cached_files(cache_dir, cache_size):
+    # least recently used first: the cached files are touched when used
+    # hard links of the same file share its time and size: counted once and evicted together
+    files = {}
+    for filename in listdir(cache_dir):
+        cache_path = join(cache_dir, filename)
+        try:
+            file_stat = stat(cache_path)
+        except OSError:
+            continue
+        if S_ISREG(file_stat.st_mode):
+            file_key = (file_stat.st_dev, file_stat.st_ino) if file_stat.st_ino != 0 else cache_path
+            files.setdefault(file_key, [file_stat.st_mtime, file_stat.st_size, []])[2].append(cache_path)
+    entries = sorted(files.values())
+    total_size = sum([size for _mtime, size, _cache_paths in entries])
+    while (total_size > cache_size) and (len(entries) > 0):
+        _mtime, size, cache_paths = entries.pop(0)
+        for cache_path in cache_paths:
+            try:
+                unlink(cache_path)
+            except OSError:
+                pass
+        total_size -= size
+
+
+def is_blob_name(filename):
+    return BLOB_NAME_PATTERN.match(filename) is not None
+
+
+def iter_blob_files(start_after='', dir_path=None, prefix=''):
+    """
+    Stored blobs as (checksum, path), in the order of their checksums whatever the depth of their buckets.
+    Only one directory is listed at a time: buckets before start_after are not even listed.
+    """
+    if dir_path is None:
+        dir_path = join(get_user_dir(), DOCUMENTS_DIR)
+    if not isdir(dir_path):
+        return iter([])
+    files = []
+    buckets = []
+    for filename in listdir(dir_path):
+        file_path = join(dir_path, filename)
+        if is_blob_name(filename):
+            if (filename > start_after) and isfile(file_path):
+                files.append((filename, file_path))
+        elif (len(prefix) < MAX_SHARD_LEVELS * 2) and (BUCKET_NAME_PATTERN.match(filename) is not None):
+            bucket_prefix = prefix + filename
+            if (bucket_prefix >= start_after[:len(bucket_prefix)]) and isdir(file_path):
+                buckets.append(filename)
+    files.sort()
+    buckets.sort()
+    bucket_files = chain.from_iterable(iter_blob_files(start_after, join(dir_path, bucket), prefix + bucket) for bucket in buckets)
+    return merge(files, bucket_files)
+
+
+def get_gc_cursor():
+    # checksum of the last blob checked by an incremental run of the collector
+    cursor_path = join(get_user_dir(), DOCUMENTS_DIR, GC_CURSOR_NAME)
+    if not isfile(cursor_path):
+        return ''
+    with open(cursor_path, 'r') as cursor_file:
+        cursor = cursor_file.read().strip()
+    return cursor if is_blob_name(cursor) else ''
+
+
+def set_gc_cursor(cursor):
+    cursor_path = get_user_path(DOCUMENTS_DIR, GC_CURSOR_NAME)
+    if cursor == '':
+        if isfile(cursor_path):
+            unlink(cursor_path)
+    else:
+        with open(cursor_path, 'w') as cursor_file:
+            cursor_file.write(cursor)
+
+
+def quarantine_file(file_path):
+    # kept QUARANTINE_EXPIRY before being removed, in case it was wrongly detected as an orphan
+    quarantine_path = get_user_path(join(DOCUMENTS_DIR, QUARANTINE_DIR), basename(file_path))
+    rename(file_path, quarantine_path)
+    utime(quarantine_path, None)
+
+
+def purge_quarantine():
+    # returns the number of bytes freed
+    quarantine_dir = join(get_user_dir(), DOCUMENTS_DIR, QUARANTINE_DIR)
+    freed = 0
+    if isdir(quarantine_dir):
+        limit_time = time() - QUARANTINE_EXPIRY
+        for filename in listdir(quarantine_dir):
+            file_path = join(quarantine_dir, filename)
+            if isfile(file_path) and (getmtime(file_path) < limit_time):
+                freed += getsize(file_path)
+                unlink(file_path)
+    return freed
+
+
+class Workspace(object):
+    """
+    Private working directory of one import or export job, removed when the job ends.
+    It is in the documents directory, so its files can be renamed to blobs.
+    """
+
+    def __init__(self):
+        self.path = join(get_user_dir(), DOCUMENTS_DIR, WORKSPACE_DIR, uuid4().hex)
+
+    def __enter__(self):
+        self.clean_expired()
+        makedirs(self.path)
+        return self
+
+    def __exit__(self, *args):
+        rmtree(self.path, True)
+
+    def get_path(self, filename):
+        return join(self.path, filename)
+
+    @classmethod
+    def clean_expired(cls):
+        root_path = join(get_user_dir(), DOCUMENTS_DIR, WORKSPACE_DIR)
+        if isdir(root_path):
+            limit_time = time() - WORKSPACE_EXPIRY
+            for job_name in listdir(root_path):
+                job_path = join(root_path, job_name)
+                if isdir(job_path) and (getmtime(job_path) < limit_time):
+                    rmtree(job_path, True)
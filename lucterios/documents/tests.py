@@ -23,21 +23,40 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import unicode_literals
-from os.path import join, dirname, exists
-from shutil import rmtree, copyfile
+from os import rename, makedirs, unlink, listdir, utime
+from os.path import join, dirname, exists, isdir, getsize
+from zipfile import ZipFile
+from io import BytesIO
+from shutil import rmtree
+from hashlib import sha256
+from calendar import timegm
 
-from django.utils import formats, timezone
+from django.utils import formats, timezone, six
 from django.contrib.auth.models import Permission
+from django.core.management import call_command
+from django.db import transaction, connection
+from django.utils.six import StringIO
+from django.utils.http import http_date
 
 from lucterios.framework.test import LucteriosTest, add_empty_user
 from lucterios.framework.xfergraphic import XferContainerAcknowledge
-from lucterios.framework.filetools import get_user_path, get_user_dir
+from lucterios.framework.filetools import get_user_dir
+from lucterios.framework.error import LucteriosException
 
 from lucterios.CORE.models import LucteriosGroup, LucteriosUser
 
-from lucterios.documents.models import Folder, Document
+from lucterios.documents.models import DocumentVersion, Folder, Document, FolderAccess, Blob, DocumentImporter, Job, ContentWord, DocumentContent, DocumentCounter, \
+    BlobCollector, PendingUnlink
+from lucterios.documents.storage import THUMBNAIL_DIR, read_chunks, store_cached_archive, Workspace, DOCUMENTS_DIR, WORKSPACE_DIR, CACHE_DIR, \
+    QUARANTINE_DIR, DOWNLOAD_DIR, GC_CURSOR_NAME, get_blob_path
+from lucterios.documents.archive import iter_zip
+from lucterios.documents.container import CODEC_STORED, CODEC_DEFLATED, get_container_header, read_container, check_container
+from lucterios.documents.thumbnail import evict_thumbnails, get_cached_thumbnail, THUMBNAIL_SIZES
+from lucterios.documents.download import parse_range, file_response, get_offload_path, MODE_SENDFILE, MODE_ACCEL
+from lucterios.documents.content import extract_text, extract_batches
 from lucterios.documents.views import FolderList, FolderAddModify, FolderDel, \
-    DocumentList, DocumentAddModify, DocumentShow, DocumentDel, DocumentSearch
+    DocumentList, DocumentAddModify, DocumentShow, DocumentDel, DocumentSearch, FolderExtract, JobShow, \
+    DocumentDownload, DocumentThumbnail, DocumentVersionDiff, DocumentVersionRestore
 
 
 class FolderTest(LucteriosTest):
@@ -73,10 +92,11 @@ class FolderTest(LucteriosTest):
         self.call('/lucterios.documents/folderAddModify', {}, False)
         self.assert_observer('core.custom', 'lucterios.documents', 'folderAddModify', 1)
         self.assert_xml_equal('TITLE', 'Ajouter un dossier')
-        self.assert_count_equal('COMPONENTS/*', 22)
+        self.assert_count_equal('COMPONENTS/*', 24)
         self.assert_comp_equal('COMPONENTS/EDIT[@name="name"]', None, (0, 0, 1, 1, 1))
         self.assert_comp_equal('COMPONENTS/MEMO[@name="description"]', None, (0, 1, 1, 1, 1))
         self.assert_comp_equal('COMPONENTS/SELECT[@name="parent"]', '0', (0, 2, 1, 1, 1))
+        self.assert_comp_equal('COMPONENTS/FLOAT[@name="quota"]', '0', (0, 3, 1, 1, 1))
         self.assert_count_equal('COMPONENTS/SELECT[@name="parent"]/CASE', 1)
         self.assert_coordcomp_equal('COMPONENTS/CHECKLIST[@name="viewer_available"]', (0, 1, 1, 5, 2))
         self.assert_coordcomp_equal('COMPONENTS/CHECKLIST[@name="viewer_chosen"]', (2, 1, 1, 5, 2))
@@ -133,6 +153,56 @@ class FolderTest(LucteriosTest):
         self.assert_observer('core.custom', 'lucterios.documents', 'folderList', 1)
         self.assert_count_equal('COMPONENTS/GRID[@name="folder"]/RECORD', 0)
 
+    def test_path(self):
+        folder1 = Folder.objects.create(name='aaa', description='aaa')
+        folder2 = Folder.objects.create(name='bbb', description='bbb', parent=folder1)
+        folder3 = Folder.objects.create(name='ccc', description='ccc', parent=folder2)
+        self.assertEqual(folder1.path, '/1/')
+        self.assertEqual(folder2.path, '/1/2/')
+        self.assertEqual(folder3.path, '/1/2/3/')
+        self.assertEqual(Folder.objects.get(id=3).get_title(), '>aaa>bbb>ccc')
+        self.assertEqual(len(folder1.get_subtree()), 3)
+
+        folder2.parent = None
+        folder2.save()
+        self.assertEqual(Folder.objects.get(id=2).path, '/2/')
+        self.assertEqual(Folder.objects.get(id=3).path, '/2/3/')
+        self.assertEqual(Folder.objects.get(id=3).get_title(), '>bbb>ccc')
+        self.assertEqual(len(folder1.get_subtree()), 1)
+        self.assertEqual(len(folder2.get_subtree()), 2)
+
+        # never a subtree of every folder
+        Folder.objects.filter(id=3).update(path='')
+        folder3 = Folder.objects.get(id=3)
+        self.assertRaises(LucteriosException, folder3.get_subtree)
+        self.assertRaises(LucteriosException, folder3.delete)
+        self.assertEqual(Folder.objects.count(), 3)
+
+    def test_deep_move(self):
+        parent = None
+        for index in range(40):
+            parent = Folder.objects.create(name='a%d' % index, description='a%d' % index, parent=parent)
+        deepest1 = parent
+        self.assertEqual(len(deepest1.path), 112)
+        parent = None
+        for index in range(50):
+            parent = Folder.objects.create(name='b%d' % index, description='b%d' % index, parent=parent)
+        deepest2 = parent
+        self.assertEqual(len(deepest2.path), 151)
+
+        root2 = Folder.objects.get(id=41)
+        root2.parent = deepest1
+        self.assertRaises(LucteriosException, root2.save)
+        self.assertEqual(Folder.objects.get(id=41).parent_id, None)
+        self.assertEqual(Folder.objects.get(id=41).path, '/41/')
+        self.assertEqual(Folder.objects.get(id=90).path, deepest2.path)
+
+        root2 = Folder.objects.get(id=41)
+        root2.parent = Folder.objects.get(id=30)
+        root2.save()
+        self.assertEqual(Folder.objects.get(id=41).path, Folder.objects.get(id=30).path + '41/')
+        self.assertEqual(len(Folder.objects.get(id=90).path), 232)
+
 
 class DocumentTest(LucteriosTest):
 
@@ -170,11 +240,6 @@ class DocumentTest(LucteriosTest):
         folder4.save()
 
     def create_doc(self):
-        file_path = join(dirname(__file__), 'static',
-                         'lucterios.documents', 'images', 'documentFind.png')
-        copyfile(file_path, get_user_path('documents', 'document_1'))
-        copyfile(file_path, get_user_path('documents', 'document_2'))
-        copyfile(file_path, get_user_path('documents', 'document_3'))
         current_date = timezone.now()
         new_doc1 = Document.objects.create(name='doc1.png', description="doc 1", creator=self.factory.user,
                                            date_creation=current_date, date_modification=current_date)
@@ -188,6 +253,11 @@ class DocumentTest(LucteriosTest):
                                            date_creation=current_date, date_modification=current_date)
         new_doc3.folder = Folder.objects.get(id=4)
         new_doc3.save()
+        file_path = join(dirname(__file__), 'static',
+                         'lucterios.documents', 'images', 'documentFind.png')
+        for new_doc in (new_doc1, new_doc2, new_doc3):
+            with open(file_path, 'rb') as file_to_load:
+                new_doc.set_blob(Blob.store_chunks(read_chunks(file_to_load)))
         return current_date
 
     def test_list(self):
@@ -203,9 +273,12 @@ class DocumentTest(LucteriosTest):
         self.assert_action_equal('ACTIONS/ACTION', ('Fermer', 'images/close.png'))
         self.assert_count_equal('COMPONENTS/*', 9)
         self.assert_coordcomp_equal('COMPONENTS/GRID[@name="document"]', (2, 2, 2, 2))
-        self.assert_count_equal('COMPONENTS/GRID[@name="document"]/HEADER', 4)
+        self.assert_count_equal('COMPONENTS/GRID[@name="document"]/HEADER', 7)
         self.assert_xml_equal('COMPONENTS/GRID[@name="document"]/HEADER[@name="name"]', "nom")
         self.assert_xml_equal('COMPONENTS/GRID[@name="document"]/HEADER[@name="description"]', "description")
+        self.assert_xml_equal('COMPONENTS/GRID[@name="document"]/HEADER[@name="size_text"]', "taille")
+        self.assert_xml_equal('COMPONENTS/GRID[@name="document"]/HEADER[@name="mimetype"]', "type")
+        self.assert_xml_equal('COMPONENTS/GRID[@name="document"]/HEADER[@name="thumbnail"]', "aperçu")
         self.assert_xml_equal('COMPONENTS/GRID[@name="document"]/HEADER[@name="date_modification"]', "date de modification")
         self.assert_xml_equal('COMPONENTS/GRID[@name="document"]/HEADER[@name="modifier"]', "modificateur")
         self.assert_count_equal('COMPONENTS/GRID[@name="document"]/RECORD', 0)
@@ -262,7 +335,7 @@ class DocumentTest(LucteriosTest):
     def test_addsave(self):
         self.factory.user = LucteriosUser.objects.get(username='empty')
 
-        self.assertFalse(exists(get_user_path('documents', 'document_1')))
+        self.assertEqual(len(Blob.objects.all()), 0)
         file_path = join(dirname(__file__), 'static', 'lucterios.documents', 'images', 'documentFind.png')
 
         docs = Document.objects.all()
@@ -283,7 +356,18 @@ class DocumentTest(LucteriosTest):
         self.assertEqual(docs[0].creator.username, "empty")
         self.assertEqual(docs[0].modifier.username, "empty")
         self.assertEqual(docs[0].date_creation, docs[0].date_modification)
-        self.assertTrue(exists(get_user_path('documents', 'document_1')))
+        self.assertEqual(docs[0].blob.nb_reference, 1)
+        self.assertTrue(exists(docs[0].blob.get_path()))
+        checksum = docs[0].checksum
+        self.assertEqual(docs[0].blob.get_name(), join('documents', checksum[0:2], checksum[2:4], checksum))
+        with open(file_path, 'rb') as file_to_load:
+            content = file_to_load.read()
+        self.assertEqual(docs[0].get_content(), content)
+        self.assertEqual(docs[0].size, len(content))
+        self.assertEqual(docs[0].checksum, sha256(content).hexdigest())
+        self.assertEqual((docs[0].storage_format, docs[0].mimetype), (2, 'image/png'))
+        header = get_container_header(docs[0].blob.get_path())
+        self.assertEqual((header.name, header.codec, header.content_size), ('', CODEC_STORED, len(content)))
 
     def test_saveagain(self):
         current_date = self.create_doc()
@@ -292,7 +376,7 @@ class DocumentTest(LucteriosTest):
         self.call('/lucterios.documents/documentShow', {"document": "1"}, False)
         self.assert_observer('core.custom', 'lucterios.documents', 'documentShow')
         self.assert_xml_equal('TITLE', "Afficher le document")
-        self.assert_count_equal('COMPONENTS/*', 9)
+        self.assert_count_equal('COMPONENTS/*', 14)
         self.assert_comp_equal('COMPONENTS/LABELFORM[@name="folder"]', ">truc2", (1, 0, 2, 1))
         self.assert_comp_equal('COMPONENTS/LABELFORM[@name="name"]', "doc1.png", (1, 1, 2, 1))
         self.assert_comp_equal('COMPONENTS/LABELFORM[@name="description"]', "doc 1", (1, 2, 2, 1))
@@ -300,6 +384,10 @@ class DocumentTest(LucteriosTest):
         self.assert_comp_equal('COMPONENTS/LABELFORM[@name="date_modification"]', formats.date_format(current_date, "DATETIME_FORMAT"), (2, 3, 1, 1))
         self.assert_comp_equal('COMPONENTS/LABELFORM[@name="creator"]', "empty", (1, 4, 1, 1))
         self.assert_comp_equal('COMPONENTS/LABELFORM[@name="date_creation"]', formats.date_format(current_date, "DATETIME_FORMAT"), (2, 4, 1, 1))
+        self.assert_comp_equal('COMPONENTS/LABELFORM[@name="mimetype"]', "image/png", (2, 5, 1, 1))
+        self.assert_comp_equal('COMPONENTS/LABELFORM[@name="storage_format"]', "brut", (1, 6, 1, 1))
+        self.assert_coordcomp_equal('COMPONENTS/DOWNLOAD[@name="filename"]', (1, 7, 4, 1))
+        self.assert_xml_equal('COMPONENTS/DOWNLOAD[@name="filename"]/FILENAME', 'lucterios.documents/documentDownload?document=1')
         self.assert_count_equal('ACTIONS/ACTION', 2)
 
         self.factory.xfer = DocumentAddModify()
@@ -324,7 +412,9 @@ class DocumentTest(LucteriosTest):
         self.assert_xml_equal('COMPONENTS/GRID[@name="document"]/RECORD[@id="1"]/VALUE[@name="description"]', "doc 1")
         self.assert_xml_equal('COMPONENTS/GRID[@name="document"]/RECORD[@id="1"]/VALUE[@name="date_modification"]', formats.date_format(current_date, "DATETIME_FORMAT"))
         self.assert_xml_equal('COMPONENTS/GRID[@name="document"]/RECORD[@id="1"]/VALUE[@name="modifier"]', "---")
-        self.assertTrue(exists(get_user_path('documents', 'document_1')))
+        blob_path = Document.objects.get(id=1).blob.get_path()
+        self.assertTrue(exists(blob_path))
+        self.assertEqual(Blob.objects.get(id=1).nb_reference, 3)
 
         self.factory.xfer = DocumentDel()
         self.call('/lucterios.documents/documentDel',
@@ -335,7 +425,69 @@ class DocumentTest(LucteriosTest):
         self.call(
             '/lucterios.documents/documentList', {"current_folder": "2"}, False)
         self.assert_count_equal('COMPONENTS/GRID[@name="document"]/RECORD', 0)
-        self.assertFalse(exists(get_user_path('documents', 'document_1')))
+        self.assertEqual(Blob.objects.get(id=1).nb_reference, 2)
+        self.assertTrue(exists(blob_path))
+
+        Document.objects.get(id=2).delete()
+        self.assertEqual(Blob.objects.get(id=1).nb_reference, 1)
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                Folder.objects.get(id=2).delete()
+                self.assertEqual(len(Blob.objects.all()), 0)
+                raise ValueError()
+        self.assertEqual(Blob.objects.get(id=1).nb_reference, 1)
+        self.assertEqual(len(PendingUnlink.objects.all()), 0)
+        self.assertTrue(exists(blob_path))
+
+        checksum = Blob.objects.get(id=1).checksum
+        Folder.objects.get(id=2).delete()
+        self.assertEqual(len(Blob.objects.all()), 0)
+        # unlinked when committed, the test transaction is never committed
+        self.assertEqual([pending.checksum for pending in PendingUnlink.objects.all()], [checksum])
+        self.assertTrue(exists(blob_path))
+        self.assertEqual(PendingUnlink.sweep(checksum=checksum), 1)
+        self.assertFalse(exists(blob_path))
+
+    def test_delete_multi(self):
+        self.create_doc()
+        folder = Folder.objects.get(id=4)
+        folder.viewer = LucteriosGroup.objects.filter(id__in=[2])
+        folder.modifier = LucteriosGroup.objects.filter(id__in=[2])
+        folder.save()
+        png_size = Document.objects.get(id=1).size
+        blob_path = Document.objects.get(id=1).blob.get_path()
+        self.assertEqual(DocumentCounter.count(), 3)
+
+        self.factory.xfer = DocumentDel()
+        self.call('/lucterios.documents/documentDel', {"document": "1;3", "CONFIRME": 'YES'}, False)
+        self.assert_observer('core.acknowledge', 'lucterios.documents', 'documentDel')
+        self.assertEqual([doc.id for doc in Document.objects.all()], [2])
+        self.assertEqual(DocumentCounter.count(), 1)
+        self.assertEqual([(folder.id, folder.total_documents, folder.total_size) for folder in Folder.objects.order_by('id')],
+                         [(1, 1, png_size), (2, 0, 0), (3, 0, 0), (4, 0, 0)])
+        self.assertEqual(Blob.objects.get(id=1).nb_reference, 1)
+        self.assertEqual(len(PendingUnlink.objects.all()), 0)
+
+        checksum = Blob.objects.get(id=1).checksum
+        self.assertEqual(Document.delete_all([2]), 1)
+        self.assertEqual(DocumentCounter.count(), 0)
+        self.assertEqual(Folder.objects.get(id=1).total_documents, 0)
+        self.assertEqual(len(Blob.objects.all()), 0)
+        self.assertEqual([pending.checksum for pending in PendingUnlink.objects.all()], [checksum])
+        self.assertTrue(exists(blob_path))
+        self.assertEqual(PendingUnlink.sweep(), 1)
+        self.assertEqual(len(PendingUnlink.objects.all()), 0)
+        self.assertFalse(exists(blob_path))
+
+        # stored again before the sweep: the file is kept
+        self.create_doc()
+        self.assertEqual(Document.delete_all(Document.objects.values_list('id', flat=True)), 3)
+        self.assertEqual(len(PendingUnlink.objects.all()), 1)
+        with open(join(dirname(__file__), 'static', 'lucterios.documents', 'images', 'documentFind.png'), 'rb') as file_to_load:
+            blob = Blob.store_chunks(read_chunks(file_to_load))
+        self.assertEqual(len(PendingUnlink.objects.all()), 0)
+        self.assertEqual(PendingUnlink.sweep(), 0)
+        self.assertTrue(exists(blob.get_path()))
 
     def test_readonly(self):
         current_date = self.create_doc()
@@ -344,7 +496,7 @@ class DocumentTest(LucteriosTest):
         self.call('/lucterios.documents/documentShow', {"document": "2"}, False)
         self.assert_observer('core.custom', 'lucterios.documents', 'documentShow')
         self.assert_xml_equal('TITLE', "Afficher le document")
-        self.assert_count_equal('COMPONENTS/*', 9)
+        self.assert_count_equal('COMPONENTS/*', 14)
         self.assert_comp_equal('COMPONENTS/LABELFORM[@name="folder"]', ">truc1", (1, 0, 2, 1))
         self.assert_comp_equal('COMPONENTS/LABELFORM[@name="name"]', "doc2.png", (1, 1, 2, 1))
         self.assert_comp_equal('COMPONENTS/LABELFORM[@name="description"]', "doc 2", (1, 2, 2, 1))
@@ -382,6 +534,210 @@ class DocumentTest(LucteriosTest):
         self.assert_observer('core.exception', 'lucterios.documents', 'documentDel')
         self.assert_xml_equal('EXCEPTION/MESSAGE', "Visualisation non autorisée !")
 
+    def test_folder_access(self):
+        access = FolderAccess(self.factory.user)
+        self.assertEqual(access.group_ids, set([2]))
+        with self.assertNumQueries(2):
+            access.load([1, 2, 3, 4])
+        with self.assertNumQueries(0):
+            self.assertFalse(access.cannot_view(1))
+            self.assertTrue(access.is_readonly(1))
+            self.assertFalse(access.cannot_view(2))
+            self.assertFalse(access.is_readonly(2))
+            self.assertFalse(access.cannot_view(3))
+            self.assertTrue(access.is_readonly(3))
+            self.assertTrue(access.cannot_view(4))
+            self.assertTrue(access.is_readonly(4))
+        folders = list(Folder.objects.filter(id__in=[1, 4]).order_by('id'))
+        self.assertTrue(folders[0].is_readonly(self.factory.user))
+        with self.assertNumQueries(2):
+            self.assertTrue(folders[1].cannot_view(self.factory.user))
+            self.assertFalse(folders[0].cannot_view(self.factory.user))
+        self.assertIs(FolderAccess.for_user(self.factory.user), FolderAccess.for_user(self.factory.user))
+
+        # the resolver kept on the user follows the changes of rights
+        folders[0].modifier.add(LucteriosGroup.objects.get(id=2))
+        self.assertFalse(folders[0].is_readonly(self.factory.user))
+        self.factory.user.groups.remove(LucteriosGroup.objects.get(id=2))
+        self.assertTrue(folders[0].cannot_view(self.factory.user))
+
+    def test_reshard(self):
+        self.create_doc()
+        blob = Blob.objects.get(id=1)
+        sharded_path = blob.get_path()
+        flat_path = join(get_user_dir(), 'documents', blob.checksum)
+        rename(sharded_path, flat_path)
+        self.assertTrue(blob.is_stored())
+        self.assertEqual(blob.get_path(), flat_path)
+
+        call_command('documents_reshard', stdout=StringIO())
+        self.assertFalse(exists(flat_path))
+        self.assertTrue(exists(sharded_path))
+        self.assertEqual(blob.get_path(), sharded_path)
+
+    def test_extract(self):
+        self.create_doc()
+        tmp_dir = join(get_user_dir(), 'tmp_import')
+        makedirs(join(tmp_dir, 'sub'))
+        with open(join(tmp_dir, 'aaa.txt'), 'wb') as file_to_write:
+            file_to_write.write(b'first file')
+        with open(join(tmp_dir, 'sub', 'bbb.txt'), 'wb') as file_to_write:
+            file_to_write.write(b'second file')
+        Folder.objects.get(id=2).import_files(tmp_dir, [], [], self.factory.user)
+
+        with ZipFile(BytesIO(b''.join(iter_zip(Folder.objects.get(id=2).get_archive_sources()))), 'r') as zip_ref:
+            self.assertEqual(sorted(zip_ref.namelist()), ['aaa.txt', 'doc1.png', 'sub/bbb.txt', 'truc4/doc3.png'])
+            self.assertEqual(zip_ref.read('sub/bbb.txt'), b'second file')
+        with ZipFile(BytesIO(b''.join(iter_zip(Folder().get_archive_sources()))), 'r') as zip_ref:
+            self.assertEqual(sorted(zip_ref.namelist()), ['truc1/doc2.png', 'truc2/aaa.txt', 'truc2/doc1.png', 'truc2/sub/bbb.txt', 'truc2/truc4/doc3.png'])
+            self.assertEqual(zip_ref.read('truc2/aaa.txt'), b'first file')
+            self.assertEqual(zip_ref.read('truc1/doc2.png'), Document.objects.get(name='doc2.png').get_content())
+
+    def test_import_archive(self):
+        archive = BytesIO()
+        with ZipFile(archive, 'w') as zip_ref:
+            zip_ref.writestr('aaa.txt', b'first file')
+            zip_ref.writestr('sub/bbb.txt', b'second file')
+            zip_ref.writestr('sub/ccc/ddd.txt', b'third file')
+            zip_ref.writestr('empty/', b'')
+            zip_ref.writestr('../eee.txt', b'fourth file')
+        archive.seek(0)
+        Folder.objects.get(id=2).import_archive(archive, LucteriosGroup.objects.filter(id__in=[1, 2]),
+                                                LucteriosGroup.objects.filter(id__in=[2]), self.factory.user)
+
+        self.assertEqual(len(Folder.objects.filter(parent_id=2)), 4)
+        self.assertEqual(Folder.objects.get(name='ccc').get_title(), '>truc2>sub>ccc')
+        self.assertEqual(len(Folder.objects.get(name='empty').document_set.all()), 0)
+        self.assertEqual(len(Document.objects.filter(folder_id=2)), 2)
+        self.assertEqual(sorted([group.id for group in Folder.objects.get(name='ccc').viewer.all()]), [1, 2])
+        self.assertEqual([group.id for group in Folder.objects.get(name='ccc').modifier.all()], [2])
+        new_doc = Document.objects.get(name='ddd.txt')
+        self.assertEqual(new_doc.creator.username, 'empty')
+        self.assertEqual(new_doc.blob.nb_reference, 1)
+        # the name stays in the document: the blob is shared by any document with the same content
+        self.assertEqual(get_container_header(new_doc.blob.get_path()).name, '')
+        self.assertEqual(new_doc.checksum, sha256(b'third file').hexdigest())
+        self.assertEqual(read_container(new_doc.blob.get_path()), b'third file')
+
+    def test_import_errors(self):
+        tmp_dir = join(get_user_dir(), 'tmp_import')
+        makedirs(tmp_dir)
+        for file_idx in range(10):
+            with open(join(tmp_dir, 'file%d.txt' % file_idx), 'wb') as file_to_write:
+                file_to_write.write(('content of file %d' % file_idx).encode())
+        importer = DocumentImporter(Folder.objects.get(id=1), [], [], self.factory.user)
+        importer.add_directory(tmp_dir)
+        unlink(join(tmp_dir, 'file3.txt'))
+        errors = importer.run()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0][0], 'file3.txt')
+        docs = Document.objects.filter(folder_id=1).order_by('id')
+        self.assertEqual([doc.name for doc in docs], ['file%d.txt' % file_idx for file_idx in range(10) if file_idx != 3])
+
+    def test_workspace(self):
+        with Workspace() as workspace1, Workspace() as workspace2:
+            self.assertNotEqual(workspace1.path, workspace2.path)
+            self.assertTrue(isdir(workspace1.path))
+            self.assertTrue(isdir(workspace2.path))
+        self.assertFalse(isdir(workspace1.path))
+        self.assertFalse(isdir(workspace2.path))
+        old_workspace = Workspace()
+        makedirs(old_workspace.path)
+        utime(old_workspace.path, (0, 0))
+        with Workspace():
+            self.assertFalse(isdir(old_workspace.path))
+
+        tmp_dir = join(get_user_dir(), 'tmp_import')
+        makedirs(tmp_dir)
+        with open(join(tmp_dir, 'file.txt'), 'wb') as file_to_write:
+            file_to_write.write(b'content of file')
+        importer = DocumentImporter(Folder.objects.get(id=1), [], [], self.factory.user)
+        importer.add_directory(tmp_dir)
+        self.assertEqual(importer.run(), [])
+        self.assertEqual(listdir(join(get_user_dir(), DOCUMENTS_DIR, WORKSPACE_DIR)), [])
+
+    def test_jobs(self):
+        self.create_doc()
+        archive = BytesIO()
+        with ZipFile(archive, 'w') as zip_ref:
+            zip_ref.writestr('aaa.txt', b'first file')
+            zip_ref.writestr('sub/bbb.txt', b'second file')
+        archive.seek(0)
+        import_job = Job.add_import(Folder.objects.get(id=2), archive, [], [], self.factory.user)
+        self.assertTrue(exists(join(get_user_dir(), import_job.get_file_name())))
+
+        self.factory.xfer = FolderExtract()
+        self.call('/lucterios.documents/folderExtract', {'SAVE': 'YES', 'parent': '2'}, False)
+        self.assert_observer('core.acknowledge', 'lucterios.documents', 'folderExtract')
+        extract_job = Job.objects.get(kind=Job.KIND_EXTRACT)
+        self.assertEqual(extract_job.status, Job.STATUS_WAITING)
+        self.assertFalse(extract_job.is_downloadable())
+
+        self.factory.xfer = JobShow()
+        self.call('/lucterios.documents/jobShow', {'job': extract_job.id}, False)
+        self.assert_observer('core.custom', 'lucterios.documents', 'jobShow')
+        self.assert_xml_equal('COMPONENTS/LABELFORM[@name="status"]', 'en attente')
+        self.assert_count_equal('COMPONENTS/DOWNLOAD', 0)
+        self.assert_count_equal('ACTIONS/ACTION', 2)
+
+        call_command('documents_jobs', once=True, stdout=StringIO())
+        import_job = Job.objects.get(id=import_job.id)
+        self.assertEqual(import_job.status, Job.STATUS_DONE)
+        self.assertEqual(import_job.nb_files, 2)
+        self.assertEqual(import_job.nb_files_done, 2)
+        self.assertFalse(exists(join(get_user_dir(), import_job.get_file_name())))
+        extract_job = Job.objects.get(id=extract_job.id)
+        self.assertEqual(extract_job.status, Job.STATUS_DONE)
+        self.assertEqual(extract_job.nb_files, 4)
+        self.assertEqual(extract_job.nb_files_done, 4)
+        self.assertEqual(extract_job.size_done, extract_job.size)
+        self.assertTrue(extract_job.is_downloadable())
+        with ZipFile(join(get_user_dir(), extract_job.get_file_name()), 'r') as zip_ref:
+            self.assertEqual(sorted(zip_ref.namelist()), ['aaa.txt', 'doc1.png', 'sub/bbb.txt', 'truc4/doc3.png'])
+
+        self.factory.xfer = JobShow()
+        self.call('/lucterios.documents/jobShow', {'job': extract_job.id}, False)
+        self.assert_observer('core.custom', 'lucterios.documents', 'jobShow')
+        self.assert_xml_equal('COMPONENTS/LABELFORM[@name="status"]', 'terminé')
+        self.assert_xml_equal('COMPONENTS/LABELFORM[@name="files"]', '4 / 4')
+        self.assert_xml_equal('COMPONENTS/DOWNLOAD[@name="filename"]/FILENAME', 'lucterios.documents/jobDownload?job=%d' % extract_job.id)
+        self.assert_count_equal('ACTIONS/ACTION', 1)
+
+        # deleted with its folder: its file is unlinked when committed, the test transaction is never committed
+        job_path = join(get_user_dir(), extract_job.get_file_name())
+        Folder.objects.get(id=2).delete()
+        self.assertEqual(len(Job.objects.filter(id=extract_job.id)), 0)
+        self.assertTrue(exists(job_path))
+        for _savepoint_ids, callback in connection.run_on_commit:
+            callback()
+        self.assertFalse(exists(job_path))
+
+    def test_extract_cache(self):
+        self.create_doc()
+        first_job = Job.add_extract(Folder.objects.get(id=2), self.factory.user)
+        self.assertEqual(first_job.status, Job.STATUS_WAITING)
+        call_command('documents_jobs', once=True, stdout=StringIO())
+        second_job = Job.add_extract(Folder.objects.get(id=2), self.factory.user)
+        self.assertEqual(second_job.status, Job.STATUS_DONE)
+        self.assertEqual(second_job.nb_files_done, 2)
+        self.assertTrue(second_job.is_downloadable())
+
+        doc = Document.objects.get(folder_id=2)
+        doc.date_modification = timezone.now()
+        doc.save()
+        third_job = Job.add_extract(Folder.objects.get(id=2), self.factory.user)
+        self.assertEqual(third_job.status, Job.STATUS_WAITING)
+        self.assertEqual(Job.add_extract(Folder.objects.get(id=1), self.factory.user).status, Job.STATUS_WAITING)
+        call_command('documents_jobs', once=True, stdout=StringIO())
+        self.assertEqual(len(listdir(join(get_user_dir(), DOCUMENTS_DIR, CACHE_DIR))), 3)
+
+        # the archive of the third job is already cached: a second link to its file is counted once
+        job_path = join(get_user_dir(), third_job.get_file_name())
+        store_cached_archive('0' * 64, job_path, getsize(job_path))
+        self.assertEqual(sorted(listdir(join(get_user_dir(), DOCUMENTS_DIR, CACHE_DIR))),
+                         sorted(['0' * 64 + '.zip', Folder.objects.get(id=2).get_fingerprint() + '.zip']))
+        self.assertTrue(Job.objects.get(id=first_job.id).is_downloadable())
+
     def test_search(self):
         self.create_doc()
 
@@ -392,3 +748,550 @@ class DocumentTest(LucteriosTest):
         self.call('/lucterios.documents/documentSearch', {'CRITERIA': 'name||7||.png'}, False)
         self.assert_observer('core.custom', 'lucterios.documents', 'documentSearch')
         self.assert_count_equal('COMPONENTS/GRID[@name="document"]/RECORD', 2)
+
+    def test_search_content(self):
+        tmp_dir = join(get_user_dir(), 'tmp_import')
+        makedirs(tmp_dir)
+        for filename, content in (('fruits.txt', 'Apple, banana and cherry. Banana again: banana!'),
+                                  ('salad.txt', 'A salad with apples and one banana.'),
+                                  ('note.md', 'Nothing about fruits, only a café.'),
+                                  ('image.png', 'banana')):
+            with open(join(tmp_dir, filename), 'wb') as file_to_write:
+                file_to_write.write(content.encode('utf-8'))
+        Folder.objects.get(id=1).import_files(tmp_dir, [], [], self.factory.user)
+        out = StringIO()
+        call_command('documents_index', stdout=out)
+        self.assertEqual(out.getvalue().strip().split('\n'), ['4 document(s) extracted', '4 document(s) indexed'])
+        out = StringIO()
+        call_command('documents_index', stdout=out)
+        self.assertEqual(out.getvalue().strip().split('\n'), ['0 document(s) extracted', '0 document(s) indexed'])
+        self.assertEqual(DocumentContent.objects.get(document__name='note.md').text, 'Nothing about fruits, only a café.')
+        self.assertEqual(DocumentContent.objects.get(document__name='image.png').text, '')
+
+        doc = Document.objects.get(name='note.md')
+        doc.date_modification = timezone.now()
+        doc.save()
+        out = StringIO()
+        call_command('documents_index', stdout=out)
+        self.assertEqual(out.getvalue().strip().split('\n'), ['1 document(s) extracted', '1 document(s) indexed'])
+
+        fruits_id = Document.objects.get(name='fruits.txt').id
+        salad_id = Document.objects.get(name='salad.txt').id
+        self.assertEqual([doc_id for doc_id, _rank in ContentWord.search('BANANA')], [fruits_id, salad_id])
+        self.assertEqual([doc_id for doc_id, _rank in ContentWord.search('banana apples')], [salad_id])
+        self.assertEqual([doc_id for doc_id, _rank in ContentWord.search('cafe')], [Document.objects.get(name='note.md').id])
+        self.assertEqual(ContentWord.search('kiwi'), [])
+
+        self.factory.xfer = DocumentSearch()
+        self.call('/lucterios.documents/documentSearch', {'CRITERIA': 'content||5||banana'}, False)
+        self.assert_observer('core.custom', 'lucterios.documents', 'documentSearch')
+        self.assert_count_equal('COMPONENTS/GRID[@name="document"]/RECORD', 2)
+        self.assert_attrib_equal('COMPONENTS/GRID[@name="document"]/RECORD[1]', 'id', six.text_type(fruits_id))
+        self.assert_attrib_equal('COMPONENTS/GRID[@name="document"]/RECORD[2]', 'id', six.text_type(salad_id))
+
+        # the limit of the ranked search does not limit the matching documents
+        self.assertEqual([doc_id for doc_id, _rank in ContentWord.search('banana', max_results=1)], [fruits_id])
+        self.assertEqual(sorted(Document.objects.filter(id__in=ContentWord.get_matching_documents('banana')).values_list('id', flat=True)),
+                         sorted([fruits_id, salad_id]))
+        self.assertEqual(list(Document.objects.filter(id__in=ContentWord.get_matching_documents('banana kiwi'))), [])
+        self.factory.xfer = DocumentSearch()
+        self.call('/lucterios.documents/documentSearch', {'CRITERIA': 'content||2||banana'}, False)
+        self.assert_observer('core.custom', 'lucterios.documents', 'documentSearch')
+        self.assert_count_equal('COMPONENTS/GRID[@name="document"]/RECORD', 2)
+        self.assert_count_equal('COMPONENTS/GRID[@name="document"]/RECORD[@id="%d"]' % fruits_id, 0)
+
+    def test_extract_text(self):
+        tmp_dir = join(get_user_dir(), 'tmp_import')
+        makedirs(tmp_dir)
+        office_file = BytesIO()
+        with ZipFile(office_file, 'w') as zip_ref:
+            zip_ref.writestr('content.xml', '<office:text><text:p>Quarterly &amp; yearly report</text:p></office:text>')
+        with open(join(tmp_dir, 'report.odt'), 'wb') as file_to_write:
+            file_to_write.write(office_file.getvalue())
+        with open(join(tmp_dir, 'page.html'), 'wb') as file_to_write:
+            file_to_write.write(b'<html><body><p>Hello</p></body></html>')
+        with open(join(tmp_dir, 'big.txt'), 'wb') as file_to_write:
+            file_to_write.write(b'x' * 2048)
+        Folder.objects.get(id=1).import_files(tmp_dir, [], [], self.factory.user)
+
+        blob_path = Document.objects.get(name='report.odt').blob.get_path()
+        self.assertEqual(extract_text(blob_path, 'report.odt')[0].split(), ['Quarterly', '&', 'yearly', 'report'])
+        self.assertEqual(extract_text(Document.objects.get(name='page.html').blob.get_path(), 'page.html')[0].split(), ['Hello'])
+        self.assertEqual(extract_text(Document.objects.get(name='big.txt').blob.get_path(), 'big.txt', max_file_size=1024), ('', 'file too big'))
+        self.assertEqual(extract_text(join(tmp_dir, 'unknown'), 'unknown.txt'), ('', 'file not found'))
+        results = [result for results in extract_batches([(idx, blob_path, 'report.odt') for idx in range(3)], 2) for result in results]
+        self.assertEqual([idx for idx, _text, error in results if error == ''], [0, 1, 2])
+
+    def test_counters(self):
+        self.assertEqual(DocumentCounter.count(), 0)
+        self.create_doc()
+        self.assertEqual(DocumentCounter.count(), 3)
+        self.assertEqual(DocumentCounter.count([1, 2]), 2)
+        self.assertEqual(DocumentCounter.count([1]), 1)
+        self.assertEqual(DocumentCounter.count([]), 0)
+
+        doc = Document.objects.get(name='doc3.png')
+        doc.folder_id = 2
+        doc.save()
+        self.assertEqual(DocumentCounter.count(), 3)
+        self.assertEqual(DocumentCounter.count([2]), 3)
+        doc.folder = None
+        doc.save()
+        self.assertEqual(DocumentCounter.count([2]), 3)
+        self.assertEqual(DocumentCounter.count([1]), 2)
+
+        tmp_dir = join(get_user_dir(), 'tmp_import')
+        makedirs(join(tmp_dir, 'sub'))
+        for filename in ('aaa.txt', join('sub', 'bbb.txt'), join('sub', 'ccc.txt')):
+            with open(join(tmp_dir, filename), 'wb') as file_to_write:
+                file_to_write.write(b'content')
+        Folder.objects.get(id=2).import_files(tmp_dir, [], [], self.factory.user)
+        self.assertEqual(DocumentCounter.count(), 6)
+        self.assertEqual(DocumentCounter.count([2]), 4)
+
+        Folder.objects.get(id=2).delete()
+        self.assertEqual(DocumentCounter.count(), 2)
+        Document.objects.get(name='doc3.png').delete()
+        self.assertEqual(DocumentCounter.count(), 1)
+        self.assertEqual(DocumentCounter.count(), len(Document.objects.all()))
+
+    def test_totals_and_quota(self):
+        self.create_doc()
+        png_size = Document.objects.get(name='doc1.png').size
+        self.assertEqual([(folder.id, folder.total_documents, folder.total_size) for folder in Folder.objects.order_by('id')],
+                         [(1, 1, png_size), (2, 2, 2 * png_size), (3, 0, 0), (4, 1, png_size)])
+
+        tmp_dir = join(get_user_dir(), 'tmp_import')
+        makedirs(tmp_dir)
+        with open(join(tmp_dir, 'aaa.txt'), 'wb') as file_to_write:
+            file_to_write.write(b'content')
+        Folder.objects.get(id=3).import_files(tmp_dir, [], [], self.factory.user)
+        txt_size = Document.objects.get(name='aaa.txt').size
+        self.assertEqual(Folder.objects.get(id=3).total_size, txt_size)
+        self.assertEqual(Folder.objects.get(id=2).total_documents, 3)
+        self.assertEqual(Folder.objects.get(id=2).total_size, 2 * png_size + txt_size)
+
+        doc = Document.objects.get(name='doc3.png')
+        doc.folder_id = 1
+        doc.save()
+        self.assertEqual(Folder.objects.get(id=1).total_size, 2 * png_size)
+        self.assertEqual(Folder.objects.get(id=2).total_size, png_size + txt_size)
+        folder = Folder.objects.get(id=3)
+        folder.parent_id = 1
+        folder.save()
+        self.assertEqual([(folder.id, folder.total_documents, folder.total_size) for folder in Folder.objects.order_by('id')],
+                         [(1, 3, 2 * png_size + txt_size), (2, 1, png_size), (3, 1, txt_size), (4, 0, 0)])
+        Document.objects.get(name='aaa.txt').delete()
+        self.assertEqual(Folder.objects.get(id=1).total_size, 2 * png_size)
+        self.assertEqual(Folder.objects.get(id=3).total_size, 0)
+
+        folder = Folder.objects.get(id=1)
+        folder.quota = 1
+        folder.save()
+        Folder.check_quota(3, 1024 * 1024 - 2 * png_size)
+        with self.assertRaises(LucteriosException):
+            Folder.check_quota(3, 1024 * 1024 - 2 * png_size + 1)
+        Folder.check_quota(2, 1024 * 1024)
+        Folder.check_quota(1, 1024 * 1024, 3)
+
+    def test_metadata(self):
+        self.create_doc()
+        doc = Document.objects.get(name='doc1.png')
+        self.assertEqual((doc.storage_format, doc.mimetype), (0, 'image/png'))
+        self.assertTrue(doc.is_consistent())
+
+        tmp_dir = join(get_user_dir(), 'tmp_import')
+        makedirs(tmp_dir)
+        with open(join(tmp_dir, 'aaa.txt'), 'wb') as file_to_write:
+            file_to_write.write(b'content')
+        with open(join(tmp_dir, 'bbb.dat'), 'wb') as file_to_write:
+            file_to_write.write(b'%PDF-1.4 content')
+        Folder.objects.get(id=2).import_files(tmp_dir, [], [], self.factory.user)
+        self.assertEqual([(doc.name, doc.storage_format, doc.mimetype) for doc in Document.objects.filter(folder_id=2).order_by('name')],
+                         [('aaa.txt', 2, 'text/plain'), ('bbb.dat', 2, 'application/pdf'), ('doc1.png', 0, 'image/png')])
+
+        Document.objects.all().update(mimetype='', storage_format=0)
+        out = StringIO()
+        call_command('documents_metadata', check=True, stdout=out)
+        self.assertEqual(out.getvalue().strip(), "5 document(s) described, 0 error(s)")
+        self.assertEqual(Document.objects.get(name='aaa.txt').storage_format, 2)
+        self.assertEqual(Document.objects.get(name='doc2.png').mimetype, 'image/png')
+        out = StringIO()
+        call_command('documents_metadata', stdout=out)
+        self.assertEqual(out.getvalue().strip(), "0 document(s) described, 0 error(s)")
+
+        Document.objects.filter(id=1).update(checksum='0' * 64)
+        self.factory.xfer = DocumentShow()
+        self.call('/lucterios.documents/documentShow', {"document": "1"}, False)
+        self.assert_observer('core.exception', 'lucterios.documents', 'documentShow')
+        self.assert_xml_equal('EXCEPTION/MESSAGE', "Fichier corrompu !")
+
+    def test_download(self):
+        self.create_doc()
+        doc = Document.objects.get(id=1)
+        last_modified = timegm(doc.date_modification.utctimetuple())
+        with open(join(dirname(__file__), 'static', 'lucterios.documents', 'images', 'documentFind.png'), 'rb') as file_to_load:
+            content = file_to_load.read()
+
+        def download(**headers):
+            request = self.factory.create_request('/lucterios.documents/documentDownload', {'document': '1'})
+            request.META.update(headers)
+            return DocumentDownload().get(request)
+
+        response = download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), content)
+        self.assertEqual(response['Content-Length'], six.text_type(len(content)))
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['ETag'], '"%s"' % doc.checksum)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        response = download(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), content[10:20])
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/%d' % len(content))
+        response = download(HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), content[-5:])
+        response = download(HTTP_RANGE='bytes=%d-' % len(content))
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */%d' % len(content))
+        response = download(HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"%s"' % doc.checksum)
+        self.assertEqual(response.status_code, 206)
+        response = download(HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"other"')
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(download(HTTP_IF_NONE_MATCH='"%s"' % doc.checksum).status_code, 304)
+        self.assertEqual(download(HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+        self.assertEqual(download(HTTP_IF_MODIFIED_SINCE=http_date(last_modified)).status_code, 304)
+        self.assertEqual(download(HTTP_IF_MODIFIED_SINCE=http_date(last_modified - 10)).status_code, 200)
+
+        self.assertEqual(parse_range('bytes=0-1,5-6', 10), None)
+        self.assertEqual(parse_range('bytes=5-100', 10), (5, 9))
+        self.assertEqual(parse_range('bytes=-100', 10), (0, 9))
+        self.assertEqual(parse_range('bytes=8-2', 10), (None, None))
+
+    def test_transfer(self):
+        content = b'first content\n' * 500
+        tmp_dir = join(get_user_dir(), 'tmp_upload')
+        makedirs(tmp_dir)
+        file_path = join(tmp_dir, 'doc.txt')
+
+        def download(doc_id):
+            request = self.factory.create_request('/lucterios.documents/documentDownload', {'document': doc_id})
+            return b''.join(DocumentDownload().get(request).streaming_content)
+
+        def upload(params, file_content):
+            with open(file_path, 'wb') as file_to_write:
+                file_to_write.write(file_content)
+            self.factory.xfer = DocumentAddModify()
+            with open(file_path, 'rb') as file_to_load:
+                params.update({'SAVE': 'YES', 'description': 'text', 'filename_FILENAME': 'doc.txt', 'filename': file_to_load})
+                self.call('/lucterios.documents/documentAddModify', params, False)
+
+        upload({"current_folder": "2"}, content)
+        self.assert_observer('core.acknowledge', 'lucterios.documents', 'documentAddModify')
+        doc = Document.objects.get(name='doc.txt')
+        self.assertEqual((doc.storage_format, doc.get_content()), (2, content))
+
+        # the same encoding for the download of show and the upload of edit
+        self.factory.xfer = DocumentShow()
+        self.call('/lucterios.documents/documentShow', {"document": doc.id}, False)
+        self.assert_observer('core.custom', 'lucterios.documents', 'documentShow')
+        self.assert_attrib_equal('COMPONENTS/DOWNLOAD[@name="filename"]', 'Compress', None)
+        self.assertEqual(download(doc.id), content)
+        self.factory.xfer = DocumentAddModify()
+        self.call('/lucterios.documents/documentAddModify', {"document": doc.id}, False)
+        self.assert_observer('core.custom', 'lucterios.documents', 'documentAddModify')
+        self.assert_attrib_equal('COMPONENTS/UPLOAD[@name="filename"]', 'Compress', None)
+
+        new_content = download(doc.id) + b'second content\n'
+        upload({"document": doc.id}, new_content)
+        self.assert_observer('core.acknowledge', 'lucterios.documents', 'documentAddModify')
+        self.assertEqual(download(doc.id), new_content)
+
+        # a document stored in a zip by an older version is sent decompressed too
+        archive = BytesIO()
+        with ZipFile(archive, 'w') as zip_ref:
+            zip_ref.writestr('old.txt', content)
+        doc = Document.objects.get(id=doc.id)
+        doc.set_blob(Blob.store_chunks([archive.getvalue()]))
+        self.assertEqual(doc.storage_format, 1)
+        self.assertEqual(download(doc.id), content)
+
+    def test_download_offload(self):
+        self.create_doc()
+        doc = Document.objects.get(id=1)
+        blob_path = doc.blob.get_path()
+        request = self.factory.create_request('/lucterios.documents/documentDownload', {'document': '1'})
+        response = file_response(request, blob_path, 'image/png', doc.name, doc.checksum, 1000, MODE_SENDFILE)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['X-Sendfile'], blob_path)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="doc1.png"')
+        self.assertEqual(response['ETag'], '"%s"' % doc.checksum)
+
+        response = file_response(request, blob_path, 'image/png', doc.name, doc.checksum, 1000, MODE_ACCEL)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + doc.blob.get_name().replace('\\', '/'))
+        self.assertFalse('X-Sendfile' in response)
+
+        request.META['HTTP_IF_NONE_MATCH'] = '"%s"' % doc.checksum
+        response = file_response(request, blob_path, 'image/png', doc.name, doc.checksum, 1000, MODE_ACCEL)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse('X-Accel-Redirect' in response)
+
+        # a container is offloaded from its decompressed copy
+        content = b'some text\n' * 1000
+        doc.set_blob(Blob.store_document([content], 'doc1.txt'))
+        blob_path = doc.blob.get_path()
+        header = get_container_header(blob_path)
+        self.assertEqual(header.codec, CODEC_DEFLATED)
+        request = self.factory.create_request('/lucterios.documents/documentDownload', {'document': '1'})
+        response = file_response(request, blob_path, 'text/plain', doc.name, doc.checksum, 1000, MODE_ACCEL)
+        download_name = join(DOCUMENTS_DIR, DOWNLOAD_DIR, doc.checksum)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + download_name.replace('\\', '/'))
+        with open(join(get_user_dir(), download_name), 'rb') as download_file:
+            self.assertEqual(download_file.read(), content)
+        self.assertEqual(get_offload_path(blob_path, header, len(content) - 1), None)
+        self.assertEqual(get_offload_path(blob_path, None), blob_path)
+
+    def test_thumbnails(self):
+        from PIL import Image
+        self.create_doc()
+        checksum = Document.objects.get(id=1).checksum
+        # smaller than the sizes of thumbnails: never enlarged
+        source_size = Image.open(join(dirname(__file__), 'static', 'lucterios.documents', 'images', 'documentFind.png')).size
+        self.assertTrue(max(source_size) <= min(THUMBNAIL_SIZES.values()))
+        self.assertEqual(get_cached_thumbnail(checksum, 'thumbnail'), None)
+        self.factory.xfer = DocumentList()
+        self.call('/lucterios.documents/documentList', {"current_folder": "2"}, False)
+        self.assert_xml_equal('COMPONENTS/GRID[@name="document"]/RECORD[@id="1"]/VALUE[@name="thumbnail"]', None)
+
+        out = StringIO()
+        call_command('documents_thumbnails', stdout=out)
+        self.assertEqual(out.getvalue().strip(), "1 thumbnail(s) made")
+        thumbnail_path = get_cached_thumbnail(checksum, 'thumbnail')
+        self.assertEqual(Image.open(thumbnail_path).size, source_size)
+        self.factory.xfer = DocumentList()
+        self.call('/lucterios.documents/documentList', {"current_folder": "2"}, False)
+        self.assertTrue(self.get_first_xpath('COMPONENTS/GRID[@name="document"]/RECORD[@id="1"]/VALUE[@name="thumbnail"]').text.startswith('data:image/*;base64,'))
+
+        request = self.factory.create_request('/lucterios.documents/documentThumbnail', {'document': '1', 'size': 'thumbnail'})
+        response = DocumentThumbnail().get(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['Cache-Control'], 'private, max-age=86400')
+        self.assertEqual(response['Content-Disposition'], 'inline; filename="doc1.png.png"')
+        with open(thumbnail_path, 'rb') as thumbnail_file:
+            self.assertEqual(b''.join(response.streaming_content), thumbnail_file.read())
+
+        self.assertEqual(len(listdir(join(get_user_dir(), DOCUMENTS_DIR, THUMBNAIL_DIR))), 1)
+        evict_thumbnails(0)
+        self.assertEqual(listdir(join(get_user_dir(), DOCUMENTS_DIR, THUMBNAIL_DIR)), [])
+
+        self.factory.xfer = DocumentShow()
+        self.call('/lucterios.documents/documentShow', {"document": "1"}, False)
+        self.assert_observer('core.custom', 'lucterios.documents', 'documentShow')
+        self.assert_xml_equal('COMPONENTS/LABELFORM[@name="preview"]', "{[center]}Aperçu en préparation{[/center]}")
+        self.assertEqual(get_cached_thumbnail(checksum, 'preview'), None)
+        self.factory.xfer = DocumentShow()
+        self.call('/lucterios.documents/documentShow', {"document": "1"}, False)
+        job = Job.objects.get(kind=Job.KIND_THUMBNAIL)
+        self.assertEqual((job.document_id, job.folder_id, job.status), (1, 2, Job.STATUS_WAITING))
+
+        call_command('documents_jobs', once=True, stdout=StringIO())
+        self.assertEqual(Job.objects.get(id=job.id).status, Job.STATUS_DONE)
+        self.assertEqual(Image.open(get_cached_thumbnail(checksum, 'preview')).size, source_size)
+        self.assertEqual(Image.open(get_cached_thumbnail(checksum, 'thumbnail')).size, source_size)
+        self.factory.xfer = DocumentShow()
+        self.call('/lucterios.documents/documentShow', {"document": "1"}, False)
+        self.assertTrue(self.get_first_xpath('COMPONENTS/IMAGE[@name="preview"]').text.startswith('data:image/*;base64,'))
+
+    def test_versions(self):
+        def get_content(revision):
+            return b''.join([b'%d;value %d\n' % (line, line if line != revision else -1) for line in range(2000)])
+
+        current_date = timezone.now()
+        doc = Document.objects.create(name='data.csv', description="data", folder_id=2, date_creation=current_date, date_modification=current_date)
+        doc.set_blob(Blob.store_chunks([get_content(0)]))
+        for revision in range(1, 13):
+            doc.set_blob(Blob.store_chunks([get_content(revision)]))
+        versions = DocumentVersion.objects.filter(document=doc).order_by('number')
+        self.assertEqual([version.number for version in versions], list(range(1, 13)))
+        self.assertEqual([version.number for version in versions if not version.is_delta], [10])
+        for version in versions:
+            self.assertEqual(version.get_content(), get_content(version.number - 1))
+        self.assertEqual(len(Blob.objects.all()), 13)
+        self.assertTrue(sum([blob.size for blob in Blob.objects.all()]) < 3 * len(get_content(0)))
+
+        self.factory.xfer = DocumentShow()
+        self.call('/lucterios.documents/documentShow', {"document": doc.id}, False)
+        self.assert_count_equal('COMPONENTS/GRID[@name="documentversion"]/RECORD', 12)
+        self.assert_count_equal('COMPONENTS/GRID[@name="documentversion"]/ACTIONS/ACTION', 2)
+
+        self.factory.xfer = DocumentVersionDiff()
+        self.call('/lucterios.documents/documentVersionDiff', {"documentversion": versions[3].id}, False)
+        self.assert_observer('core.custom', 'lucterios.documents', 'documentVersionDiff')
+        diff_lines = self.get_first_xpath('COMPONENTS/LABELFORM[@name="diff"]').text.split('{[br/]}')
+        self.assertEqual(diff_lines[:3], ['--- data.csv #4', '+++ data.csv', '@@ -2,6 +2,6 @@'])
+        self.assertEqual(sorted(diff_lines[5:9]), ['+3;value 3', '+4;value -1', '-3;value -1', '-4;value 4'])
+
+        self.factory.xfer = DocumentVersionRestore()
+        self.call('/lucterios.documents/documentVersionRestore', {"documentversion": versions[0].id, "CONFIRME": "YES"}, False)
+        self.assert_observer('core.acknowledge', 'lucterios.documents', 'documentVersionRestore')
+        doc = Document.objects.get(id=doc.id)
+        self.assertEqual(doc.get_content(), get_content(0))
+        self.assertEqual(DocumentVersion.objects.filter(document=doc).count(), 13)
+        self.assertEqual(DocumentVersion.objects.get(document=doc, number=13).get_content(), get_content(12))
+
+        # a version kept whole is restored by chunks
+        version = DocumentVersion.objects.get(document=doc, number=10)
+        self.assertFalse(version.is_delta)
+        self.assertEqual(b''.join(version.iter_content()), get_content(9))
+        doc = version.restore(None)
+        self.assertEqual((doc.get_content(), doc.size), (get_content(9), len(get_content(9))))
+        self.assertEqual(DocumentVersion.objects.get(document=doc, number=14).get_next().id, doc.id)
+
+        doc.delete()
+        self.assertEqual(len(Blob.objects.all()), 0)
+
+    def test_compression(self):
+        csv_content = b''.join([b'%d;value %d\n' % (line, line) for line in range(2000)])
+        tmp_dir = join(get_user_dir(), 'tmp_import')
+        makedirs(tmp_dir)
+        with open(join(tmp_dir, 'data.csv'), 'wb') as file_to_write:
+            file_to_write.write(csv_content)
+        with open(join(tmp_dir, 'image.jpg'), 'wb') as file_to_write:
+            file_to_write.write(b'\xff\xd8\xff' + csv_content)
+        archive = BytesIO()
+        with ZipFile(archive, 'w') as zip_ref:
+            zip_ref.writestr('other.csv', csv_content + b'end\n')
+        archive.seek(0)
+        Folder.objects.get(id=2).import_files(tmp_dir, [], [], self.factory.user)
+        Folder.objects.get(id=3).import_archive(archive, [], [], self.factory.user)
+        compressions = {}
+        for doc in Document.objects.all():
+            compressions[doc.name] = get_container_header(doc.blob.get_path()).codec
+            self.assertTrue(doc.get_content().startswith(b'\xff\xd8\xff' if doc.name == 'image.jpg' else b'0;value 0\n'))
+        self.assertEqual(compressions, {'data.csv': CODEC_DEFLATED, 'image.jpg': CODEC_STORED, 'other.csv': CODEC_DEFLATED})
+        doc = Document.objects.get(name='data.csv')
+        self.assertEqual((doc.size, doc.checksum), (len(csv_content), sha256(csv_content).hexdigest()))
+        self.assertTrue(getsize(doc.blob.get_path()) < len(csv_content) / 2)
+
+        # same content under another name: same blob
+        blob = Blob.store_document([csv_content], 'renamed.csv')
+        self.assertEqual(blob.id, Document.objects.get(name='data.csv').blob_id)
+        self.assertEqual(blob.nb_reference, 2)
+        Blob.release(blob.id)
+
+        raw_content = csv_content + b'raw\n'
+        current_date = timezone.now()
+        doc = Document.objects.create(name='raw.csv', description="raw", folder_id=4, date_creation=current_date, date_modification=current_date)
+        doc.set_blob(Blob.store_chunks([raw_content]))
+        self.create_doc()
+        raw_blob_id = doc.blob_id
+        self.assertEqual(Folder.objects.get(id=4).total_size, len(raw_content) + Document.objects.get(name='doc3.png').size)
+        out = StringIO()
+        call_command('documents_recompress', stdout=out)
+        self.assertEqual(out.getvalue().strip()[:24], "1 blob(s) recompressed, ")
+        doc = Document.objects.get(id=doc.id)
+        self.assertEqual((doc.storage_format, doc.blob_id, doc.blob.nb_reference), (2, raw_blob_id, 1))
+        self.assertEqual(doc.get_content(), raw_content)
+        self.assertTrue(getsize(doc.blob.get_path()) < len(raw_content) / 2)
+        self.assertEqual(Folder.objects.get(id=4).total_size, len(raw_content) + Document.objects.get(name='doc3.png').size)
+        self.assertEqual(Document.objects.get(name='doc1.png').storage_format, 0)
+        out = StringIO()
+        call_command('documents_recompress', stdout=out)
+        self.assertEqual(out.getvalue().strip()[:24], "0 blob(s) recompressed, ")
+
+    def test_container(self):
+        self.create_doc()
+        with open(join(dirname(__file__), 'static', 'lucterios.documents', 'images', 'documentFind.png'), 'rb') as file_to_load:
+            png_content = file_to_load.read()
+        txt_content = b'old content\n' * 100
+        archive = BytesIO()
+        with ZipFile(archive, 'w') as zip_ref:
+            zip_ref.writestr('old.txt', txt_content)
+        current_date = timezone.now()
+        doc = Document.objects.create(name='old.txt', description="old", folder_id=1, date_creation=current_date, date_modification=current_date)
+        doc.set_blob(Blob.store_chunks([archive.getvalue()]))
+        self.assertEqual(doc.storage_format, 1)
+
+        out = StringIO()
+        call_command('documents_convert', check=True, stdout=out)
+        self.assertEqual(out.getvalue().strip(), "2 blob(s) converted, 0 error(s)")
+        self.assertEqual(len(Blob.objects.all()), 2)
+        doc = Document.objects.get(id=doc.id)
+        self.assertEqual((doc.storage_format, doc.get_content()), (2, txt_content))
+        header = get_container_header(doc.blob.get_path())
+        self.assertEqual((header.name, header.codec, header.content_size), ('', CODEC_DEFLATED, len(txt_content)))
+        self.assertEqual((doc.size, doc.checksum), (len(txt_content), sha256(txt_content).hexdigest()))
+        doc = Document.objects.get(name='doc1.png')
+        self.assertEqual((doc.storage_format, doc.blob.nb_reference, doc.get_content()), (2, 3, png_content))
+        self.assertTrue(check_container(doc.blob.get_path()))
+        self.assertEqual(Folder.objects.get(id=2).total_size, 2 * doc.size)
+        out = StringIO()
+        call_command('documents_convert', check=True, stdout=out)
+        self.assertEqual(out.getvalue().strip(), "0 blob(s) converted, 0 error(s)")
+
+        request = self.factory.create_request('/lucterios.documents/documentDownload', {'document': doc.id})
+        request.META['HTTP_RANGE'] = 'bytes=10-19'
+        response = DocumentDownload().get(request)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), png_content[10:20])
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/%d' % len(png_content))
+        self.assertEqual(response['Content-Type'], 'image/png')
+        with ZipFile(BytesIO(b''.join(iter_zip(Folder.objects.get(id=1).get_archive_sources()))), 'r') as zip_ref:
+            self.assertEqual(sorted(zip_ref.namelist()), ['doc2.png', 'old.txt'])
+            self.assertEqual(zip_ref.read('old.txt'), txt_content)
+
+    def test_collector(self):
+        self.create_doc()
+        Blob.objects.filter(id=1).update(nb_reference=5)
+        orphan_path = get_blob_path('f' * 64)
+        with open(orphan_path, 'wb') as file_to_write:
+            file_to_write.write(b'orphan')
+        utime(orphan_path, (1000, 1000))
+        lost_blob = Blob.store_chunks([b'lost'])
+        current_date = timezone.now()
+        doc = Document.objects.create(name='missing.txt', description="missing", folder_id=1, date_creation=current_date, date_modification=current_date)
+        doc.set_blob(Blob.store_chunks([b'missing']))
+        unlink(doc.blob.get_path())
+        with open(join(get_user_dir(), DOCUMENTS_DIR, 'tmp_leftover'), 'wb') as file_to_write:
+            file_to_write.write(b'tmp')
+
+        collector = BlobCollector(limit=1, grace_period=0)
+        self.assertFalse(collector.run())
+        self.assertEqual(collector.nb_checked, 1)
+        self.assertTrue(exists(join(get_user_dir(), DOCUMENTS_DIR, GC_CURSOR_NAME)))
+        other_collector = BlobCollector(grace_period=0)
+        self.assertTrue(other_collector.run())
+        self.assertFalse(exists(join(get_user_dir(), DOCUMENTS_DIR, GC_CURSOR_NAME)))
+        self.assertEqual(collector.nb_checked + other_collector.nb_checked, 4)
+        self.assertEqual(collector.nb_orphans + other_collector.nb_orphans, 3)
+        self.assertEqual(collector.nb_fixed + other_collector.nb_fixed, 1)
+        self.assertEqual(collector.nb_missing + other_collector.nb_missing, 1)
+        self.assertEqual(collector.reclaimed + other_collector.reclaimed, len(b'orphan') + len(b'lost') + len(b'tmp'))
+        self.assertEqual(Blob.objects.get(id=1).nb_reference, 3)
+        self.assertEqual(len(Blob.objects.filter(id=lost_blob.id)), 0)
+        self.assertEqual(sorted(listdir(join(get_user_dir(), DOCUMENTS_DIR, QUARANTINE_DIR))), sorted(['f' * 64, lost_blob.checksum]))
+        self.assertEqual(Document.objects.get(name='doc1.png').get_content()[:4], b'\x89PNG')
+
+        out = StringIO()
+        call_command('documents_gc', grace=0, remove=True, stdout=out)
+        self.assertEqual(out.getvalue().split('\n')[0][:77], "2 blob(s) checked, 0 orphan(s), 0 reference count(s) fixed, 1 missing file(s)")
+
+    def test_version_upload(self):
+        self.create_doc()
+        file_path = join(dirname(__file__), 'static', 'lucterios.documents', 'images', 'documentConf.png')
+        self.factory.xfer = DocumentAddModify()
+        with open(file_path, 'rb') as file_to_load:
+            self.call('/lucterios.documents/documentAddModify', {'SAVE': 'YES', "document": "1", 'description': 'new version',
+                                                                 'filename_FILENAME': 'conf.png', 'filename': file_to_load}, False)
+        self.assert_observer('core.acknowledge', 'lucterios.documents', 'documentAddModify')
+        doc = Document.objects.get(id=1)
+        self.assertEqual(doc.name, 'conf.png')
+        version = DocumentVersion.objects.get(document=doc)
+        self.assertEqual((version.number, version.name, version.modifier), (1, 'doc1.png', None))
+        with open(join(dirname(__file__), 'static', 'lucterios.documents', 'images', 'documentFind.png'), 'rb') as file_to_load:
+            self.assertEqual(version.get_content(), file_to_load.read())
+        self.assertEqual(Blob.objects.get(id=1).nb_reference, 3)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+'''
+thumbnail module of documents
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+from os import rename, unlink, utime
+from os.path import isfile, join
+from io import BytesIO
+from base64 import b64encode
+from zipfile import ZipFile, is_zipfile
+from uuid import uuid4
+
+from django.conf import settings
+
+from lucterios.framework.filetools import get_user_dir, get_user_path, BASE64_PREFIX
+from lucterios.documents.storage import DOCUMENTS_DIR, THUMBNAIL_DIR, evict_cached_files
+from lucterios.documents.container import get_container_header, read_container
+
+THUMBNAIL_SIZES = {
+    'thumbnail': 64,  # in the grid of documents
+    'preview': 400,  # in the document
+}
+
+THUMBNAIL_CACHE_SIZE = 200 * 1024 * 1024  # 200Mo
+if hasattr(settings, 'DOCUMENTS_THUMBNAIL_CACHE_SIZE'):
+    THUMBNAIL_CACHE_SIZE = settings.DOCUMENTS_THUMBNAIL_CACHE_SIZE
+
+THUMBNAIL_MAX_FILE_SIZE = 30 * 1024 * 1024  # 30Mo, bigger images are not decoded
+if hasattr(settings, 'DOCUMENTS_THUMBNAIL_MAX_FILE_SIZE'):
+    THUMBNAIL_MAX_FILE_SIZE = settings.DOCUMENTS_THUMBNAIL_MAX_FILE_SIZE
+
+THUMBNAIL_MAX_AGE = 24 * 60 * 60  # seconds of browser cache
+
+# types decoded by Pillow, no first page preview of PDF without an external renderer
+THUMBNAIL_MIMETYPES = ('image/png', 'image/jpeg', 'image/gif', 'image/bmp', 'image/tiff', 'image/x-ms-bmp')
+
+
+def is_thumbnail_supported(mimetype):
+    return mimetype in THUMBNAIL_MIMETYPES
+
+
+def get_thumbnail_path(checksum, size_name):
+    # named by content: documents with the same file share their thumbnails
+    return get_user_path(join(DOCUMENTS_DIR, THUMBNAIL_DIR), "%s_%s.png" % (checksum, size_name))
+
+
+def get_cached_thumbnail(checksum, size_name):
+    thumbnail_path = get_thumbnail_path(checksum, size_name)
+    try:
+        utime(thumbnail_path, None)
+    except OSError:
+        return None
+    return thumbnail_path
+
+
+def get_thumbnail_base64(thumbnail_path):
+    with open(thumbnail_path, 'rb') as thumbnail_file:
+        return BASE64_PREFIX + b64encode(thumbnail_file.read()).decode('ascii')
+
+
+def open_image_file(blob_path):
+    container_header = get_container_header(blob_path)
+    if container_header is not None:
+        if container_header.content_size > THUMBNAIL_MAX_FILE_SIZE:
+            return None
+        return BytesIO(read_container(blob_path))
+    if is_zipfile(blob_path):
+        with ZipFile(blob_path, 'r') as zip_ref:
+            infos = [info for info in zip_ref.infolist() if not info.filename.endswith('/')]
+            if (len(infos) == 0) or (infos[0].file_size > THUMBNAIL_MAX_FILE_SIZE):
+                return None
+            return BytesIO(zip_ref.read(infos[0]))
+    return open(blob_path, 'rb')
+
+
+def make_thumbnail(blob_path, thumbnail_path, max_size):
+    from PIL import Image
+    image_file = open_image_file(blob_path)
+    if image_file is None:
+        return False
+    with image_file:
+        image = Image.open(image_file)
+        # JPEG decoded directly at a reduced scale
+        image.draft('RGB', (max_size, max_size))
+        if image.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        image.thumbnail((max_size, max_size), Image.ANTIALIAS)
+        tmp_path = "%s.%s.tmp" % (thumbnail_path, uuid4().hex)
+        try:
+            image.save(tmp_path, 'PNG', optimize=True)
+            rename(tmp_path, thumbnail_path)
+        finally:
+            if isfile(tmp_path):
+                unlink(tmp_path)
+    return True
+
+
+def generate_thumbnail(blob_path, checksum, size_name, evict=True):
+    """
+    Path of the thumbnail of a stored image, made if not in the cache yet.
+    None if the file cannot be read as an image.
+    """
+    thumbnail_path = get_cached_thumbnail(checksum, size_name)
+    if thumbnail_path is not None:
+        return thumbnail_path
+    thumbnail_path = get_thumbnail_path(checksum, size_name)
+    try:
+        if not make_thumbnail(blob_path, thumbnail_path, THUMBNAIL_SIZES[size_name]):
+            return None
+    except Exception:
+        return None
+    if evict:
+        evict_thumbnails()
+    return thumbnail_path
+
+
+def evict_thumbnails(cache_size=None):
+    if cache_size is None:
+        cache_size = THUMBNAIL_CACHE_SIZE
+    evict_cached_files(join(get_user_dir(), DOCUMENTS_DIR, THUMBNAIL_DIR), cache_size)
@@ -23,33 +23,40 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import unicode_literals
-from os.path import join, exists
-from os import makedirs, walk
-from shutil import rmtree
-from zipfile import ZipFile
+from logging import getLogger
+from os.path import join, isfile
+from calendar import timegm
+
 
 from django.utils.translation import ugettext_lazy as _
-from django.db.models import Q
+from django.db.models import Q, Case, When, Value, IntegerField
 from django.utils import six
+from django.template.defaultfilters import filesizeformat
 
 from lucterios.framework.xferadvance import XferListEditor, XferDelete, XferAddEditor, XferShowEditor,\
-    TITLE_ADD, TITLE_MODIFY, TITLE_DELETE, TITLE_EDIT, TITLE_CANCEL, TITLE_OK,\
+    TITLE_ADD, TITLE_MODIFY, TITLE_DELETE, TITLE_EDIT, TITLE_CANCEL, TITLE_OK, TITLE_CLOSE,\
     TEXT_TOTAL_NUMBER
-from lucterios.framework.xfersearch import XferSearchEditor
+from lucterios.framework.xfersearch import XferSearchEditor, FieldDescList, FieldDescItem, TYPE_STR, OP_DIFFERENT
 from lucterios.framework.tools import MenuManage, FORMTYPE_NOMODAL, ActionsManage, \
     FORMTYPE_MODAL, CLOSE_NO, FORMTYPE_REFRESH, SELECT_SINGLE, SELECT_NONE, \
-    WrapAction, CLOSE_YES, SELECT_MULTI
+    WrapAction, CLOSE_YES, SELECT_MULTI, ifplural
 from lucterios.framework.xfercomponents import XferCompButton, XferCompLabelForm, \
     XferCompCheckList, XferCompImage, XferCompUpLoad, \
-    XferCompDownLoad
+    XferCompDownLoad, XferCompGrid
 from lucterios.framework.error import LucteriosException, IMPORTANT
 from lucterios.framework import signal_and_lock
-from lucterios.framework.xfergraphic import XferContainerAcknowledge
-from lucterios.framework.filetools import get_tmp_dir, get_user_dir
+from lucterios.framework.xfergraphic import XferContainerAcknowledge, XferContainerCustom
+from lucterios.framework.xferbasic import XferContainerAbstract
+from lucterios.framework.filetools import get_user_dir
 from lucterios.CORE.parameters import notfree_mode_connect
 from lucterios.CORE.models import LucteriosGroup
 
-from lucterios.documents.models import Folder, Document
+from lucterios.documents.models import Folder, Document, FolderAccess, Job, ContentWord, DocumentCounter, DocumentVersion
+from lucterios.documents.storage import FORMAT_ZIP
+from lucterios.documents.download import file_response
+from lucterios.documents.content import content_to_text, diff_texts, get_extension, EXTRACTABLE_EXTENSIONS, DIFF_MAX_FILE_SIZE
+from lucterios.documents.thumbnail import get_thumbnail_base64, is_thumbnail_supported, get_cached_thumbnail, \
+    THUMBNAIL_SIZES, THUMBNAIL_MAX_AGE
 
 MenuManage.add_sub(
     "documents.conf", "core.extensions", "", _("Document"), "", 10)
@@ -142,20 +149,11 @@ class FolderImport(FolderImportExport):
         modifierids = self.getparam("modifier", ())
         if 'zipfile' in self.request.FILES.keys():
             upload_file = self.request.FILES['zipfile']
-            tmp_dir = join(get_tmp_dir(), 'zipfile')
-            if exists(tmp_dir):
-                rmtree(tmp_dir)
-            makedirs(tmp_dir)
-            try:
-                with ZipFile(upload_file, 'r') as zip_ref:
-                    zip_ref.extractall(tmp_dir)
-                viewers = LucteriosGroup.objects.filter(id__in=viewerids)
-                modifiers = LucteriosGroup.objects.filter(id__in=modifierids)
-                self.item.import_files(
-                    tmp_dir, viewers, modifiers, self.request.user)
-            finally:
-                if exists(tmp_dir):
-                    rmtree(tmp_dir)
+            Folder.check_quota(self.item.id, upload_file.size)
+            viewers = LucteriosGroup.objects.filter(id__in=viewerids)
+            modifiers = LucteriosGroup.objects.filter(id__in=modifierids)
+            job = Job.add_import(self.item, upload_file, viewers, modifiers, self.request.user)
+            self.redirect_action(JobShow.get_action(), modal=FORMTYPE_MODAL, close=CLOSE_YES, params={'job': six.text_type(job.id)})
 
 
 @ActionsManage.affect_grid(_("Extract"), "zip.png", unique=SELECT_NONE)
@@ -163,43 +161,90 @@ class FolderImport(FolderImportExport):
 class FolderExtract(FolderImportExport):
     caption = _("Extract")
 
-    def open_zipfile(self, filename):
-        dlg = self.create_custom()
-        dlg.item = self.item
+    def run_archive(self):
+        job = Job.add_extract(self.item, self.request.user)
+        self.redirect_action(JobShow.get_action(), modal=FORMTYPE_MODAL, close=CLOSE_YES, params={'job': six.text_type(job.id)})
+
+
+def check_job_owner(xfer):
+    if (xfer.item.user_id != xfer.request.user.id) and not xfer.request.user.is_superuser:
+        raise LucteriosException(IMPORTANT, _("No allow to view!"))
+
+
+@MenuManage.describ('documents.add_folder')
+class JobShow(XferContainerCustom):
+    caption = _("Import/Extract")
+    icon = "documentConf.png"
+    model = Job
+    field_id = 'job'
+
+    def add_label(self, name, title, value, row):
+        lbl = XferCompLabelForm('lbl' + name)
+        lbl.set_value_as_name(title)
+        lbl.set_location(1, row)
+        self.add_component(lbl)
+        lbl = XferCompLabelForm(name)
+        lbl.set_value(value)
+        lbl.set_location(2, row)
+        self.add_component(lbl)
+
+    def fillresponse(self):
+        check_job_owner(self)
         img = XferCompImage('img')
         img.set_value(self.icon_path())
         img.set_location(0, 0, 1, 3)
-        dlg.add_component(img)
+        self.add_component(img)
         lbl = XferCompLabelForm('title')
-        lbl.set_value_as_title(self.caption)
-        lbl.set_location(1, 0, 6)
-        dlg.add_component(lbl)
-        zipdown = XferCompDownLoad('filename')
-        zipdown.compress = False
-        zipdown.http_file = True
-        zipdown.maxsize = 0
-        zipdown.set_value(filename)
-        zipdown.set_download(filename)
-        zipdown.set_location(1, 15, 2)
-        dlg.add_component(zipdown)
+        lbl.set_value_as_title(self.item.get_kind_display())
+        lbl.set_location(1, 0, 2)
+        self.add_component(lbl)
+        if self.item.folder_id is None:
+            self.add_label('folder', _('folder'), '>', 1)
+        else:
+            self.add_label('folder', _('folder'), self.item.folder.get_title(), 1)
+        self.add_label('status', _('status'), self.item.get_status_display(), 2)
+        self.add_label('files', _('files done'), "%d / %d" % (self.item.nb_files_done, self.item.nb_files), 3)
+        self.add_label('size', _('size done'), "%s / %s" % (filesizeformat(self.item.size_done), filesizeformat(self.item.size)), 4)
+        eta = self.item.get_eta()
+        if eta is not None:
+            self.add_label('eta', _('remaining time'), "%d:%02d:%02d" % (eta // 3600, (eta // 60) % 60, eta % 60), 5)
+        if self.item.message != '':
+            self.add_label('message', _('message'), self.item.message, 6)
+        if self.item.is_downloadable():
+            zipdown = XferCompDownLoad('filename')
+            zipdown.compress = False
+            zipdown.http_file = True
+            zipdown.maxsize = 0
+            zipdown.set_value('extract.zip')
+            zipdown.set_filename("%s?job=%d" % (JobDownload.url_text, self.item.id))
+            zipdown.set_location(1, 15, 2)
+            self.add_component(zipdown)
+        if self.item.status in (Job.STATUS_WAITING, Job.STATUS_RUNNING):
+            self.add_action(self.get_action(_('Refresh'), 'images/refresh.png'), modal=FORMTYPE_REFRESH, close=CLOSE_NO)
+        self.add_action(WrapAction(TITLE_CLOSE, 'images/close.png'))
 
-    def run_archive(self):
-        tmp_dir = join(get_tmp_dir(), 'zipfile')
-        download_file = join(get_user_dir(), 'extract.zip')
-        if exists(tmp_dir):
-            rmtree(tmp_dir)
-        makedirs(tmp_dir)
+
+@MenuManage.describ('documents.add_folder')
+class JobDownload(XferContainerAbstract):
+    caption = _("Extract")
+    icon = "documentConf.png"
+    model = Job
+    field_id = 'job'
+
+    def get(self, request, *args, **kwargs):
+        getLogger("lucterios.core.request").debug(
+            ">> get %s [%s]", request.path, request.user)
         try:
-            self.item.extract_files(tmp_dir)
-            with ZipFile(download_file, 'w') as zip_ref:
-                for (dirpath, _dirs, filenames) in walk(tmp_dir):
-                    for filename in filenames:
-                        zip_ref.write(
-                            join(dirpath, filename), join(dirpath[len(tmp_dir):], filename))
+            self._initialize(request, *args, **kwargs)
+            check_job_owner(self)
+            if not self.item.is_downloadable():
+                raise LucteriosException(IMPORTANT, _("File not found!"))
+            last_modified = timegm(self.item.date_end.utctimetuple())
+            return file_response(request, join(get_user_dir(), self.item.get_file_name()), 'application/zip', 'extract.zip',
+                                 "job-%d-%d" % (self.item.id, last_modified), last_modified)
         finally:
-            if exists(tmp_dir):
-                rmtree(tmp_dir)
-        self.open_zipfile('extract.zip')
+            getLogger("lucterios.core.request").debug(
+                "<< get %s [%s]", request.path, request.user)
 
 MenuManage.add_sub("office", None, "lucterios.documents/images/office.png", _("Office"), _("Office tools"), 70)
 
@@ -277,15 +322,15 @@ class DocumentList(XferListEditor):
         else:
             folder_filter = Q(parent=None)
         if notfree_mode_connect() and not self.request.user.is_superuser:
-            folder_filter &= Q(viewer__in=self.request.user.groups.all())
+            folder_filter &= Q(viewer__in=FolderAccess.for_request(self.request).group_ids)
         folder_list = Folder.objects.filter(folder_filter).order_by("name").distinct()
         for folder_item in folder_list:
             list_folders.append((folder_item.id, folder_item.name))
         if folder_obj is not None:
-            if folder_obj.parent is None:
+            if folder_obj.parent_id is None:
                 parent_id = 0
             else:
-                parent_id = folder_obj.parent.id
+                parent_id = folder_obj.parent_id
             list_folders.insert(0, (parent_id, '..'))
         select = XferCompCheckList('current_folder')
         select.simple = True
@@ -295,27 +340,38 @@ class DocumentList(XferListEditor):
         self.add_component(select)
 
         self.add_folder_buttons(new_col, new_row)
+        self.add_thumbnails(obj_doc)
+
+    def add_thumbnails(self, grid):
+        # only thumbnails already made: they are generated by the documents_thumbnails command or by the jobs queued when documents are shown
+        grid.add_header('thumbnail', _('preview'), 'icon')
+        for doc_id, checksum, mimetype in Document.objects.filter(id__in=grid.record_ids).values_list('id', 'checksum', 'mimetype'):
+            thumbnail_path = None
+            if is_thumbnail_supported(mimetype):
+                thumbnail_path = get_cached_thumbnail(checksum, 'thumbnail')
+            if thumbnail_path is not None:
+                grid.set_value(doc_id, 'thumbnail', get_thumbnail_base64(thumbnail_path))
+            else:
+                grid.set_value(doc_id, 'thumbnail', '')
 
 
 def docgrid_modify_condition(xfer, gridname=''):
     current_folder = xfer.getparam('current_folder', 0)
-    if current_folder > 0:
-        folder_obj = Folder.objects.get(id=current_folder)
-    else:
-        folder_obj = None
-    if folder_obj is not None and notfree_mode_connect() and not xfer.request.user.is_superuser:
-        if folder_obj.cannot_view(xfer.request.user):
+    if current_folder > 0 and notfree_mode_connect() and not xfer.request.user.is_superuser:
+        access = FolderAccess.for_request(xfer.request)
+        if access.cannot_view(current_folder):
             raise LucteriosException(IMPORTANT, _("No allow to view!"))
-        if folder_obj.is_readonly(xfer.request.user):
+        if access.is_readonly(current_folder):
             return False
     return True
 
 
 def docshow_modify_condition(xfer):
-    if xfer.item.folder is not None and notfree_mode_connect() and not xfer.request.user.is_superuser:
-        if xfer.item.folder.cannot_view(xfer.request.user):
+    if xfer.item.folder_id is not None and notfree_mode_connect() and not xfer.request.user.is_superuser:
+        access = FolderAccess.for_request(xfer.request)
+        if access.cannot_view(xfer.item.folder_id):
             raise LucteriosException(IMPORTANT, _("No allow to view!"))
-        if xfer.item.folder.is_readonly(xfer.request.user):
+        if access.is_readonly(xfer.item.folder_id):
             return False
     return True
 
@@ -340,10 +396,11 @@ class DocumentAddModify(XferAddEditor):
         return self.has_changed
 
     def fillresponse(self):
-        if self.item.folder is not None and notfree_mode_connect() and not self.request.user.is_superuser:
-            if self.item.folder.cannot_view(self.request.user):
+        if self.item.folder_id is not None and notfree_mode_connect() and not self.request.user.is_superuser:
+            access = FolderAccess.for_request(self.request)
+            if access.cannot_view(self.item.folder_id):
                 raise LucteriosException(IMPORTANT, _("No allow to view!"))
-            if self.item.folder.is_readonly(self.request.user):
+            if access.is_readonly(self.item.folder_id):
                 raise LucteriosException(IMPORTANT, _("No allow to write!"))
         XferAddEditor.fillresponse(self)
 
@@ -357,6 +414,135 @@ class DocumentShow(XferShowEditor):
     field_id = 'document'
 
 
+def check_document_view(xfer):
+    if xfer.item.folder_id is not None and notfree_mode_connect() and not xfer.request.user.is_superuser:
+        if FolderAccess.for_request(xfer.request).cannot_view(xfer.item.folder_id):
+            raise LucteriosException(IMPORTANT, _("No allow to view!"))
+
+
+@MenuManage.describ('documents.change_document')
+class DocumentDownload(XferContainerAbstract):
+    caption = _("Show document")
+    icon = "document.png"
+    model = Document
+    field_id = 'document'
+
+    def get(self, request, *args, **kwargs):
+        getLogger("lucterios.core.request").debug(
+            ">> get %s [%s]", request.path, request.user)
+        try:
+            self._initialize(request, *args, **kwargs)
+            check_document_view(self)
+            if (self.item.blob is None) or not isfile(self.item.blob.get_path()):
+                raise LucteriosException(IMPORTANT, _("File not found!"))
+            last_modified = timegm(self.item.date_modification.utctimetuple())
+            if self.item.checksum != '':
+                etag = self.item.checksum
+            else:
+                etag = "%d-%d" % (self.item.id, last_modified)
+            # the client gets the content itself, whatever its storage
+            content_type = self.item.mimetype or 'application/octet-stream'
+            return file_response(request, self.item.blob.get_path(), content_type, self.item.name, etag, last_modified,
+                                 member=(self.item.storage_format == FORMAT_ZIP))
+        finally:
+            getLogger("lucterios.core.request").debug(
+                "<< get %s [%s]", request.path, request.user)
+
+
+@MenuManage.describ('documents.change_document')
+class DocumentThumbnail(XferContainerAbstract):
+    caption = _("Show document")
+    icon = "document.png"
+    model = Document
+    field_id = 'document'
+
+    def get(self, request, *args, **kwargs):
+        getLogger("lucterios.core.request").debug(
+            ">> get %s [%s]", request.path, request.user)
+        try:
+            self._initialize(request, *args, **kwargs)
+            check_document_view(self)
+            size_name = self.getparam('size', 'preview')
+            if size_name not in THUMBNAIL_SIZES:
+                size_name = 'preview'
+            thumbnail_path = self.item.get_thumbnail(size_name)
+            if (thumbnail_path is None) and (self.item.blob_id is not None) and is_thumbnail_supported(self.item.mimetype):
+                Job.add_thumbnail(self.item, request.user)
+                raise LucteriosException(IMPORTANT, _("Preview in preparation"))
+            if (thumbnail_path is None) or not isfile(thumbnail_path):
+                raise LucteriosException(IMPORTANT, _("No preview for this document!"))
+            last_modified = timegm(self.item.date_modification.utctimetuple())
+            response = file_response(request, thumbnail_path, 'image/png', "%s.png" % self.item.name, "%s-%s" % (self.item.checksum, size_name),
+                                     last_modified, attachment=False)
+            response['Cache-Control'] = 'private, max-age=%d' % THUMBNAIL_MAX_AGE
+            return response
+        finally:
+            getLogger("lucterios.core.request").debug(
+                "<< get %s [%s]", request.path, request.user)
+
+
+@ActionsManage.affect_grid(_("Differences"), "images/show.png", unique=SELECT_SINGLE)
+@MenuManage.describ('documents.change_document')
+class DocumentVersionDiff(XferContainerCustom):
+    caption = _("Differences")
+    icon = "document.png"
+    model = DocumentVersion
+    field_id = 'documentversion'
+
+    def fillresponse(self):
+        if self.item.document.folder_id is not None and notfree_mode_connect() and not self.request.user.is_superuser:
+            if FolderAccess.for_request(self.request).cannot_view(self.item.document.folder_id):
+                raise LucteriosException(IMPORTANT, _("No allow to view!"))
+        img = XferCompImage('img')
+        img.set_value(self.icon_path())
+        img.set_location(0, 0)
+        self.add_component(img)
+        old_name = "%s #%d" % (self.item.name, self.item.number)
+        next_item = self.item.get_next()
+        new_name = next_item.name
+        lbl = XferCompLabelForm('title')
+        lbl.set_value_as_title("%s => %s" % (old_name, new_name))
+        lbl.set_location(1, 0)
+        self.add_component(lbl)
+        sizes = {'old': filesizeformat(self.item.size), 'new': filesizeformat(next_item.size)}
+        if self.item.checksum == next_item.checksum:
+            diff_lines = []
+        elif (get_extension(self.item.name) not in EXTRACTABLE_EXTENSIONS) or (get_extension(new_name) not in EXTRACTABLE_EXTENSIONS):
+            diff_lines = [_("Binary contents differ (%(old)s => %(new)s)") % sizes]
+        elif max(self.item.size, next_item.size) > DIFF_MAX_FILE_SIZE:
+            # contents read in memory to be compared
+            diff_lines = [_("Contents too big to be compared (%(old)s => %(new)s)") % sizes]
+        else:
+            diff_lines = diff_texts(content_to_text(self.item.get_content(), self.item.name), content_to_text(next_item.get_content(), new_name),
+                                    old_name, new_name)
+        if len(diff_lines) == 0:
+            diff_lines = [_("No difference")]
+        lbl = XferCompLabelForm('diff')
+        lbl.set_value("{[br/]}".join(diff_lines))
+        lbl.set_location(1, 1)
+        self.add_component(lbl)
+        self.add_action(WrapAction(TITLE_CLOSE, 'images/close.png'))
+
+
+@ActionsManage.affect_grid(_("Restore"), "images/ok.png", unique=SELECT_SINGLE)
+@MenuManage.describ('documents.add_document')
+class DocumentVersionRestore(XferContainerAcknowledge):
+    caption = _("Restore")
+    icon = "document.png"
+    model = DocumentVersion
+    field_id = 'documentversion'
+
+    def fillresponse(self):
+        if self.item.document.folder_id is not None and notfree_mode_connect() and not self.request.user.is_superuser:
+            access = FolderAccess.for_request(self.request)
+            if access.cannot_view(self.item.document.folder_id):
+                raise LucteriosException(IMPORTANT, _("No allow to view!"))
+            if access.is_readonly(self.item.document.folder_id):
+                raise LucteriosException(IMPORTANT, _("No allow to write!"))
+        if self.confirme(_("Do you want to restore the version %d of this document?") % self.item.number):
+            self.item.restore(self.request.user)
+
+
 @ActionsManage.affect_grid(TITLE_DELETE, "images/delete.png", unique=SELECT_MULTI, condition=docgrid_modify_condition)
 @MenuManage.describ('documents.delete_document')
 class DocumentDel(XferDelete):
@@ -366,15 +552,56 @@ class DocumentDel(XferDelete):
     field_id = 'document'
 
     def fillresponse(self):
-        folder = None
-        if len(self.items) > 0:
-            folder = self.items[0].folder
-        if folder is not None and notfree_mode_connect() and not self.request.user.is_superuser:
-            if folder.cannot_view(self.request.user):
-                raise LucteriosException(IMPORTANT, _("No allow to view!"))
-            if folder.is_readonly(self.request.user):
-                raise LucteriosException(IMPORTANT, _("No allow to write!"))
-        XferDelete.fillresponse(self)
+        if notfree_mode_connect() and not self.request.user.is_superuser:
+            folder_ids = set([item.folder_id for item in self.items if item.folder_id is not None])
+            access = FolderAccess.for_request(self.request)
+            access.load(folder_ids)
+            for folder_id in folder_ids:
+                if access.cannot_view(folder_id):
+                    raise LucteriosException(IMPORTANT, _("No allow to view!"))
+                if access.is_readonly(folder_id):
+                    raise LucteriosException(IMPORTANT, _("No allow to write!"))
+        if len(self.items) > 1:
+            # one transaction for the selection, the files are unlinked later by the jobs worker
+            if self.confirme(ifplural(len(self.items), _("Do you want delete this %(name)s ?") % {'name': self.model._meta.verbose_name},
+                                      _("Do you want delete those %(nb)s %(name)s ?") % {'nb': len(self.items), 'name': self.model._meta.verbose_name_plural})):
+                Document.delete_all(self.items.values_list('id', flat=True))
+        else:
+            XferDelete.fillresponse(self)
+
+
+class ContentFieldDesc(FieldDescItem):
+    """
+    Search criterion on the indexed content of documents.
+    All matching documents are found, the ranks of the best ones are kept to sort the result.
+    """
+
+    def __init__(self):
+        FieldDescItem.__init__(self, 'content')
+        self.ranks = None
+
+    def init(self, model):
+        self.description = _('content')
+        self.field_type = TYPE_STR
+        return True
+
+    def get_query(self, value, operation):
+        matching_ids = ContentWord.get_matching_documents(value)
+        if operation == int(OP_DIFFERENT[0]):
+            return ~Q(id__in=matching_ids)
+        found_ranks = dict(ContentWord.search(value))
+        if self.ranks is None:
+            self.ranks = found_ranks
+        else:
+            self.ranks = dict([(doc_id, rank + self.ranks[doc_id]) for doc_id, rank in found_ranks.items() if doc_id in self.ranks])
+        return Q(id__in=matching_ids)
+
+
+class DocumentFieldDescList(FieldDescList):
+
+    def initial(self, model):
+        FieldDescList.initial(self, model)
+        self.field_desc_list.append(ContentFieldDesc())
 
 
 @MenuManage.describ('documents.change_document', FORMTYPE_NOMODAL, 'documents.actions', _('To find a document following a set of criteria.'))
@@ -384,14 +611,36 @@ class DocumentSearch(XferSearchEditor):
     model = Document
     field_id = 'document'
 
+    def __init__(self):
+        XferSearchEditor.__init__(self)
+        self.fields_desc = DocumentFieldDescList()
+
     def get_text_search(self):
         criteria_desc = XferSearchEditor.get_text_search(self)
         if notfree_mode_connect():
             if self.filter is None:
                 self.filter = Q()
-            self.filter = self.filter & (Q(folder=None) | Q(folder__viewer__in=self.request.user.groups.all()))
+            self.filter = self.filter & (Q(folder=None) | Q(folder__viewer__in=FolderAccess.for_request(self.request).group_ids))
         return criteria_desc
 
+    def fillresponse(self):
+        XferSearchEditor.fillresponse(self)
+        ranks = self.fields_desc.get('content').ranks
+        if (ranks is not None) and (len(ranks) > 0):
+            # best ranked documents first, then the other matching ones
+            old_grid = self.get_components(self.field_id)
+            self.remove_component(self.field_id)
+            rank_order = sorted(ranks.keys(), key=lambda doc_id: (-ranks[doc_id], doc_id))
+            self.items = self.items.annotate(content_rank=Case(*[When(id=doc_id, then=Value(rank_idx)) for rank_idx, doc_id in enumerate(rank_order)],
+                                                               default=Value(len(rank_order)), output_field=IntegerField())).order_by('content_rank')
+            grid = XferCompGrid(self.field_id)
+            grid.set_model(self.items, self.fieldnames, self)
+            grid.add_actions(self, action_list=self.action_grid)
+            grid.add_action_notified(self)
+            grid.set_location(old_grid.col, old_grid.row, old_grid.colspan)
+            grid.set_size(200, 500)
+            self.add_component(grid)
+
 
 @signal_and_lock.Signal.decorate('summary')
 def summary_documents(xfer):
@@ -401,12 +650,10 @@ def summary_documents(xfer):
         lab.set_value_as_infocenter(_('Document management'))
         lab.set_location(0, row, 4)
         xfer.add_component(lab)
-        filter_result = Q()
         if notfree_mode_connect():
-            filter_result = filter_result & (
-                Q(folder=None) | Q(folder__viewer__in=xfer.request.user.groups.all()))
-        nb_doc = len(Document.objects.filter(
-            *[filter_result]))
+            nb_doc = DocumentCounter.count(FolderAccess.for_request(xfer.request).group_ids)
+        else:
+            nb_doc = DocumentCounter.count()
         lbl_doc = XferCompLabelForm('lbl_nbdocument')
         lbl_doc.set_location(0, row + 1, 4)
         if nb_doc == 0:
@@ -433,11 +680,11 @@ def conf_wizard_document(wizard_ident, xfer):
         xfer.add_title(_("Lucterios documents"), _("Parameters"))
         lbl = XferCompLabelForm("nb_folder")
         lbl.set_location(1, xfer.get_max_row() + 1)
-        lbl.set_value(TEXT_TOTAL_NUMBER % {'name': Folder._meta.verbose_name_plural, 'count': len(Folder.objects.all())})
+        lbl.set_value(TEXT_TOTAL_NUMBER % {'name': Folder._meta.verbose_name_plural, 'count': Folder.objects.count()})
         xfer.add_component(lbl)
         lbl = XferCompLabelForm("nb_doc")
         lbl.set_location(1, xfer.get_max_row() + 1)
-        lbl.set_value(TEXT_TOTAL_NUMBER % {'name': Document._meta.verbose_name_plural, 'count': len(Document.objects.all())})
+        lbl.set_value(TEXT_TOTAL_NUMBER % {'name': Document._meta.verbose_name_plural, 'count': DocumentCounter.count()})
         xfer.add_component(lbl)
         btn = XferCompButton("btnconf")
         btn.set_location(4, xfer.get_max_row() - 1, 1, 2)